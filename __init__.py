@@ -14,6 +14,23 @@ from .listener import Listener as event
 from .pairing import Pairing as pairing
 from .heartbeat import Heartbeat as heartbeat
 from .httpserver import HTTPServer as server
+from .metrics import Metrics as metrics
+from .monitor import Monitor as monitor, create_task
+from .heap import Heap as heap
+from .ratelimit import RateLimit as ratelimit
+from .relay import Relay as relay
+from .peers import Peers as peers
+from .fragments import Fragments as fragments
+from .history import History as history
+from .aggregate import Aggregate as aggregate
+from .transmitter import Transmitter as tx
+from .feedback import Feedback as feedback
+from .rpc import RPC as rpc
+from .outbox import Outbox as outbox
+from .bridge import Bridge as bridge
+from .transport import ESPNow, UDP, Loopback
+from .clock import Clock as clock
+from .loadtest import LoadTest as loadtest
 import aioespnow as espnow
 import aiorepl
 
@@ -28,39 +45,107 @@ async def init():
     preferences = dict(ap_boot=False, ap_ssid=None, ap_key='inovator', ap_color=None, ap_color_code=None, ap_ch=13,
                        sta_boot=True, sta_reconnect=False, sta_reconnects=-1, sta_ch=13, sta_hostname=None,
                        sta_ssid=None, sta_key=None,
-                       ch_update=False, ch_reset=True, )
+                       ch_update=False, ch_reset=True,
+                       metrics=False, monitor=False, monitor_ms=100, monitor_stall_ms=50,
+                       heap=False, heap_low=0,
+                       rl=False, rl_rate=20, rl_burst=40, rl_block_ms=30000, rl_block_after=100,
+                       relay=False, relay_ttl=3,
+                       peers=False, peers_max=16,
+                       frag_buffer=2048, frag_timeout_ms=3000,
+                       history=False, history_size=32, history_slot=64,
+                       tx_queue=16, tx_inflight=2, tx_pace_ms=0,
+                       groups=[],
+                       outbox=False, outbox_size=8192, outbox_ttl_s=86400, outbox_pace_ms=20, outbox_probe_ms=30000,
+                       bridge=False, bridge_host=None, bridge_port=4210, bridge_mqtt=False, bridge_flush_ms=1000,
+                       bridge_batch=1024,
+                       udp=False, udp_group='239.70.73.76', udp_port=4211,
+                       clock=False, clock_ping_ms=10000, )
 
     global settings
     settings = settings()
 
+    global monitor
+    monitor = monitor()
+
+    global heap
+    heap = heap()
+
     global cyberware
     cyberware = cyberware()
 
+    global feedback
+    feedback = feedback()
+
     global network
     network = network()
 
     global event
     event = event()
 
+    global tx
+    tx = tx()
+
+    global rpc
+    rpc = rpc()
+
+    global outbox
+    outbox = outbox()
+
+    global ratelimit
+    ratelimit = ratelimit()
+
+    global relay
+    relay = relay()
+
+    global peers
+    peers = peers()
+
+    global fragments
+    fragments = fragments()
+
+    global history
+    history = history()
+
+    global aggregate
+    aggregate = aggregate()
+
     global pairing
     pairing = pairing()
 
     global heartbeat
     heartbeat = heartbeat()
 
+    global clock
+    clock = clock()
+
     global server
     server = server()
 
+    global bridge
+    bridge = bridge()
+
+    global loadtest
+    loadtest = loadtest()
+
+    global metrics
+    metrics = metrics()
+
     global espnow
     espnow = espnow.AIOESPNow()
     espnow.active(True)
+    event.add_transport(ESPNow(espnow))
+    if preferences['udp']:
+        event.add_transport(UDP())
+    if peers.enabled:
+        peers.pin(cyberware.mac_public)
 
-    asyncio.create_task(aiorepl.task())
+    # REPL task, cancelled in low memory mode.
+    global repl
+    repl = create_task(aiorepl.task(), 'aiorepl')
 
     # Notify the user that the cyberos is ready.
-    await cyberware.pixel.set_color(color=cyberware.pixel.C_GREEN)
-    await asyncio.sleep(0)  # Fix for first tones play far too long.
-    await cyberware.buzzer.play(index=0)
+    feedback.color(cyberware.pixel.C_GREEN)
+    feedback.tone(0)
 
 
 async def run_forever():
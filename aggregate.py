@@ -0,0 +1,137 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS AGGREGATE
+#
+# Windowed aggregation and downsampling of numeric sensor events.
+
+import uasyncio as asyncio
+from uasyncio import Event
+from array import array
+from utime import ticks_ms, ticks_diff, ticks_add
+import fildz_cyberos as cyberos
+from .monitor import create_task
+
+# Accumulator values per slot.
+_MIN = 0
+_MAX = 1
+_SUM = 2
+_LAST = 3
+_VALUES = 4
+
+
+class Aggregate:
+    _SLOTS = 8  # Number of aggregated (sender, event) pairs.
+
+    def __init__(self):
+        self._slots = {}  # Sender name to {event name: slot}.
+        self._keys = [None] * self._SLOTS  # (Sender name, event name) per slot.
+        self._index = array('B', [0] * self._SLOTS)  # Aggregated arg index.
+        self._windows = array('L', [0] * self._SLOTS)  # Window length in ms.
+        self._ends = array('L', [0] * self._SLOTS)  # ticks_ms() the window ends at.
+        self._counts = array('L', [0] * self._SLOTS)
+        self._values = array('f', [0] * (self._SLOTS * _VALUES))
+
+        self._on_add = Event()
+        create_task(self._event_flush(), 'aggregate.flush')
+
+    ################################################################################
+    # Properties
+    #
+    # Any (sender, event) pair is aggregated.
+    @property
+    def active(self):
+        return len(self._slots) > 0
+
+    ################################################################################
+    # Configuration
+    #
+    # Aggregate the arg of the event over the window, handlers get one event per window
+    # with args (min, max, mean, count, last), e.g. "cyberos.aggregate.add('SENSOR-0F889A-ABW', 'on_temp', 60000)".
+    def add(self, cyberware, event_name, window_ms, index=0):
+        self.remove(cyberware, event_name)
+        for slot in range(self._SLOTS):
+            if self._keys[slot] is None:
+                break
+        else:
+            raise ValueError('No free aggregate slots')
+        self._keys[slot] = (cyberware, event_name)
+        self._index[slot] = index
+        self._windows[slot] = window_ms
+        self._counts[slot] = 0
+        if cyberware not in self._slots:
+            self._slots[cyberware] = {}
+        self._slots[cyberware][event_name] = slot
+        self._on_add.set()
+
+    def remove(self, cyberware, event_name):
+        slot = self._slots.get(cyberware, {}).pop(event_name, None)
+        if slot is None:
+            return
+        if not len(self._slots[cyberware]):
+            del self._slots[cyberware]
+        self._keys[slot] = None
+
+    ################################################################################
+    # Pipeline
+    #
+    # Samples of aggregated events reach handlers and waiters once per window only.
+    def aggregated(self, cyberware, event_name):
+        return cyberware in self._slots and event_name in self._slots[cyberware]
+
+    # Accumulate the event, returns False if the event is not aggregated and must be fired.
+    def feed(self, cyberware, event_name, args):
+        if cyberware not in self._slots or event_name not in self._slots[cyberware]:
+            return False
+        slot = self._slots[cyberware][event_name]
+        try:
+            value = float(args[self._index[slot]])
+        except (IndexError, ValueError, TypeError):
+            return False
+        base = slot * _VALUES
+        if not self._counts[slot]:
+            self._values[base + _MIN] = value
+            self._values[base + _MAX] = value
+            self._values[base + _SUM] = 0
+            self._ends[slot] = ticks_add(ticks_ms(), self._windows[slot])
+        elif value < self._values[base + _MIN]:
+            self._values[base + _MIN] = value
+        elif value > self._values[base + _MAX]:
+            self._values[base + _MAX] = value
+        self._values[base + _SUM] += value
+        self._values[base + _LAST] = value
+        self._counts[slot] += 1
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('aggregated')
+        return True
+
+    ################################################################################
+    # Tasks
+    #
+    # Emit one aggregated event per window.
+    async def _event_flush(self):
+        while True:
+            if not self.active:
+                self._on_add.clear()
+                await self._on_add.wait()
+            now = ticks_ms()
+            wait = 1000
+            for slot in range(self._SLOTS):
+                if self._keys[slot] is None or not self._counts[slot]:
+                    continue
+                left = ticks_diff(self._ends[slot], now)
+                if left > 0:
+                    if left < wait:
+                        wait = left
+                    continue
+                base = slot * _VALUES
+                count = self._counts[slot]
+                self._counts[slot] = 0
+                cyberware, event_name = self._keys[slot]
+                await cyberos.event.emit(cyberware, event_name, [self._values[base + _MIN],
+                                                                 self._values[base + _MAX],
+                                                                 self._values[base + _SUM] / count,
+                                                                 count,
+                                                                 self._values[base + _LAST]])
+            await asyncio.sleep_ms(wait)
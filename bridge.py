@@ -0,0 +1,277 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS BRIDGE
+#
+# ESP-NOW events batched to a UDP or MQTT backend over STA, backend commands sent back as events.
+
+# Uplink datagram or MQTT message: b'FZ', version, then events as
+# B len sender, B len name, B args count and args as B len + bytes.
+# Downlink datagram or MQTT message: b'FZ', version, then commands as
+# B len receiver ('' all subscribers, '@group' or cyberware name), B len name, B args count and args.
+# A local stand-in for the backend is enough to try it, e.g. "nc -ul 4210" on the host set in "bridge_host".
+# umqtt.simple calls block the event loop, the MQTT socket timeout bounds every call to _TIMEOUT_S.
+# connect() can only be bounded by umqtt.simple versions with its timeout argument.
+
+import usocket as socket
+import uasyncio as asyncio
+from utime import ticks_ms, ticks_diff
+import fildz_cyberos as cyberos
+from .monitor import create_task
+
+_MAGIC = b'FZ\x01'
+
+
+class Bridge:
+    _TICK_MS = 50  # Downlink poll interval.
+    _BACKOFF = 8  # Longest flush retry interval in flush intervals.
+    _TIMEOUT_S = 1  # Longest time an MQTT call may block.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['bridge']
+        self._host = cyberos.preferences['bridge_host']
+        self._port = cyberos.preferences['bridge_port']
+        self._mqtt = cyberos.preferences['bridge_mqtt']  # MQTT broker instead of plain UDP.
+        self._flush_ms = cyberos.preferences['bridge_flush_ms']
+
+        self._batch = bytearray(cyberos.preferences['bridge_batch'])  # Uplink batch, allocated once.
+        self._view = memoryview(self._batch)
+        self._length = len(_MAGIC)
+        self._batch[:self._length] = _MAGIC
+        self._count = 0  # Events in the batch.
+        self._addr = None
+        self._sock = None
+        self._client = None
+        self._topic = None  # MQTT uplink topic.
+        self._commands = []  # Downlink commands as (receiver, name, args).
+        self._failures = 0  # Failed flushes in a row.
+        self._up = 0
+        self._down = 0
+        self._dropped = 0
+
+        if self._enabled:
+            create_task(self._event_uplink(), 'bridge.uplink')
+            create_task(self._event_bridge(), 'bridge.bridge')
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    # Takes effect on the next reboot.
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['bridge'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def connected(self):
+        return self._sock is not None or self._client is not None
+
+    # Events sent to the backend.
+    @property
+    def up(self):
+        return self._up
+
+    # Commands received from the backend.
+    @property
+    def down(self):
+        return self._down
+
+    # Events dropped because the uplink was too slow.
+    @property
+    def dropped(self):
+        return self._dropped
+
+    ################################################################################
+    # Connection
+    #
+    def _connect(self):
+        self._addr = socket.getaddrinfo(self._host, self._port)[0][-1]
+        if self._mqtt:
+            try:
+                from umqtt.simple import MQTTClient
+            except ImportError:
+                print('CYBEROS > Bridge needs umqtt.simple for MQTT')
+                self._enabled = False
+                return
+            topic = 'fildz/%s/' % cyberos.network.ap_ssid
+            self._client = MQTTClient(cyberos.network.ap_ssid, self._host, self._port, keepalive=60)
+            self._client.set_callback(self._on_message)
+            try:
+                self._client.connect(timeout=self._TIMEOUT_S)
+            except TypeError:
+                self._client.connect()  # Older umqtt.simple without the timeout argument.
+            self._client.sock.settimeout(self._TIMEOUT_S)
+            self._client.subscribe(topic + 'down')
+            self._topic = topic + 'up'
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind(('0.0.0.0', self._port))
+            self._sock.setblocking(False)
+        print('CYBEROS > Bridge connected to {}:{}'.format(self._host, self._port))
+
+    def _disconnect(self):
+        try:
+            if self._client is not None:
+                self._client.disconnect()
+            if self._sock is not None:
+                self._sock.close()
+        except OSError:
+            pass
+        self._client = None
+        self._sock = None
+
+    ################################################################################
+    # Uplink
+    #
+    # Append the event to the batch, False if there is no room.
+    def _append(self, sender, name, args):
+        # Typed args (see Listener.schema) are sent as text.
+        args = [arg.encode() if isinstance(arg, str) else arg if isinstance(arg, (bytes, bytearray, memoryview))
+                else str(arg).encode() for arg in args]
+        n = 3 + len(sender) + len(name)
+        for arg in args:
+            if len(arg) > 255:
+                return False  # Reassembled fragmented args do not fit the batch format.
+            n += 1 + len(arg)
+        if self._length + n > len(self._batch) or len(args) > 255:
+            return False
+        view = self._view
+        offset = self._length
+        for field in (sender, name):
+            field = field.encode()
+            view[offset] = len(field)
+            view[offset + 1:offset + 1 + len(field)] = field
+            offset += 1 + len(field)
+        view[offset] = len(args)
+        offset += 1
+        for arg in args:
+            view[offset] = len(arg)
+            view[offset + 1:offset + 1 + len(arg)] = arg
+            offset += 1 + len(arg)
+        self._length = offset
+        self._count += 1
+        return True
+
+    def _flush(self):
+        if not self._count:
+            return True
+        try:
+            if self._client is not None:
+                self._client.sock.settimeout(self._TIMEOUT_S)  # check_msg() leaves the socket blocking.
+                self._client.publish(self._topic, self._view[:self._length])
+            else:
+                self._sock.sendto(self._view[:self._length], self._addr)
+        except OSError:
+            if self._client is not None:
+                self._disconnect()  # Message may be sent partly, the MQTT stream is lost.
+            self._failures += 1
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('bridge_errors')
+            return False
+        self._failures = 0
+        self._up += self._count
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('bridge_up', self._count)
+        self._length = len(_MAGIC)
+        self._count = 0
+        return True
+
+    # Events of paired cyberwares and public events are collected into the batch, control events stay local.
+    async def _event_uplink(self):
+        async for sender, name, args in cyberos.event.subscribe(size=16):
+            if name in cyberos.event.CONTROL_EVENTS:
+                continue
+            if not self._append(sender, name, args) and (not self.connected or not self._flush()
+                                                         or not self._append(sender, name, args)):
+                # Uplink is slow or down, newer events give way until the batch is sent.
+                self._dropped += 1
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('bridge_dropped')
+
+    ################################################################################
+    # Downlink
+    #
+    def _on_message(self, topic, msg):
+        self._command(msg)
+
+    # Commands are queued and sent by the bridge task, never from the MQTT callback.
+    def _command(self, msg):
+        if msg[:len(_MAGIC)] != _MAGIC:
+            return
+        offset = len(_MAGIC)
+        commands = []
+        try:
+            while offset < len(msg):
+                fields = []
+                for i in range(2):
+                    fields.append(str(msg[offset + 1:offset + 1 + msg[offset]], 'utf8'))
+                    offset += 1 + msg[offset]
+                count = msg[offset]
+                offset += 1
+                args = []
+                for i in range(count):
+                    args.append(bytes(msg[offset + 1:offset + 1 + msg[offset]]))
+                    offset += 1 + msg[offset]
+                if offset > len(msg):
+                    raise IndexError
+                receiver = fields[0]
+                if len(receiver) and receiver[0] != '@' \
+                        and 'mac' not in cyberos.cyberwares['subscribed'].get(receiver, ()):
+                    continue  # Not paired with the receiver.
+                commands.append((receiver, fields[1], args))
+        except (IndexError, UnicodeError):
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('bridge_bad_commands')
+            return
+        self._commands.extend(commands)
+
+    ################################################################################
+    # Tasks
+    #
+    # Keeps the connection while STA is connected, flushes the batch and polls for commands.
+    async def _event_bridge(self):
+        flushed = ticks_ms()
+        while True:
+            if not cyberos.network.on_sta_connected.is_set():
+                self._disconnect()
+                await cyberos.network.on_sta_connected.wait()
+            if not self.connected:
+                try:
+                    self._connect()
+                except OSError as e:
+                    print('CYBEROS > Bridge connection failed:', e)
+                    self._disconnect()
+                    await asyncio.sleep_ms(self._flush_ms * self._BACKOFF)
+                    continue
+                if not self._enabled:
+                    return
+
+            # Failed flushes are retried less and less often.
+            backoff = self._failures + 1 if self._failures < self._BACKOFF else self._BACKOFF
+            if ticks_diff(ticks_ms(), flushed) >= self._flush_ms * backoff:
+                self._flush()
+                flushed = ticks_ms()
+
+            try:
+                if self._client is not None:
+                    self._client.check_msg()
+                else:
+                    while True:
+                        msg, addr = self._sock.recvfrom(256)
+                        if addr[0] == self._addr[0]:
+                            self._command(msg)
+            except OSError:
+                pass  # No more datagrams, EAGAIN.
+            while len(self._commands):
+                receiver, name, args = self._commands.pop(0)
+                self._down += 1
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('bridge_down')
+                await cyberos.event.send(name, *args, cyberware=receiver, sync=False)
+            await asyncio.sleep_ms(self._TICK_MS)
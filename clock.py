@@ -0,0 +1,163 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS CLOCK
+#
+# Clock offset and drift of paired cyberwares from ping/pong exchanges and one-way event latency.
+
+import uasyncio as asyncio
+from utime import ticks_us, ticks_diff, ticks_add
+import fildz_cyberos as cyberos
+from .monitor import create_task
+from .metrics import Histogram
+from .listener import OPT_TIME
+
+# Estimate per cyberware.
+_OFFSET = 0  # Cyberware clock minus our clock in us.
+_DRIFT = 1  # Offset change in us per us.
+_AT = 2  # ticks_us() of the estimate.
+_RTT = 3  # Round trip of the sample the estimate is based on.
+
+
+class Clock:
+    def __init__(self):
+        self._enabled = cyberos.preferences['clock']
+        self._ping_ms = cyberos.preferences['clock_ping_ms']  # Time between pings of each paired cyberware.
+
+        self._estimates = {}  # Cyberware name to [offset, drift, at, rtt].
+        self._latency = {}  # Cyberware name to one-way latency histogram in us.
+        self._stamp = bytearray((OPT_TIME, 4, 0, 0, 0, 0))
+
+        if self._enabled:
+            create_task(self._event_sync(), 'clock.sync')
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    # Frames are timestamped and paired cyberwares are pinged.
+    @property
+    def enabled(self):
+        return self._enabled
+
+    # Takes effect on the next reboot.
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['clock'] = value
+        cyberos.settings.on_save_settings.set()
+
+    ################################################################################
+    # Timestamps
+    #
+    # Time option of the frame in our clock, the transmitter stamps it again once the frame is sent (see restamp()).
+    def option(self):
+        stamp = self._stamp
+        now = ticks_us()
+        stamp[2] = now & 0xFF
+        stamp[3] = (now >> 8) & 0xFF
+        stamp[4] = (now >> 16) & 0xFF
+        stamp[5] = (now >> 24) & 0xFF
+        return bytes(stamp)
+
+    # Rewrite the time option of the frame with the current time, frames wait in the TX queue after encoding.
+    def restamp(self, frame):
+        offset = 0
+        while offset < len(frame) and frame[offset] & 0x80:
+            if frame[offset] == OPT_TIME and frame[offset + 1] == 4:
+                frame[offset + 2:offset + 6] = self.option()[2:]
+                return
+            offset += 2 + frame[offset + 1]
+
+    # Cyberware time converted to our clock, None until there is an estimate.
+    def local(self, cyberware, ticks):
+        estimate = self._estimates.get(cyberware)
+        if estimate is None:
+            return None
+        offset = estimate[_OFFSET] + int(estimate[_DRIFT] * ticks_diff(ticks_us(), estimate[_AT]))
+        return ticks_add(ticks, -offset)
+
+    # Time option of the frame received at rx_us, called from the listener.
+    def observe(self, cyberware, stamp, rx_us):
+        sent = self.local(cyberware, stamp[0] | (stamp[1] << 8) | (stamp[2] << 16) | (stamp[3] << 24))
+        if sent is None:
+            return
+        latency = ticks_diff(rx_us, sent)
+        if cyberware not in self._latency:
+            self._latency[cyberware] = Histogram()
+        self._latency[cyberware].observe(latency if latency > 0 else 0)
+
+    ################################################################################
+    # Estimator
+    #
+    # Ping sent at t1, received by the cyberware at t2, pong sent at t3 and received at t4.
+    # Offset assumes both directions take the same time, samples with a much longer round trip are ignored.
+    def sample(self, cyberware, t1, t2, t3, t4):
+        rtt = ticks_diff(t4, t1) - ticks_diff(t3, t2)
+        if rtt < 0:
+            return
+        offset = ticks_diff(t2, t1) - rtt // 2
+        estimate = self._estimates.get(cyberware)
+        if estimate is None:
+            self._estimates[cyberware] = [offset, 0.0, t4, rtt]
+            return
+        if rtt > estimate[_RTT] * 2 + 1000:
+            # Queued or retried somewhere, let the reference round trip grow slowly.
+            estimate[_RTT] += estimate[_RTT] // 8
+            return
+        elapsed = ticks_diff(t4, estimate[_AT])
+        if elapsed > 1000000:
+            drift = ticks_diff(offset, estimate[_OFFSET]) / elapsed
+            estimate[_DRIFT] = estimate[_DRIFT] * 0.75 + drift * 0.25
+        estimate[_OFFSET] = offset
+        estimate[_AT] = t4
+        estimate[_RTT] = rtt
+
+    def reset(self):
+        self._estimates.clear()
+        self._latency.clear()
+
+    ################################################################################
+    # Report
+    #
+    def report(self):
+        lines = ['# cyberos clock enabled=%d' % self._enabled]
+        for cyberware in self._estimates:
+            estimate = self._estimates[cyberware]
+            lines.append('cyberos_clock_offset_us{peer="%s"} %d' % (cyberware, estimate[_OFFSET]))
+            lines.append('cyberos_clock_drift_ppm{peer="%s"} %.2f' % (cyberware, estimate[_DRIFT] * 1000000))
+            lines.append('cyberos_clock_rtt_us{peer="%s"} %d' % (cyberware, estimate[_RTT]))
+        for cyberware in self._latency:
+            histogram = self._latency[cyberware]
+            n = 0
+            for i, bound in enumerate(histogram.bounds):
+                n += histogram.buckets[i]
+                lines.append('cyberos_latency_us_bucket{peer="%s",le="%d"} %d' % (cyberware, bound, n))
+            lines.append('cyberos_latency_us_bucket{peer="%s",le="+Inf"} %d' % (cyberware, histogram.count))
+            lines.append('cyberos_latency_us_mean{peer="%s"} %d' % (cyberware, histogram.mean))
+            lines.append('cyberos_latency_us_max{peer="%s"} %d' % (cyberware, histogram.max))
+        return '\n'.join(lines) + '\n'
+
+    # REPL helper, e.g. "cyberos.clock.dump()".
+    def dump(self):
+        print(self.report(), end='')
+
+    ################################################################################
+    # Tasks
+    #
+    # Ping the paired cyberwares one by one, pongs feed the estimator.
+    async def _event_sync(self):
+        while True:
+            await asyncio.sleep_ms(self._ping_ms)
+            for cyberware in list(cyberos.cyberwares['subscribed']):
+                if 'mac' in cyberos.cyberwares['subscribed'].get(cyberware, ()):
+                    await cyberos.heartbeat.ping(cyberware)
+
+    async def _route(self):
+        @cyberos.server.route('/clock')
+        async def clock(request):
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            await cyberos.server.write(request, self.report())
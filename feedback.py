@@ -0,0 +1,107 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS FEEDBACK
+#
+# Fire-and-forget buzzer tones and pixel patterns played by a single task.
+
+import uasyncio as asyncio
+from uasyncio import Event
+from utime import ticks_ms, ticks_diff, ticks_add
+import fildz_cyberos as cyberos
+from .monitor import create_task
+
+# Feedback kinds.
+_TONE = 0
+_COLOR = 1
+
+
+class Feedback:
+    _SIZE = 4  # Queued tones and colors.
+
+    def __init__(self):
+        self._queue = []  # (priority, kind, value), highest priority first.
+        self._pattern = None  # Repeating pixel pattern as ((color, ms), ...).
+        self._step = 0
+        self._end = 0  # ticks_ms() the current pattern step ends at.
+        self._dropped = 0
+        self._on_feedback = Event()
+        create_task(self._event_feedback(), 'feedback')
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def dropped(self):
+        return self._dropped
+
+    ################################################################################
+    # Queue
+    #
+    # Play the buzzer tone, e.g. "cyberos.feedback.tone(0)".
+    def tone(self, index, priority=0):
+        self._put(priority, _TONE, index)
+
+    # Set the pixel color, e.g. "cyberos.feedback.color(cyberos.cyberware.pixel.C_GREEN)".
+    def color(self, color, priority=0):
+        self._put(priority, _COLOR, color)
+
+    # Repeat the pixel pattern until it is replaced, None stops it and sets the color if given.
+    def pattern(self, steps, color=None):
+        self._pattern = steps
+        self._step = 0
+        self._end = ticks_ms()
+        if color is not None:
+            self.color(color)
+        self._on_feedback.set()
+
+    def _put(self, priority, kind, value):
+        for i in range(len(self._queue)):
+            if self._queue[i][1] == kind and (kind == _COLOR or self._queue[i][2] == value):
+                # Same tone is already queued, a newer color replaces the queued one.
+                if kind == _COLOR:
+                    self._queue[i] = (self._queue[i][0] if self._queue[i][0] > priority else priority, kind, value)
+                return
+        if len(self._queue) >= self._SIZE:
+            if self._queue[-1][0] >= priority:
+                self._dropped += 1
+                return
+            self._queue.pop()
+            self._dropped += 1
+        i = 0
+        while i < len(self._queue) and self._queue[i][0] >= priority:
+            i += 1
+        self._queue.insert(i, (priority, kind, value))
+        self._on_feedback.set()
+
+    ################################################################################
+    # Tasks
+    #
+    async def _event_feedback(self):
+        while True:
+            if len(self._queue):
+                priority, kind, value = self._queue.pop(0)
+                if kind == _TONE:
+                    await cyberos.cyberware.buzzer.play(index=value)
+                else:
+                    await cyberos.cyberware.pixel.set_color(color=value)
+                continue
+            left = None
+            if self._pattern is not None:
+                left = ticks_diff(self._end, ticks_ms())
+                if left <= 0:
+                    color, ms = self._pattern[self._step % len(self._pattern)]
+                    self._step += 1
+                    self._end = ticks_add(ticks_ms(), ms)
+                    await cyberos.cyberware.pixel.set_color(color=color)
+                    continue
+            # Wait for new feedback or the end of the pattern step.
+            self._on_feedback.clear()
+            if left is None:
+                await self._on_feedback.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(self._on_feedback.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
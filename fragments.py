@@ -0,0 +1,233 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS FRAGMENTS
+#
+# Fragmentation and reassembly of events that do not fit into a single ESP-NOW frame.
+
+import uasyncio as asyncio
+import ustruct as struct
+from array import array
+from utime import ticks_ms, ticks_diff
+import fildz_cyberos as cyberos
+from .listener import OPT_FRAGMENT, OPT_RELAY_SIZE, OPT_TIME_SIZE, MAX_FRAME
+from .transmitter import Completion
+
+# Fragment option: message id, fragment index, fragment count, fragment chunk size.
+_FRAGMENT_SIZE = 6
+
+
+class Fragments:
+    _SLOTS = 2  # Messages reassembled at the same time.
+
+    def __init__(self):
+        self._timeout_ms = cyberos.preferences['frag_timeout_ms']
+        size = cyberos.preferences['frag_buffer']
+
+        self._msg_id = 0
+        # Reassembly buffer is allocated once and split into slots.
+        self._region = size // self._SLOTS
+        self._buffer = memoryview(bytearray(self._region * self._SLOTS))
+        self._bits = (self._region // 64 + 8) // 8  # Fragment bitmap size, fragments carry at least 64 bytes.
+        self._bitmaps = memoryview(bytearray(self._bits * self._SLOTS))
+        self._keys = [None] * self._SLOTS  # (Sender MAC, message id) per slot.
+        self._received = array('H', [0] * self._SLOTS)
+        self._started = array('L', [0] * self._SLOTS)
+        self._last = array('H', [0] * self._SLOTS)  # Size of the last fragment chunk.
+        self._benchmarked = 0  # Size of the last benchmark event reassembled.
+
+    ################################################################################
+    # Properties
+    #
+    # Largest event args size that can be reassembled, args are packed with a 2 byte length each.
+    @property
+    def max_size(self):
+        return self._region
+
+    @property
+    def timeout_ms(self):
+        return self._timeout_ms
+
+    @timeout_ms.setter
+    def timeout_ms(self, value):
+        self._timeout_ms = value
+        cyberos.preferences['frag_timeout_ms'] = value
+        cyberos.settings.on_save_settings.set()
+
+    ################################################################################
+    # Send
+    #
+    # Args are packed with 2 byte lengths and sent as numbered chunks of the packed args.
+    async def send(self, event_name, args, cyberware, sync):
+        size = 0
+        for arg in args:
+            size += 2 + len(arg)
+        body = bytearray(size)
+        offset = 0
+        for arg in args:
+            struct.pack_into('>H%is' % len(arg), body, offset, len(arg), arg)
+            offset += 2 + len(arg)
+        body = memoryview(body)
+
+        # Frame header, fragment option, chunk length, the relay and time options are not part of the chunk.
+        chunk = MAX_FRAME - (3 + len(cyberos.network.ap_ssid) + len(cyberware) + len(event_name)
+                             + 2 + _FRAGMENT_SIZE + 1 + (OPT_RELAY_SIZE if cyberos.relay.enabled else 0)
+                             + (OPT_TIME_SIZE if cyberos.clock.enabled else 0))
+        if chunk > 255:
+            chunk = 255
+        count = (size + chunk - 1) // chunk
+        if count > 0xFFFF:
+            raise ValueError('Event too large')
+        self._msg_id = (self._msg_id + 1) & 0xFF
+        completions = []
+        for index in range(count):
+            option = bytes((OPT_FRAGMENT, _FRAGMENT_SIZE, self._msg_id,
+                            index >> 8, index & 0xFF, count >> 8, count & 0xFF, chunk))
+            completions.append(await cyberos.event.transmit(event_name, (body[index * chunk:(index + 1) * chunk],),
+                                                            cyberware, sync, option))
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('frag_tx', count)
+        # Completion of the whole event is the completion of its last fragment.
+        completion = Completion()
+        asyncio.create_task(self._complete(completions, completion))
+        return completion
+
+    async def _complete(self, completions, completion):
+        result = True
+        for fragment in completions:
+            if await fragment.wait() is not True:
+                result = False
+        completion._complete(result)
+
+    ################################################################################
+    # Reassembly
+    #
+    def _free(self, slot):
+        self._keys[slot] = None
+        self._received[slot] = 0
+        bits = self._bitmaps[slot * self._bits:(slot + 1) * self._bits]
+        for i in range(self._bits):
+            bits[i] = 0
+
+    # Slot of the message, a new one is taken if needed, None if there is no room.
+    def _slot(self, key, now):
+        free = None
+        for slot in range(self._SLOTS):
+            if self._keys[slot] == key:
+                return slot
+            if self._keys[slot] is not None and ticks_diff(now, self._started[slot]) > self._timeout_ms:
+                # Incomplete message timed out.
+                self._free(slot)
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('frag_expired')
+            if self._keys[slot] is None and free is None:
+                free = slot
+        if free is not None:
+            self._keys[free] = key
+            self._started[free] = now
+        return free
+
+    # Store the fragment chunk, returns args once all fragments are received.
+    def receive(self, mac, option, chunk):
+        if len(option) != _FRAGMENT_SIZE:
+            return None
+        index = (option[1] << 8) | option[2]
+        count = (option[3] << 8) | option[4]
+        size = option[5]
+        # Only the last fragment may be shorter, so the chunk must fit where it goes.
+        if index >= count or len(chunk) > size or index * size + len(chunk) > self._region or count > self._bits * 8:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('frag_dropped')
+            return None
+        slot = self._slot((mac, option[0]), ticks_ms())
+        if slot is None:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('frag_dropped')
+            return None
+
+        bits = self._bitmaps[slot * self._bits:(slot + 1) * self._bits]
+        if bits[index >> 3] & (1 << (index & 7)):
+            return None  # Duplicate fragment.
+        bits[index >> 3] |= 1 << (index & 7)
+        offset = slot * self._region + index * size
+        self._buffer[offset:offset + len(chunk)] = chunk
+        self._received[slot] += 1
+        if index == count - 1:
+            self._last[slot] = len(chunk)
+        if self._received[slot] < count:
+            return None
+
+        # All fragments received, unpack the args.
+        body = self._buffer[slot * self._region:slot * self._region + (count - 1) * size + self._last[slot]]
+        args = list()
+        offset = 0
+        while offset < len(body):
+            arg_size = (body[offset] << 8) | body[offset + 1]
+            arg = body[offset + 2:offset + 2 + arg_size]
+            try:
+                arg = str(arg, 'utf8')
+            except UnicodeError:
+                arg = bytes(arg)
+            args.append(arg)
+            offset += 2 + arg_size
+        self._free(slot)
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('frag_rx')
+        return args
+
+    ################################################################################
+    # Benchmark
+    #
+    # Throughput of fragmented events to a paired cyberware, e.g. "await cyberos.fragments.benchmark('X')".
+    # The cyberware must call listen() first, which subscribes it to "on_benchmark" and registers the status call.
+    # An event counts as delivered once the cyberware confirms the reassembled size.
+    # Sizes above its reassembly buffer (max_size, half of the frag_buffer preference) are not sent. 64 KB would
+    # need a frag_buffer of 128 KB, more than the ESP8266 heap, with the default 2048 bytes the limit is 1 KB.
+    async def benchmark(self, cyberware, sizes=(1024, 2048, 4096, 8192, 16384, 32768, 65536), sync=True):
+        status = await self._status(cyberware)
+        if status is None:
+            print('CYBEROS > {} is not listening, run "await cyberos.fragments.listen(...)" on it'.format(cyberware))
+            return []
+        max_size = int(status[1])
+        results = []
+        for size in sizes:
+            if size > max_size:
+                print('CYBEROS > {} bytes do not fit the {} byte reassembly buffer of {}'.format(
+                    size, max_size, cyberware))
+                results.append((size, 0, False))
+                continue
+            payload = bytes(size - 2)  # Packed args carry a 2 byte length.
+            start = ticks_ms()
+            await (await self.send('on_benchmark', (payload,), cyberware, sync))
+            ms = ticks_diff(ticks_ms(), start) or 1
+            status = await self._status(cyberware)
+            ok = status is not None and int(status[0]) == size
+            results.append((size, ms, ok))
+            print('CYBEROS > {} bytes in {} ms, {} KB/s{}'.format(
+                size, ms, size * 1000 // ms // 1024, '' if ok else ', not reassembled'))
+        return results
+
+    # Confirm benchmark events of the paired cyberware, e.g. "await cyberos.fragments.listen('BUTTON-02AD9A-WAY')".
+    # Paired cyberwares send only the events we are subscribed to, so this subscribes to "on_benchmark".
+    async def listen(self, cyberware):
+        cyberos.rpc.register('fragments_benchmark', self._benchmark_status)
+        await cyberos.event.push(cyberware, 'on_benchmark', self._on_benchmark)
+
+    def _on_benchmark(self):
+        size = 0
+        for arg in cyberos.event.args:
+            size += 2 + len(arg)
+        self._benchmarked = size
+
+    # Size of the last benchmark event reassembled and the largest size that can be reassembled.
+    def _benchmark_status(self):
+        size = self._benchmarked
+        self._benchmarked = 0
+        return size, self._region
+
+    async def _status(self, cyberware):
+        try:
+            return await cyberos.event.call(cyberware, 'fragments_benchmark', timeout_ms=1000)
+        except RuntimeError:
+            return None  # Not listening, the method is unknown.
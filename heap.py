@@ -0,0 +1,178 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS HEAP
+#
+# Per subsystem heap allocation profiling and low memory mode.
+
+import gc
+from micropython import const
+import uasyncio as asyncio
+from uasyncio import Event
+from array import array
+import fildz_cyberos as cyberos
+from .monitor import create_task
+
+# Subsystem stats array indexes.
+_CALLS = const(0)
+_ALLOC = const(1)  # Total bytes allocated.
+_PEAK = const(2)  # Largest single call allocation.
+_FREE = const(3)  # Lowest free heap seen at the end of the call.
+
+
+class Heap:
+    _CHECK_MS = 1000  # Low memory check period.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['heap']
+        self._low_free = cyberos.preferences['heap_low']
+
+        self._stats = {}  # Allocation stats per subsystem (e.g., {'listener.decode': array('l', [...])}).
+        self._free_min = gc.mem_free()  # Heap low-water mark.
+        self._alloc_max = gc.mem_alloc()  # Heap high-water mark.
+
+        self._on_low_memory = Event()
+
+        create_task(self._event_low_memory(), 'heap.low_memory')
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['heap'] = value
+        cyberos.settings.on_save_settings.set()
+
+    # Free heap in bytes below which optional work is shed, "0" - disabled.
+    @property
+    def low_free(self):
+        return self._low_free
+
+    @low_free.setter
+    def low_free(self, value):
+        self._low_free = value
+        cyberos.preferences['heap_low'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def low_memory(self):
+        return self._on_low_memory.is_set()
+
+    @property
+    def stats(self):
+        return self._stats
+
+    ################################################################################
+    # Events
+    #
+    @property
+    def on_low_memory(self):
+        return self._on_low_memory
+
+    ################################################################################
+    # Hooks
+    #
+    # Usage: "mark = cyberos.heap.begin()", work, "cyberos.heap.end('subsystem', mark)".
+    def begin(self):
+        return gc.mem_alloc()
+
+    def end(self, name, mark):
+        alloc = gc.mem_alloc()
+        free = gc.mem_free()
+        if name not in self._stats:
+            self._stats[name] = array('l', [0, 0, 0, free])
+        stats = self._stats[name]
+        stats[_CALLS] += 1
+        # Negative delta means the GC ran in between, the allocation is unknown then.
+        if alloc > mark:
+            stats[_ALLOC] += alloc - mark
+            if alloc - mark > stats[_PEAK]:
+                stats[_PEAK] = alloc - mark
+        if free < stats[_FREE]:
+            stats[_FREE] = free
+        if free < self._free_min:
+            self._free_min = free
+        if alloc > self._alloc_max:
+            self._alloc_max = alloc
+
+    def reset(self):
+        self._stats.clear()
+        self._free_min = gc.mem_free()
+        self._alloc_max = gc.mem_alloc()
+
+    ################################################################################
+    # Tasks
+    #
+    async def _event_low_memory(self):
+        while True:
+            await asyncio.sleep_ms(self._CHECK_MS)
+            if not self._low_free:
+                continue
+            free = gc.mem_free()
+            if free < self._free_min:
+                self._free_min = free
+            if not self._on_low_memory.is_set():
+                if free < self._low_free:
+                    gc.collect()
+                    if gc.mem_free() < self._low_free:
+                        await self._shed()
+            elif free > self._low_free + self._low_free // 2:
+                await self._restore()
+
+    # Stop optional work: HTTP server, REPL and event history.
+    async def _shed(self):
+        print('CYBEROS > Low memory, {} bytes free'.format(gc.mem_free()))
+        self._on_low_memory.set()
+        await cyberos.server.stop()
+        if cyberos.repl is not None:
+            cyberos.repl.cancel()
+            cyberos.repl = None
+        if cyberos.history.enabled:
+            cyberos.history.shed()
+        gc.collect()
+
+    async def _restore(self):
+        print('CYBEROS > Memory recovered, {} bytes free'.format(gc.mem_free()))
+        self._on_low_memory.clear()
+        if cyberos.repl is None:
+            import aiorepl
+            cyberos.repl = create_task(aiorepl.task(), 'aiorepl')
+        if cyberos.history.enabled:
+            cyberos.history.restore()
+        cyberos.network.on_wlan_change.set()  # Let the HTTP server start again.
+
+    ################################################################################
+    # Reports
+    #
+    def report(self):
+        lines = ['# cyberos heap enabled=%d low_memory=%d' % (self._enabled, self.low_memory),
+                 'cyberos_heap_free %d' % gc.mem_free(),
+                 'cyberos_heap_alloc %d' % gc.mem_alloc(),
+                 'cyberos_heap_free_min %d' % self._free_min,
+                 'cyberos_heap_alloc_max %d' % self._alloc_max]
+        for name in self._stats:
+            stats = self._stats[name]
+            lines.append('cyberos_heap_calls{subsystem="%s"} %d' % (name, stats[_CALLS]))
+            lines.append('cyberos_heap_alloc_bytes{subsystem="%s"} %d' % (name, stats[_ALLOC]))
+            lines.append('cyberos_heap_alloc_peak{subsystem="%s"} %d' % (name, stats[_PEAK]))
+            lines.append('cyberos_heap_free_min{subsystem="%s"} %d' % (name, stats[_FREE]))
+        return '\n'.join(lines) + '\n'
+
+    # REPL helper, e.g. "cyberos.heap.dump()".
+    def dump(self):
+        print(self.report(), end='')
+
+    async def _route(self):
+        @cyberos.server.route('/heap')
+        async def heap(request):
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            await cyberos.server.write(request, self.report())
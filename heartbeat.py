@@ -12,7 +12,9 @@
 
 import uasyncio as asyncio
 from uasyncio import Event
+from utime import ticks_us, ticks_diff
 import fildz_cyberos as cyberos
+from .monitor import create_task
 
 
 class Heartbeat:
@@ -20,8 +22,7 @@ class Heartbeat:
         self._on_ping = Event()
         self._on_pong = Event()
 
-        asyncio.create_task(self._event_ping())
-        asyncio.create_task(self._event_pong())
+        create_task(self._event_ping(), 'heartbeat.ping')
 
         # Events.
         asyncio.create_task(self._push())
@@ -29,30 +30,56 @@ class Heartbeat:
     ################################################################################
     # Events
     #
+    # Deprecated, kept for one release: use "cyberos.event.subscribe(name='on_ping')" instead.
     @property
     def on_ping(self):
         return self._on_ping
 
+    # Deprecated, kept for one release: use "await cyberos.heartbeat.ping(X)" instead.
     @property
     def on_pong(self):
         return self._on_pong
 
+    ################################################################################
+    # Ping
+    #
+    # Round trip time in ms to the paired cyberware, None if it did not answer, e.g. "await cyberos.heartbeat.ping(X)".
+    # Ping carries its send time, pong adds the times the ping was received and the pong sent for the clock estimator.
+    # The time option of the pong, stamped when it left the cyberware, is the better pong send time.
+    async def ping(self, cyberware, timeout_ms=1000):
+        pong = cyberos.event.subscribe(cyberware, 'on_pong', 1)
+        try:
+            t1 = ticks_us()
+            await cyberos.event.send('on_ping', str(t1), cyberware=cyberware)
+            event = await pong.get(timeout_ms)
+            self._on_pong.clear()
+            if event is None:
+                return None
+            t4 = pong.rx_us
+            args = event[2]
+            if cyberos.clock.enabled and len(args) == 3 and args[0] == str(t1):
+                t3 = pong.tx_us if pong.tx_us is not None else int(args[2])
+                cyberos.clock.sample(cyberware, t1, int(args[1]), t3, t4)
+            return ticks_diff(t4, t1) // 1000
+        finally:
+            cyberos.event.unsubscribe(pong)
+
     ################################################################################
     # Tasks
     #
-    # Received a ping.
+    # Answer pings of the paired cyberwares.
     async def _event_ping(self):
-        while True:
-            await self._on_ping.wait()
+        pings = cyberos.event.subscribe(name='on_ping')
+        async for sender, name, args in pings:
+            t2 = pings.rx_us
             self._on_ping.clear()
-            # print('Ping from', cyberos.event.sender)
-
-    # Received a pong.
-    async def _event_pong(self):
-        while True:
-            await self._on_pong.wait()
-            self._on_pong.clear()
-            # print('Pong from', cyberos.event.sender)
+            if 'mac' not in cyberos.cyberwares['subscribed'].get(sender, ()):
+                continue  # Pings are cyberos events, so unpaired cyberwares reach us too.
+            # print('Ping from', sender)
+            if len(args):
+                await cyberos.event.send('on_pong', args[0], str(t2), str(ticks_us()), cyberware=sender)
+            else:
+                await cyberos.event.send('on_pong', cyberware=sender)
 
     async def _push(self):
         cyberos.cyberwares[cyberos.network.ap_ssid]['events'].update(
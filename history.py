@@ -0,0 +1,150 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS HISTORY
+#
+# Fixed capacity ring buffer of received event frames with a query API.
+
+import uasyncio as asyncio
+from array import array
+from utime import ticks_ms, ticks_diff
+import fildz_cyberos as cyberos
+from .listener import OPT_COMPACT
+
+
+class History:
+    def __init__(self):
+        self._enabled = cyberos.preferences['history']
+        self._size = cyberos.preferences['history_size']  # Number of frames kept.
+        self._slot = cyberos.preferences['history_slot']  # Bytes kept per frame, longer frames are truncated.
+
+        # Storage is allocated once, recording a frame only copies bytes into it.
+        self._frames = bytearray(self._size * self._slot) if self._enabled else bytearray(0)
+        self._view = memoryview(self._frames)
+        self._lengths = array('H', [0] * self._size)
+        self._times = array('L', [0] * self._size)  # ticks_ms() the frame was received at.
+        self._index = 0  # Next slot to write.
+        self._count = 0  # Frames recorded so far.
+        self._shed = False  # Storage is freed in low memory.
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    # Storage is allocated on the next reboot.
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['history'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def count(self):
+        return self._count if self._count < self._size else self._size
+
+    ################################################################################
+    # Recording
+    #
+    # Record the raw frame, called from the listener for every received frame.
+    def record(self, event):
+        if not len(self._frames):
+            return  # Disabled or shed in low memory.
+        n = len(event)
+        if n > self._slot:
+            n = self._slot
+        offset = self._index * self._slot
+        self._view[offset:offset + n] = event if n == len(event) else memoryview(event)[:n]
+        self._lengths[self._index] = n
+        self._times[self._index] = ticks_ms()
+        self._index = (self._index + 1) % self._size
+        self._count += 1
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+
+    # Free the storage in low memory, called from the heap.
+    def shed(self):
+        if len(self._frames):
+            self._shed = True
+            self._frames = bytearray(0)
+            self._view = memoryview(self._frames)
+            self.clear()
+
+    # Allocate the shed storage again once memory is recovered.
+    def restore(self):
+        if self._shed:
+            self._shed = False
+            self._frames = bytearray(self._size * self._slot)
+            self._view = memoryview(self._frames)
+
+    ################################################################################
+    # Queries
+    #
+    # Frames oldest first as (age in ms, sender, receiver, name, args), e.g.
+    # "cyberos.history.query(sender='BUTTON-02AD9A-WAY', name='on_click', since_ms=60000)".
+    def query(self, sender=None, name=None, since_ms=None, limit=None):
+        now = ticks_ms()
+        results = []
+        n = self.count
+        for i in range(n):
+            index = (self._index - n + i) % self._size
+            age = ticks_diff(now, self._times[index])
+            if since_ms is not None and age > since_ms:
+                continue
+            offset = index * self._slot
+            frame = self._view[offset:offset + self._lengths[index]]
+            try:
+                _sender, _receiver, _name, _args = self._decode(frame)
+            except Exception:
+                continue  # Truncated frame.
+            if sender is not None and _sender != sender:
+                continue
+            if name is not None and _name != name:
+                continue
+            results.append((age, _sender, _receiver, _name, _args))
+        if limit is not None:
+            results = results[-limit:]
+        return results
+
+    def _decode(self, frame):
+        size = cyberos.event.options_size(frame)
+        if size and frame[0] == OPT_COMPACT:
+            sender = cyberos.event.peer_name(frame[2])
+            name = cyberos.cyberwares['subscribed'][sender]['names'][frame[3]]
+            return sender, cyberos.network.ap_ssid, name, cyberos.event.decode_args(frame, size)
+        return cyberos.event.decode(frame[size:])
+
+    # REPL helper, e.g. "cyberos.history.dump(name='on_click')".
+    def dump(self, sender=None, name=None, since_ms=None, limit=None):
+        for age, _sender, _receiver, _name, _args in self.query(sender, name, since_ms, limit):
+            print('-{} ms {} > {} {} {}'.format(age, _sender, _receiver or '*', _name, _args))
+
+    async def _route(self):
+        # /history?sender=BUTTON-02AD9A-WAY&name=on_click&since_ms=60000&limit=10
+        @cyberos.server.route('/history*')
+        async def history(request):
+            params = {}
+            if '?' in request.url:
+                for param in request.url.split('?', 1)[1].split('&'):
+                    if '=' in param:
+                        key, value = param.split('=', 1)
+                        params[key] = value
+            since_ms = int(params['since_ms']) if 'since_ms' in params else None
+            limit = int(params['limit']) if 'limit' in params else None
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            for age, _sender, _receiver, _name, _args in self.query(params.get('sender'), params.get('name'),
+                                                                    since_ms, limit):
+                await cyberos.server.write(request, '%d %s %s %s %s\n' % (age, _sender, _receiver or '*', _name,
+                                                                          _args))
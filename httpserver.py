@@ -11,6 +11,7 @@ import uasyncio as asyncio
 import uerrno
 from ubinascii import a2b_base64 as base64_decode
 import fildz_cyberos as cyberos
+from .monitor import create_task
 
 
 class HttpError(Exception):
@@ -41,7 +42,7 @@ class HTTPServer:
         self.port = port
         self.address = address
         self.instance = None  # Asyncio server object.
-        asyncio.create_task(self._event_wlan_change())
+        create_task(self._event_wlan_change(), 'httpserver.wlan_change')
 
     async def write(self, request, data):
         await request.write(
@@ -140,6 +141,16 @@ class HTTPServer:
             break
 
     async def handle(self, reader, writer):
+        if cyberos.heap.enabled:
+            mark = cyberos.heap.begin()
+            try:
+                await self._handle(reader, writer)
+            finally:
+                cyberos.heap.end('httpserver.handle', mark)
+        else:
+            await self._handle(reader, writer)
+
+    async def _handle(self, reader, writer):
         items = await reader.readline()
         items = items.decode('ascii').split()
         if len(items) != 3:
@@ -235,7 +246,7 @@ class HTTPServer:
     async def _event_wlan_change(self):
         while True:
             await cyberos.network.on_wlan_change.wait()
-            if not cyberos.pairing.on_pair.is_set():
+            if not cyberos.pairing.on_pair.is_set() and not cyberos.heap.low_memory:
                 if cyberos.network.on_sta_connected.is_set() or cyberos.network.on_ap_active.is_set():
                     await self.start()
                 elif not cyberos.network.on_sta_connected.is_set() and not cyberos.network.on_ap_active.is_set():
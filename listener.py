@@ -4,24 +4,109 @@
 ################################################################################
 # FILDZ CYBEROS EVENT LISTENER
 #
-# ESP-NOW event listener and firing of events or generators.
+# ESP-NOW event listener and firing of events, callbacks or coroutines.
 
 import uasyncio as asyncio
 from uasyncio import Event
 import fildz_cyberos as cyberos
+from .monitor import create_task
 import ustruct as struct
+from utime import ticks_us, ticks_diff
+from ucollections import deque
+from .schema import Schema
+
+# Priority lanes.
+LANE_CONTROL = 0  # Pairing, heartbeat and channel events.
+LANE_DATA = 1  # Application events.
+
+# Frame options prefix the frame as tag (0x80 and above), payload length and payload.
+# A frame without options starts with the sender name length that is always below 0x80.
+OPT_RELAY = 0x80
+OPT_RELAY_SIZE = 9  # Relay option size including its tag and length.
+OPT_FRAGMENT = 0x81
+OPT_SCHEMA = 0x82  # Args are a single arg packed with the event schema.
+OPT_COMPACT = 0x83  # Sender peer id and event name id replace the header of frames between paired cyberwares.
+OPT_RPC = 0x84  # Call or result of the call with its correlation id.
+OPT_TIME = 0x85  # Time the frame was sent at in the sender clock, ticks_us().
+OPT_TIME_SIZE = 6  # Time option size including its tag and length.
+
+MAX_FRAME = 250  # ESP-NOW payload limit.
+
+
+# Selective receive of events as (sender, name, args), resolved by the dispatch task.
+# Times of the event get() returned last are kept, as the listener moves on to the next event meanwhile.
+class Waiter:
+    def __init__(self, sender, name, size):
+        self.sender = sender
+        self.name = name
+        self.rx_us = 0  # Time the event was received at, ticks_us().
+        self.tx_us = None  # Time the event was sent at in the sender clock, None without the time option.
+        self._events = deque((), size)  # Oldest event is dropped once full, as (event, rx_us, tx_us).
+        self._on_event = Event()
+
+    def _put(self, event, rx_us, tx_us):
+        self._events.append((event, rx_us, tx_us))
+        self._on_event.set()
+
+    # Next event, None if it did not arrive in time.
+    async def get(self, timeout_ms=None):
+        while not len(self._events):
+            self._on_event.clear()
+            if timeout_ms is None:
+                await self._on_event.wait()
+            else:
+                try:
+                    await asyncio.wait_for_ms(self._on_event.wait(), timeout_ms)
+                except asyncio.TimeoutError:
+                    return None
+        event, self.rx_us, self.tx_us = self._events.popleft()
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
 
 
 class Listener:
+    # Events that are received, dispatched and sent before any application event.
+    CONTROL_EVENTS = ('on_pairing', 'on_peer_id', 'on_groups', 'on_ping', 'on_pong', 'on_ch_change')
+    _LANE_SIZE = (8, 16)  # Received frames queued per lane.
+    _EMITTED = 8  # Locally generated events queued for dispatch.
+
     def __init__(self):
         self._on_event = Event()
-        asyncio.create_task(self._event())
+        self._on_rx = Event()  # Frames are waiting in the lanes.
+        self._lanes = (deque((), self._LANE_SIZE[LANE_CONTROL]), deque((), self._LANE_SIZE[LANE_DATA]))
+        self._emitted = deque((), self._EMITTED)  # Locally generated events as (cyberware, event name, args).
+        self._control = set(name.encode() for name in self.CONTROL_EVENTS)
+        create_task(self._event(), 'listener.event')
 
         self._sender_mac = None  # Event sender MAC address (e.g., b'\x9e\x9c\x1f\x00\x00\x00')
+        self._rx_us = 0  # Time the event is dispatched at, ticks_us().
+        self._tx_us = None  # Time the event was sent at in the sender clock, ticks_us().
         self._name = None  # Event name (e.g., on_pair, on_ping)
         self._args = list()  # Event arguments (e.g., (0, 0, 'Hello World!'))
         self._sender = None  # Event sender name (e.g., BUTTON-02AD9A-WAY)
         self._receiver = None  # Event receiver name (e.g., DISPLAY-0F889A-ABW)
+        self._options = b''  # Event frame options.
+        self._schemas = {}  # Event name to its args schema.
+        self._timeouts = {}  # Coroutine handler to its timeout in ms.
+        self._waiters = {}  # Event name, None for any, to its waiters.
+        self._waited = {}  # Sender, None for any, to the event names waited for, advertised like subscriptions.
+        self._wildcards = {}  # Cyberware name prefix (e.g., 'BUTTON-' of 'BUTTON-*') to {event name: handlers}.
+        self._matches = {}  # Cyberware name to {event name: handlers} of the wildcards it matches.
+        self._groups = set(cyberos.preferences['groups'])  # Groups we are a member of.
+        self._members = {}  # Group name to paired cyberwares that are its members.
+        self._transports = {}  # Transport name to transport, see add_transport().
+        self._espnow = None  # Default transport.
+        self._ids = {}  # Peer id we gave to the paired cyberware to its name.
+        self.index_ids()
+        self._paired = []  # Paired cyberware names.
+        self._subscribers = {}  # Event name to paired cyberwares that advertised interest in it.
+        self._everything = []  # Paired cyberwares that did not advertise their interests, they get every event.
+        self.index_subscribers()
 
     ################################################################################
     # Properties
@@ -46,6 +131,18 @@ class Listener:
     def args(self):
         return self._args
 
+    @property
+    def options(self):
+        return self._options
+
+    @property
+    def rx_us(self):
+        return self._rx_us
+
+    @property
+    def groups(self):
+        return tuple(self._groups)
+
     ################################################################################
     # Events
     #
@@ -56,102 +153,383 @@ class Listener:
     ################################################################################
     # Tasks
     #
-    # New event received.
-    async def _event(self):
-        async for sender, event in cyberos.espnow:
-            self._sender_mac = sender
+    # Move received frames to the priority lanes, so the radio is drained while handlers run.
+    async def _receive(self, transport):
+        async for sender, event in transport:
+            # Flood protection runs before the frame is copied or decoded.
+            if cyberos.ratelimit.enabled and not cyberos.ratelimit.check(sender, event):
+                continue
+            index = self.lane(event)
+            lane = self._lanes[index]
+            if len(lane) == self._LANE_SIZE[index]:
+                lane.popleft()  # Lane is full, drop the oldest frame.
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('rx_lane_dropped')
+            # ESP-NOW reuses the receive buffers, so keep a copy.
+            lane.append((bytes(sender), bytes(event)))
+            self._on_rx.set()
 
-            try:
-                self._sender, self._receiver, self._name, self._args = self.decode(event)
-            except:
+    # Size of the options that prefix the frame, compact frames without args are options only.
+    def options_size(self, event):
+        offset = 0
+        while offset < len(event) and event[offset] & 0x80:
+            offset += 2 + event[offset + 1]
+        return offset
+
+    # Payload of the received event frame option, None if the frame has no such option.
+    def option(self, tag):
+        options = self._options
+        offset = 0
+        while offset < len(options):
+            if options[offset] == tag:
+                return options[offset + 2:offset + 2 + options[offset + 1]]
+            offset += 2 + options[offset + 1]
+        return None
+
+    # Event name of the raw frame as bytes, no decoding needed.
+    def raw_name(self, event):
+        try:
+            offset = self.options_size(event)
+            if offset and event[0] == OPT_COMPACT:
+                # Compact frames carry the peer id and the id of the event name we gave the paired cyberware.
+                return cyberos.cyberwares['subscribed'][self._ids[event[2]]]['names'][event[3]].encode()
+            offset += 1 + event[offset]
+            offset += 1 + event[offset]
+            return bytes(event[offset + 1:offset + 1 + event[offset]])
+        except (IndexError, KeyError):
+            return b''
+
+    # Typed args of the event from the single raw arg of the frame.
+    def _unpack(self, arg):
+        if self._name in self._schemas:
+            return self._schemas[self._name].unpack(arg)
+        return [bytes(arg)]  # We do not know the schema, leave args packed.
+
+    # Lane of the raw frame by its event name.
+    def lane(self, event):
+        return LANE_CONTROL if self.raw_name(event) in self._control else LANE_DATA
+
+    # Dispatch queued frames, the control lane is always emptied first.
+    async def _event(self):
+        control, data = self._lanes
+        while True:
+            await self._on_rx.wait()
+            if len(control):
+                sender, event = control.popleft()
+            elif len(self._emitted):
+                await self._emit(*self._emitted.popleft())
+                await asyncio.sleep(0)
+                continue
+            elif len(data):
+                sender, event = data.popleft()
+            else:
+                self._on_rx.clear()
                 continue
+            await self._dispatch(sender, event)
+            # Let the woken tasks read the event and the radio fill the lanes before the next frame.
+            await asyncio.sleep(0)
 
-            # print('\nFROM:', self._sender)
-            # print('TO:', self._receiver)
-            # print('EVENT:', self._name)
-            # print('ARGS:', self._args)
+    # New event received.
+    async def _dispatch(self, sender, event):
+        self._sender_mac = sender
+        self._rx_us = ticks_us()
+        self._tx_us = None
+        if cyberos.history.enabled:
+            cyberos.history.record(event)
 
-            self._on_event.set()  # We have a new event, inform tasks.
+        profile = cyberos.heap.enabled
+        if profile:
+            mark = cyberos.heap.begin()
+        try:
+            size = self.options_size(event)
+            event = memoryview(event)
+            self._options = event[:size]
+            fragment = self.option(OPT_FRAGMENT) if size else None
+            schema = self.option(OPT_SCHEMA) if size else None
+            compact = self.option(OPT_COMPACT) if size else None
+            if compact is not None:
+                # Frame from the paired cyberware that uses the peer id and the event names we gave it.
+                self._sender = self.peer_name(compact[0])
+                self._receiver = cyberos.network.ap_ssid
+                self._name = cyberos.cyberwares['subscribed'][self._sender]['names'][compact[1]]
+                if schema is None:
+                    self._args = self.decode_args(event, size)
+                else:
+                    self._args = self._unpack(event[size + 1:size + 1 + event[size]])
+            elif fragment is None and schema is None:
+                self._sender, self._receiver, self._name, self._args = self.decode(event[size:])
+            else:
+                # Frame carries a single raw arg that must not be decoded as text.
+                offset = size
+                for x in range(3):
+                    offset += 1 + event[offset]
+                self._sender, self._receiver, self._name, args = self.decode(event[size:offset])
+                arg = event[offset + 1:offset + 1 + event[offset]]
+                if fragment is not None:
+                    # Fragment chunk is reassembled before the event is dispatched.
+                    args = cyberos.fragments.receive(sender, fragment, arg)
+                    if args is None:
+                        return
+                else:
+                    args = self._unpack(arg)
+                self._args = args
+        except Exception:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('rx_decode_errors')
+            return
+        if profile:
+            cyberos.heap.end('listener.decode', mark)
+            mark = cyberos.heap.begin()
 
-            # To whom event was sent?
-            if not len(self._receiver):
-                # Event was sent to all cyberwares, so it is a public event.
-                # Public events are sent to AP MAC address on default channel.
+        if cyberos.metrics.enabled:
+            cyberos.metrics.rx(self._sender, self._name)
+
+        relay = self.option(OPT_RELAY) if size else None
+        if relay is not None and not cyberos.relay.receive(relay, self._sender, sender):
+            return  # Duplicate of the relayed frame.
+        if relay is None and cyberos.relay.enabled:
+            cyberos.relay.heard(self._sender)
+        rpc = self.option(OPT_RPC) if size else None
+        if size and cyberos.clock.enabled:
+            stamp = self.option(OPT_TIME)
+            if stamp is not None and len(stamp) == 4:
+                self._tx_us = stamp[0] | (stamp[1] << 8) | (stamp[2] << 16) | (stamp[3] << 24)
+                cyberos.clock.observe(self._sender, stamp, self._rx_us)
+        if cyberos.outbox.enabled:
+            cyberos.outbox.seen(self._sender)
+
+        # print('\nFROM:', self._sender)
+        # print('TO:', self._receiver)
+        # print('EVENT:', self._name)
+        # print('ARGS:', self._args)
+
+        self._on_event.set()  # We have a new event, inform tasks.
+        group = self._receiver[:1] == '@'
+        if len(self._waiters) and rpc is None and (not len(self._receiver) or (
+                self._receiver == cyberos.network.ap_ssid or group and self._receiver[1:] in self._groups) and (
+                self._name in cyberos.cyberwares[cyberos.network.ap_ssid]['events']
+                or 'mac' in cyberos.cyberwares['subscribed'].get(self._sender, ()))) and (
+                not cyberos.aggregate.active or not cyberos.aggregate.aggregated(self._sender, self._name)):
+            # Public events, cyberos events and events from paired cyberwares to us or our groups.
+            # Aggregated samples are not, waiters get the aggregated event once per window (see emit()).
+            self._resolve()
+
+        # To whom event was sent?
+        if not len(self._receiver):
+            # Event was sent to all cyberwares, so it is a public event.
+            # Public events are sent to AP MAC address on default channel.
+            if self._name in cyberos.cyberwares[cyberos.network.ap_ssid]['events']:
+                # print('\nPUBLIC {} EVENT'.format(self._name))
+                self._set(cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name])
+            if relay is not None and cyberos.relay.enabled:
+                # Public events are flooded further as well.
+                await cyberos.relay.forward(event, relay, self._receiver)
+        elif self._receiver == cyberos.network.ap_ssid:
+            # Event was sent to our cyberware, so it is a private event.
+            # Private events are sent to STA MAC address on random channel (channel depends on cyberware config).
+            # The event we received can be from unpaired, in-pairing, or paired cyberware.
+            # Is the event received is from the paired or unpaired cyberware?
+            if self._sender in cyberos.cyberwares['subscribed']:
+                # Received an event from either paired-subscribed or unpaired-subscribed cyberware.
+                # If we have a mac address of the event sender, then we are paired with it.
+                if 'mac' in cyberos.cyberwares['subscribed'][self._sender]:
+                    # We are paired with the event sender, but are we subscribed to its events?
+                    if rpc is not None:
+                        # Call from or result to the paired cyberware, not an event.
+                        await cyberos.rpc.receive(rpc, self._sender, self._name, self._args)
+                    elif self._name in cyberos.cyberwares[cyberos.network.ap_ssid]['events']:
+                        # Cyberos event from the paired cyberware (e.g., on_peer_id).
+                        self._set(cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name])
+                    else:
+                        await self._subscribed()
+                # else:
+                # Event from unpaired device, but we are subscribed to its events.
+                # We do not execute any events from unpaired cyberware except for public events.
+                # print('\nUNPAIRED {} {} SUBSCRIBED EVENT'.format(self._sender, self._name))
+            else:
+                # Received an event from 'unpaired' or 'in-pairing' cyberware.
+                # We do not execute any events from 'unpaired' cyberware except if it is a public event
+                # like 'on_pairing' that is only available in 'in-pairing' cyberware.
+                # 'in-pairing' cyberware is a cyberware that is answering our pairing (on_pairing event) request.
                 if self._name in cyberos.cyberwares[cyberos.network.ap_ssid]['events']:
-                    if not cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name].is_set():
-                        # print('\nPUBLIC {} EVENT'.format(self._name))
-                        cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name].set()
-            elif self._receiver == cyberos.network.ap_ssid:
-                # Event was sent to our cyberware, so it is a private event.
-                # Private events are sent to STA MAC address on random channel (channel depends on cyberware config).
-                # The event we received can be from unpaired, in-pairing, or paired cyberware.
-                # Is the event received is from the paired or unpaired cyberware?
-                if self._sender in cyberos.cyberwares['subscribed']:
-                    # Received an event from either paired-subscribed or unpaired-subscribed cyberware.
-                    # If we have a mac address of the event sender, then we are paired with it.
-                    if 'mac' in cyberos.cyberwares['subscribed'][self._sender]:
-                        # We are paired with the event sender, but are we subscribed to its events?
-                        if self._name in cyberos.cyberwares['subscribed'][self._sender]['events']:
-                            # print('\nPAIRED {} {} SUBSCRIBED EVENT'.format(self._sender, self._name))
-                            # Indeed we are subscribed to paired cyberware events.
-                            # Now should we set the event or run a function?
-                            if cyberos.cyberwares['subscribed'][self._sender] \
-                                    ['events'][self._name].__class__.__name__ is 'Event':
-                                if not cyberos.cyberwares['subscribed'][self._sender]['events'][self._name].is_set():
-                                    cyberos.cyberwares['subscribed'][self._sender]['events'][self._name].set()
-                            elif cyberos.cyberwares['subscribed'][self._sender]['events'][
-                                self._name].__class__.__name__ is 'generator':
-                                await cyberos.cyberwares['subscribed'][self._sender]['events'][self._name]()
-                        # else:
-                        # We do not listen to paired cyberware events.
-                        # print('\nPAIRED {} {} UNSUBSCRIBED EVENT'.format(self._sender, self._name))
-                    # else:
-                    # Event from unpaired device, but we are subscribed to its events.
-                    # We do not execute any events from unpaired cyberware except for public events.
-                    # print('\nUNPAIRED {} {} SUBSCRIBED EVENT'.format(self._sender, self._name))
-                else:
-                    # Received an event from 'unpaired' or 'in-pairing' cyberware.
-                    # We do not execute any events from 'unpaired' cyberware except if it is a public event
-                    # like 'on_pairing' that is only available in 'in-pairing' cyberware.
-                    # 'in-pairing' cyberware is a cyberware that is answering our pairing (on_pairing event) request.
-                    if self._name in cyberos.cyberwares[cyberos.network.ap_ssid]['events']:
-                        if not cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name].is_set():
-                            # print('\nCYBEROS {} EVENT'.format(self._name))
-                            cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name].set()
-                    # else:
-                    # print('\nUNPAIRED {} {} UNSUBSCRIBED EVENT'.format(self._sender, self._name))
-            # Event was sent to some other cyberware, resend it to all.
-            # else:
+                    # print('\nCYBEROS {} EVENT'.format(self._name))
+                    self._set(cyberos.cyberwares[cyberos.network.ap_ssid]['events'][self._name])
+                # else:
+                # print('\nUNPAIRED {} {} UNSUBSCRIBED EVENT'.format(self._sender, self._name))
+        elif group:
+            # Event was sent to a group, members handle it like a private event from the paired cyberware.
+            if self._receiver[1:] in self._groups and 'mac' in cyberos.cyberwares['subscribed'].get(self._sender, ()):
+                await self._subscribed()
+            if relay is not None and cyberos.relay.enabled:
+                # Group events are flooded further as well.
+                await cyberos.relay.forward(event, relay, self._receiver)
+        elif relay is not None and cyberos.relay.enabled:
+            # Event was sent to some other cyberware, resend it once.
             # print('\nRetransmitting...')
-            self._on_event.clear()
+            await cyberos.relay.forward(event, relay, self._receiver)
+        self._on_event.clear()
+        if profile:
+            cyberos.heap.end('listener.dispatch', mark)
 
-    async def encode(self, event_name, args, cyberware=''):
-        a_len = len(cyberos.network.ap_ssid)
+    # Event from the paired cyberware, are we subscribed to it by its name or a wildcard?
+    async def _subscribed(self):
+        handlers = self.handlers(self._sender, self._name)
+        if handlers is not None:
+            # print('\nPAIRED {} {} SUBSCRIBED EVENT'.format(self._sender, self._name))
+            # Indeed we are subscribed to paired cyberware events.
+            # Aggregated events are emitted once per window instead.
+            if not cyberos.aggregate.active or not cyberos.aggregate.feed(self._sender, self._name, self._args):
+                await self._fire(handlers)
+        # else:
+        # We do not listen to paired cyberware events.
+        # print('\nPAIRED {} {} UNSUBSCRIBED EVENT'.format(self._sender, self._name))
+
+    # Handlers of the cyberware event, subscriptions by name come first, then the wildcards it matches.
+    def handlers(self, cyberware, event_name):
+        events = cyberos.cyberwares['subscribed'][cyberware]['events']
+        if event_name in events:
+            return events[event_name]
+        if not len(self._wildcards):
+            return None
+        if cyberware not in self._matches:
+            # Wildcards are matched once per cyberware, later frames are a dictionary lookup.
+            matches = {}
+            for prefix in self._wildcards:
+                if cyberware.startswith(prefix):
+                    matches.update(self._wildcards[prefix])
+            self._matches[cyberware] = matches
+        return self._matches[cyberware].get(event_name)
+
+    # Names of the events we are subscribed to from the cyberware, by its name or a wildcard.
+    def event_names(self, cyberware):
+        names = list(cyberos.cyberwares['subscribed'][cyberware]['events'])
+        for prefix in self._wildcards:
+            if cyberware.startswith(prefix):
+                for name in self._wildcards[prefix]:
+                    if name not in names:
+                        names.append(name)
+        for sender in (cyberware, None):
+            for name in self._waited.get(sender, ()):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    # Should we set the event, run a callback or start a coroutine?
+    # Callbacks run inline, coroutines run concurrently and start before the next frame is dispatched,
+    # so they must read the event properties (e.g., cyberos.event.args) before their first await.
+    async def _fire(self, handlers):
+        for handler in handlers if handlers.__class__.__name__ == 'list' else (handlers,):
+            if handler.__class__.__name__ == 'Event':
+                self._set(handler)
+                continue
+            timed = cyberos.metrics.enabled
+            if timed:
+                start = ticks_us()
+            try:
+                result = handler()
+            except Exception as e:
+                # Failing callback must not stop the dispatch task nor the other handlers.
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('handler_errors')
+                print('CYBEROS > {} handler failed: {}'.format(self._name, e))
+                continue
+            if result.__class__.__name__ in ('generator', 'coroutine'):
+                asyncio.create_task(self._run(result, self._name, self._timeouts.get(handler)))
+            elif timed:
+                cyberos.metrics.observe(self._name, ticks_diff(ticks_us(), start))
+
+    async def _run(self, coro, event_name, timeout_ms):
+        timed = cyberos.metrics.enabled
+        if timed:
+            start = ticks_us()
+        try:
+            if timeout_ms is None:
+                await coro
+            else:
+                await asyncio.wait_for_ms(coro, timeout_ms)
+        except asyncio.TimeoutError:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('handler_timeouts')
+            print('CYBEROS > {} handler timed out'.format(event_name))
+        except Exception as e:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('handler_errors')
+            print('CYBEROS > {} handler failed: {}'.format(event_name, e))
+        else:
+            if timed:
+                cyberos.metrics.observe(event_name, ticks_diff(ticks_us(), start))
+
+    # Emit an event generated locally (e.g., aggregated events) to the handlers subscribed to it.
+    # It is dispatched by the dispatch task like a received frame, so handlers never read the args of another event.
+    async def emit(self, cyberware, event_name, args):
+        if len(self._emitted) == self._EMITTED and cyberos.metrics.enabled:
+            cyberos.metrics.inc('rx_emit_dropped')  # The oldest emitted event gives way.
+        self._emitted.append((cyberware, event_name, args))
+        self._on_rx.set()
+
+    async def _emit(self, cyberware, event_name, args):
+        handlers = self.handlers(cyberware, event_name) if cyberware in cyberos.cyberwares['subscribed'] else None
+        if handlers is not None:
+            self._sender = cyberware
+            self._receiver = cyberos.network.ap_ssid
+            self._name = event_name
+            self._args = args
+            self._options = b''
+            self._rx_us = ticks_us()
+            self._tx_us = None
+            if len(self._waiters):
+                self._resolve()
+            await self._fire(handlers)
+
+    def _resolve(self):
+        for name in (self._name, None):
+            if name in self._waiters:
+                for waiter in self._waiters[name]:
+                    if waiter.sender is None or waiter.sender == self._sender:
+                        waiter._put((self._sender, self._name, self._args), self._rx_us, self._tx_us)
+
+    # Set the event unless it is still set from the previous frame, in which case the frame is coalesced.
+    def _set(self, event):
+        if not event.is_set():
+            event.set()
+        elif cyberos.metrics.enabled:
+            cyberos.metrics.inc('rx_dropped_set')
+
+    # Compact frames (header=False) carry the options and args only.
+    # Text is packed as UTF-8 bytes, so lengths are byte lengths and struct accepts it on CPython as well.
+    async def encode(self, event_name, args, cyberware='', options=b'', header=True):
+        sender = cyberos.network.ap_ssid.encode()
+        cyberware = cyberware.encode()
+        event_name = event_name.encode()
+        args = [arg.encode() if isinstance(arg, str) else arg for arg in args]
+        o_len = len(options)
+        a_len = len(sender)
         c_len = len(cyberware)
         e_len = len(event_name)
 
         n = len(args)
         for arg in args:
             n += len(arg)
-        offset = 1 + a_len + 1 + c_len + 1 + e_len
+        offset = o_len + (1 + a_len + 1 + c_len + 1 + e_len if header else 0)
         n += offset
         data = bytearray(n)
         buffer = memoryview(data)
-        struct.pack_into('b%isb%isb%is' % (a_len, c_len, e_len), buffer, 0,
-                         a_len, cyberos.network.ap_ssid,
-                         c_len, cyberware,
-                         e_len, event_name)
+        buffer[:o_len] = options
+        if header:
+            struct.pack_into('B%isB%isB%is' % (a_len, c_len, e_len), buffer, o_len,
+                             a_len, sender,
+                             c_len, cyberware,
+                             e_len, event_name)
         for arg in args:
             arg_len = len(arg)
-            struct.pack_into('b%is' % arg_len, buffer, offset, arg_len, arg)
+            struct.pack_into('B%is' % arg_len, buffer, offset, arg_len, arg)
             offset += 1 + arg_len
         return buffer
 
-    async def decode(self, event):
-        size = len(event)
+    # Generator of the sender, the receiver, the event name and the args, e.g. "sender, receiver, name, args =".
+    def decode(self, event):
         event = memoryview(event)
         offset = 0
-        args = list()
 
         # Event sender, receiver, name.
         for x in range(3):
@@ -161,40 +539,299 @@ class Listener:
                 arg = str(arg, 'utf8')
             except UnicodeError:
                 arg = bytes(arg)
-            offset += 1 + len(arg)
+            offset += 1 + arg_size
             yield arg
 
         # Event args.
-        while True:
-            if offset >= size:
-                yield args
-                break
-            arg_size = event[offset:offset + 1][0]
+        yield self.decode_args(event, offset)
+
+    def decode_args(self, event, offset=0):
+        size = len(event)
+        args = list()
+        while offset < size:
+            arg_size = event[offset]
             arg = event[offset + 1:offset + 1 + arg_size]
             try:
                 arg = str(arg, 'utf8')
             except UnicodeError:
                 arg = bytes(arg)
             args.append(arg)
-            offset += 1 + len(arg)
+            offset += 1 + arg_size
+        return args
 
+    # Application events are sent only to the paired cyberwares subscribed to them.
+    # Returns the completion handle of the queued event, a list of them if sent to all cyberwares.
+    # Returns None if the cyberware or the group is not subscribed to the event, counted as "tx_filtered".
     async def send(self, event_name, *args, cyberware='', sync=True):
+        control = event_name in self.CONTROL_EVENTS
         if cyberware is '':
-            for cyberware in cyberos.cyberwares['subscribed']:
-                _event = await self.encode(event_name, '' if not len(args) else args, cyberware=cyberware)
-                await cyberos.espnow.asend(cyberos.cyberwares['subscribed'][cyberware]['mac'], _event, sync=sync)
+            completions = []
+            for cyberware in self._paired if control else self._subscribers.get(event_name, ()):
+                completions.append(await self._send(event_name, args, cyberware, sync))
+            if not control:
+                for cyberware in self._everything:
+                    completions.append(await self._send(event_name, args, cyberware, sync))
+            return completions
+        elif cyberware[:1] == '@':
+            # One frame reaches every member of the group.
+            if cyberware[1:] not in self._members:
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('tx_filtered')
+                return None
+            return await self._send(event_name, args, cyberware, sync)
         else:
-            _event = await self.encode(event_name, '' if not len(args) else args, cyberware=cyberware)
-            await cyberos.espnow.asend(cyberos.cyberwares['subscribed'][cyberware]['mac'], _event, sync=sync)
+            if not control and 'tx_names' in cyberos.cyberwares['subscribed'][cyberware] \
+                    and event_name not in cyberos.cyberwares['subscribed'][cyberware]['tx_names']:
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('tx_filtered')
+                return None
+            return await self._send(event_name, args, cyberware, sync)
+
+    async def _send(self, event_name, args, cyberware, sync):
+        if event_name in self._schemas:
+            # Typed args must fit into a single frame.
+            return await self.transmit(event_name, (self._schemas[event_name].pack(args),), cyberware, sync,
+                                       bytes((OPT_SCHEMA, 0)))
+        # Events that do not fit into a single frame of the cyberware transport are fragmented.
+        max_frame = self.transport(cyberware).max_frame
+        n = 3 + len(cyberos.network.ap_ssid) + len(cyberware) + len(event_name) + len(args)
+        for arg in args:
+            if len(arg) > 255:
+                n = max_frame + 1
+                break
+            n += len(arg)
+        if cyberos.relay.enabled:
+            n += OPT_RELAY_SIZE
+        if cyberos.clock.enabled:
+            n += OPT_TIME_SIZE
+        if n > max_frame:
+            return await cyberos.fragments.send(event_name, args, cyberware, sync)
+        return await self.transmit(event_name, args, cyberware, sync)
+
+    # Encode and transmit a single frame.
+    async def transmit(self, event_name, args, cyberware, sync, options=b''):
+        stamp = cyberos.clock.option() if cyberos.clock.enabled else b''
+        if cyberos.relay.enabled and not cyberos.relay.direct(cyberware):
+            # Relayed frames go to the learned next hop or are flooded, paired cyberwares in range get them directly.
+            _event = await self.encode(event_name, '' if not len(args) else args, cyberware=cyberware,
+                                       options=options + stamp + cyberos.relay.option())
+            mac = cyberos.relay.next_hop(cyberware)
+        elif cyberware[:1] == '@':
+            # Group events are sent to AP MAC address like public events, group members pick them up.
+            _event = await self.encode(event_name, '' if not len(args) else args, cyberware=cyberware,
+                                       options=options + stamp)
+            mac = cyberos.cyberware.mac_public
+        else:
+            peer = cyberos.cyberwares['subscribed'][cyberware]
+            if (not len(options) or options[0] != OPT_FRAGMENT) and 'tx_id' in peer \
+                    and event_name in peer['tx_names']:
+                # Paired cyberware gave us a peer id and an id for this event name, schema and RPC frames too.
+                # Fragments keep the full header. The compact option comes first, see raw_name().
+                _event = await self.encode(event_name, '' if not len(args) else args,
+                                           options=bytes((OPT_COMPACT, 2, peer['tx_id'],
+                                                          peer['tx_names'][event_name])) + options + stamp,
+                                           header=False)
+            else:
+                _event = await self.encode(event_name, '' if not len(args) else args, cyberware=cyberware,
+                                           options=options + stamp)
+            mac = peer['mac']
+        return await self.asend(mac, _event, cyberware, event_name, sync=sync)
+
+    # Queue an encoded event for the transmitter, every frame we send goes through here.
+    # Returns the completion handle, "await" it for the delivery result.
+    async def asend(self, mac, event, cyberware, event_name, sync=True):
+        return await cyberos.tx.submit(mac, event, cyberware, event_name, sync)
 
+    # Name of the paired cyberware we gave the peer id to.
+    def peer_name(self, peer_id):
+        return self._ids[peer_id]
+
+    # Rebuild the peer id index once peer ids change.
+    def index_ids(self):
+        self._ids.clear()
+        for cyberware in cyberos.cyberwares['subscribed']:
+            if 'id' in cyberos.cyberwares['subscribed'][cyberware]:
+                self._ids[cyberos.cyberwares['subscribed'][cyberware]['id']] = cyberware
+
+    # Rebuild the subscriber index once pairing or advertised interests change.
+    def index_subscribers(self):
+        self._paired = []
+        self._subscribers = {}
+        self._everything = []
+        self._members = {}
+        for cyberware in cyberos.cyberwares['subscribed']:
+            peer = cyberos.cyberwares['subscribed'][cyberware]
+            if 'mac' not in peer:
+                continue
+            self._paired.append(cyberware)
+            for group in peer.get('groups', ()):
+                if group not in self._members:
+                    self._members[group] = []
+                self._members[group].append(cyberware)
+            if 'tx_names' in peer:
+                for name in peer['tx_names']:
+                    if name not in self._subscribers:
+                        self._subscribers[name] = []
+                    self._subscribers[name].append(cyberware)
+            else:
+                self._everything.append(cyberware)
+
+    # Receive and send frames over the transport too, ESP-NOW is the default one.
+    def add_transport(self, transport):
+        if self._espnow is None:
+            self._espnow = transport
+        self._transports[transport.name] = transport
+        create_task(self._receive(transport), 'listener.receive.' + transport.name)
+
+    # Transport frames to the cyberware are sent over.
+    def transport(self, cyberware):
+        return self._transports.get(cyberos.cyberwares['subscribed'].get(cyberware, {}).get('transport'), self._espnow)
+
+    # Send frames to the paired cyberware over the transport, e.g. "cyberos.event.route('X', 'udp')".
+    # None goes back to ESP-NOW.
+    def route(self, cyberware, transport_name):
+        peer = cyberos.cyberwares['subscribed'][cyberware]
+        if transport_name is None or transport_name == self._espnow.name:
+            peer.pop('transport', None)
+        elif transport_name in self._transports:
+            peer['transport'] = transport_name
+        else:
+            raise ValueError('Unknown transport %s' % transport_name)
+        cyberos.settings.on_save_cyberwares.set()
+
+    # Register typed args of the event, e.g. "cyberos.event.schema('on_temp', ('int16', 'float'))".
+    # Both the sender and the receiver must register the same schema, None removes it.
+    def schema(self, event_name, fields):
+        if fields is None:
+            self._schemas.pop(event_name, None)
+        else:
+            self._schemas[event_name] = Schema(fields)
+
+    # Subscription changes are advertised to the paired cyberware, so it sends us only the events we want.
+    # Cyberware name ending with '*' subscribes to the event of every paired cyberware whose name starts with it,
+    # e.g. "await cyberos.event.push('BUTTON-*', 'on_click', btn_clicked)".
     async def push(self, cyberware_name, event_name, event):
-        if cyberware_name in cyberos.cyberwares['subscribed']:
+        if cyberware_name[-1:] == '*':
+            prefix = cyberware_name[:-1]
+            if prefix not in self._wildcards:
+                self._wildcards[prefix] = {}
+            self._wildcards[prefix][event_name] = event
+            self._wildcard_changed(prefix)
+        elif cyberware_name in cyberos.cyberwares['subscribed']:
             cyberos.cyberwares['subscribed'][cyberware_name]['events'].update({event_name: event})
+            cyberos.pairing.advertise(cyberware_name)
         else:
             cyberos.cyberwares['subscribed'].update({cyberware_name: {'events': {event_name: event}}})
 
     async def pull(self, cyberware_name, event_name=''):
+        if cyberware_name[-1:] == '*':
+            prefix = cyberware_name[:-1]
+            events = self._wildcards.get(prefix, {})
+            if event_name == '':
+                events.clear()
+            else:
+                events.pop(event_name, None)
+            if not len(events):
+                self._wildcards.pop(prefix, None)
+            self._wildcard_changed(prefix)
+            return
         if event_name is '':
             cyberos.cyberwares['subscribed'][cyberware_name]['events'].clear()
         else:
             cyberos.cyberwares['subscribed'][cyberware_name]['events'].pop(event_name)
+        cyberos.pairing.advertise(cyberware_name)
+
+    def _wildcard_changed(self, prefix):
+        self._matches.clear()
+        for cyberware in self._paired:
+            if cyberware.startswith(prefix):
+                cyberos.pairing.advertise(cyberware)
+
+    # Subscribed events of the cyberware or the wildcard.
+    def _events(self, cyberware_name):
+        if cyberware_name[-1:] == '*':
+            return self._wildcards.get(cyberware_name[:-1], {})
+        return cyberos.cyberwares['subscribed'].get(cyberware_name, {'events': {}})['events']
+
+    # Join the group, paired cyberwares learn our groups and send group events once to all members,
+    # e.g. "cyberos.event.join('kitchen')" and "await cyberos.event.send('on_light', '1', cyberware='@kitchen')".
+    def join(self, group):
+        self._groups.add(group)
+        self._groups_changed()
+
+    def leave(self, group):
+        self._groups.discard(group)
+        self._groups_changed()
+
+    def _groups_changed(self):
+        cyberos.preferences['groups'] = list(self._groups)
+        cyberos.settings.on_save_settings.set()
+        for cyberware in self._paired:
+            cyberos.pairing.advertise(cyberware)
+
+    # Call the method registered on the paired cyberware and return its result args, None on timeout, e.g.
+    # "level, = await cyberos.event.call('BUTTON-02AD9A-WAY', 'get_battery', timeout_ms=500, retries=2)".
+    async def call(self, cyberware, method, *args, timeout_ms=1000, retries=0):
+        return await cyberos.rpc.call(cyberware, method, *args, timeout_ms=timeout_ms, retries=retries)
+
+    # Wait for the next event matching the sender and the name, None for any, e.g.
+    # "sender, name, args = await cyberos.event.next(name='on_click', timeout_ms=5000)". Returns None on timeout.
+    # Paired cyberwares send only the events we are subscribed to, see subscribe().
+    async def next(self, sender=None, name=None, timeout_ms=None):
+        waiter = self.subscribe(sender, name, 1)
+        try:
+            return await waiter.get(timeout_ms)
+        finally:
+            self.unsubscribe(waiter)
+
+    # Events matching the sender and the name without a task per event, e.g.
+    # "async for sender, name, args in cyberos.event.subscribe(name='on_click'):".
+    # The event name is advertised to the paired cyberwares like push() does and stays subscribed,
+    # so waiting in a loop does not resubscribe. Waiters for any name only get the events subscribed otherwise.
+    def subscribe(self, sender=None, name=None, size=4):
+        if name is not None and name not in self.CONTROL_EVENTS and name not in self._waited.get(sender, ()):
+            if sender not in self._waited:
+                self._waited[sender] = set()
+            self._waited[sender].add(name)
+            for cyberware in self._paired if sender is None else (sender,):
+                cyberos.pairing.advertise(cyberware)
+        waiter = Waiter(sender, name, size)
+        if name not in self._waiters:
+            self._waiters[name] = []
+        self._waiters[name].append(waiter)
+        return waiter
+
+    def unsubscribe(self, waiter):
+        waiters = self._waiters.get(waiter.name, ())
+        if waiter in waiters:
+            waiters.remove(waiter)
+            if not len(waiters):
+                del self._waiters[waiter.name]
+
+    # Add one more handler of the event, handlers are Events, callbacks or coroutine functions,
+    # e.g. "await cyberos.event.add('BUTTON-02AD9A-WAY', 'on_click', btn_clicked, timeout_ms=1000)".
+    async def add(self, cyberware_name, event_name, handler, timeout_ms=None):
+        if timeout_ms is not None:
+            self._timeouts[handler] = timeout_ms
+        events = self._events(cyberware_name)
+        if event_name not in events:
+            await self.push(cyberware_name, event_name, handler)
+        elif events[event_name].__class__.__name__ == 'list':
+            events[event_name].append(handler)
+        else:
+            events[event_name] = [events[event_name], handler]
+
+    # Remove the handler of the event, the event is pulled once it has no handlers left.
+    async def remove(self, cyberware_name, event_name, handler):
+        self._timeouts.pop(handler, None)
+        events = self._events(cyberware_name)
+        if event_name not in events:
+            return
+        handlers = events[event_name]
+        if handlers.__class__.__name__ == 'list' and handler in handlers:
+            handlers.remove(handler)
+            if len(handlers):
+                return
+        elif handlers is not handler:
+            return
+        await self.pull(cyberware_name, event_name)
@@ -0,0 +1,220 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS LOAD TEST
+#
+# Traffic generator and receiver statistics for throughput tests between paired cyberwares.
+
+# Load events are "on_load" with args (run id, sequence number, send time in ticks_us(), padding).
+# Both ends use Listener, so tests run over any transport the peer is routed over (see Listener.route()).
+# On a host the Loopback transport stands in for the radio, tests/test_loadtest.py runs a load test over it.
+
+import uasyncio as asyncio
+from utime import ticks_us, ticks_ms, ticks_diff, ticks_add
+import fildz_cyberos as cyberos
+
+_EVENT = 'on_load'
+
+
+class LoadTest:
+    _PENDING = 16  # Completions checked for the delivery result at the same time.
+
+    def __init__(self):
+        self._run = 0
+        self._task = None
+        # Sender.
+        self._peer = None
+        self._sent = 0
+        self._acked = 0
+        self._failed = 0
+        self._tx_bytes = 0
+        self._tx_ms = 0
+        self._rate = 0
+        self._size = 0
+        # Receiver.
+        self._source = None
+        self._rx_run = None
+        self._received = 0
+        self._rx_bytes = 0
+        self._last_seq = -1  # Highest sequence number received.
+        self._reordered = 0
+        self._duplicates = 0
+        self._jitter = 0  # Interarrival jitter in us as in RFC 3550.
+        self._first_us = 0
+        self._last_us = 0
+        self._last_transit = None
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def running(self):
+        return self._task is not None
+
+    ################################################################################
+    # Sender
+    #
+    # Send events to the paired cyberware at the rate (events per second) with the args size in bytes,
+    # e.g. "await cyberos.loadtest.run('DISPLAY-0F889A-ABW', rate=100, size=64, duration_ms=10000)".
+    # The receiver must listen() to the sender first, until it subscribes the load events are not sent at all
+    # (the "tx_filtered" metric) and count as failed.
+    async def run(self, cyberware, rate=50, size=32, duration_ms=10000):
+        self._run = (self._run + 1) & 0xFFFF
+        self._peer = cyberware
+        self._rate = rate
+        self._size = size
+        self._sent = 0
+        self._acked = 0
+        self._failed = 0
+        self._tx_bytes = 0
+        pending = []
+        interval = 1000000 // rate
+        start = ticks_ms()
+        due = ticks_us()
+        print('CYBEROS > Load test to {} at {} events/s, {} bytes'.format(cyberware, rate, size))
+        while ticks_diff(ticks_ms(), start) < duration_ms:
+            wait = ticks_diff(due, ticks_us())
+            if wait > 1000:
+                await asyncio.sleep_ms(wait // 1000)
+            elif wait < -4 * interval:
+                due = ticks_us()  # Falling behind, do not burst to catch up.
+            due = ticks_add(due, interval)
+
+            run, seq, sent = str(self._run), str(self._sent), str(ticks_us())
+            padding = size - len(run) - len(seq) - len(sent)
+            completion = await cyberos.event.send(_EVENT, run, seq, sent, bytes(padding if padding > 0 else 0),
+                                                  cyberware=cyberware)
+            self._sent += 1
+            self._tx_bytes += size
+            if completion is None:
+                self._failed += 1  # The cyberware is not listening.
+            else:
+                pending.append(completion)
+            # Count the results of the frames already sent.
+            while len(pending) and (pending[0].done or len(pending) >= self._PENDING):
+                self._count(await pending.pop(0).wait())
+            await asyncio.sleep(0)
+        for completion in pending:
+            self._count(await completion.wait())
+        self._tx_ms = ticks_diff(ticks_ms(), start)
+        print(self.report(), end='')
+        return self.report()
+
+    def _count(self, result):
+        if result is True:
+            self._acked += 1
+        else:
+            self._failed += 1
+
+    # Start the run in the background, e.g. from the HTTP route.
+    def start(self, cyberware, rate=50, size=32, duration_ms=10000):
+        if self._task is None:
+            self._task = asyncio.create_task(self._background(cyberware, rate, size, duration_ms))
+
+    async def _background(self, cyberware, rate, size, duration_ms):
+        try:
+            await self.run(cyberware, rate, size, duration_ms)
+        finally:
+            self._task = None
+
+    ################################################################################
+    # Receiver
+    #
+    # Measure load events of the paired cyberware, e.g. "await cyberos.loadtest.listen('BUTTON-02AD9A-WAY')".
+    async def listen(self, cyberware):
+        if self._source is not None and self._source != cyberware:
+            await cyberos.event.pull(self._source, _EVENT)
+        self._source = cyberware
+        self._rx_run = None
+        await cyberos.event.push(cyberware, _EVENT, self._on_load)
+
+    async def stop(self):
+        if self._source is not None:
+            await cyberos.event.pull(self._source, _EVENT)
+            self._source = None
+
+    # Runs inline in the dispatch task, so it only counts.
+    def _on_load(self):
+        args = cyberos.event.args
+        if len(args) < 3:
+            return
+        rx = cyberos.event.rx_us
+        try:
+            run, seq, sent = int(args[0]), int(args[1]), int(args[2])
+        except ValueError:
+            return
+        if run != self._rx_run:
+            # New run, start over.
+            self._rx_run = run
+            self._received = 0
+            self._rx_bytes = 0
+            self._last_seq = -1
+            self._reordered = 0
+            self._duplicates = 0
+            self._jitter = 0
+            self._first_us = rx
+            self._last_transit = None
+        self._received += 1
+        for arg in args:
+            self._rx_bytes += len(arg)
+        if seq > self._last_seq:
+            self._last_seq = seq
+        elif seq == self._last_seq:
+            self._duplicates += 1
+        else:
+            self._reordered += 1
+        # Transit time includes the clock offset, its change between events is the jitter.
+        transit = ticks_diff(rx, sent)
+        if self._last_transit is not None:
+            d = transit - self._last_transit
+            self._jitter += ((d if d > 0 else -d) - self._jitter) // 16
+        self._last_transit = transit
+        self._last_us = rx
+
+    ################################################################################
+    # Report
+    #
+    def report(self):
+        lines = ['# cyberos load test']
+        if self._peer is not None:
+            ms = self._tx_ms or 1
+            lines.append('tx peer=%s rate=%d size=%d sent=%d acked=%d failed=%d ms=%d rate_achieved=%d kbps=%d' % (
+                self._peer, self._rate, self._size, self._sent, self._acked, self._failed, self._tx_ms,
+                self._sent * 1000 // ms, self._tx_bytes * 8 // ms))
+        if self._rx_run is not None:
+            expected = self._last_seq + 1
+            lost = expected - self._received + self._duplicates
+            us = ticks_diff(self._last_us, self._first_us) or 1
+            lines.append('rx peer=%s run=%d received=%d lost=%d loss_pct=%d reordered=%d duplicates=%d '
+                         'goodput_kbps=%d jitter_us=%d' % (
+                             self._source, self._rx_run, self._received, lost if lost > 0 else 0,
+                             (lost if lost > 0 else 0) * 100 // (expected or 1), self._reordered, self._duplicates,
+                             self._rx_bytes * 8000 // us, self._jitter))
+        return '\n'.join(lines) + '\n'
+
+    # REPL helper, e.g. "cyberos.loadtest.dump()".
+    def dump(self):
+        print(self.report(), end='')
+
+    async def _route(self):
+        # /loadtest?peer=DISPLAY-0F889A-ABW&rate=100&size=64&duration_ms=10000 starts a run,
+        # /loadtest?listen=BUTTON-02AD9A-WAY listens to the sender, /loadtest shows the report.
+        @cyberos.server.route('/loadtest*')
+        async def loadtest(request):
+            params = {}
+            if '?' in request.url:
+                for param in request.url.split('?', 1)[1].split('&'):
+                    if '=' in param:
+                        key, value = param.split('=', 1)
+                        params[key] = value
+            if 'listen' in params:
+                await self.listen(params['listen'])
+            if 'peer' in params:
+                self.start(params['peer'], int(params.get('rate', 50)), int(params.get('size', 32)),
+                           int(params.get('duration_ms', 10000)))
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            await cyberos.server.write(request, self.report())
@@ -0,0 +1,156 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS METRICS
+#
+# Counters and fixed-bucket histograms fed by the event listener and the TX path.
+
+import uasyncio as asyncio
+from array import array
+import fildz_cyberos as cyberos
+
+
+class Histogram:
+    # Upper bucket bounds, last bucket counts everything above the last bound.
+    BOUNDS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+    def __init__(self, bounds=None):
+        self._bounds = self.BOUNDS if bounds is None else bounds
+        self._buckets = array('L', [0] * (len(self._bounds) + 1))
+        self._count = 0
+        self._total = 0
+        self._max = 0
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self._total // self._count if self._count else 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self._bounds:
+            if value <= bound:
+                break
+            i += 1
+        self._buckets[i] += 1
+        self._count += 1
+        self._total += value
+        if value > self._max:
+            self._max = value
+
+    def reset(self):
+        for i in range(len(self._buckets)):
+            self._buckets[i] = 0
+        self._count = 0
+        self._total = 0
+        self._max = 0
+
+
+class Metrics:
+    def __init__(self):
+        self._enabled = cyberos.preferences['metrics']
+
+        self._counters = {}  # Global counters (e.g., {'rx_decode_errors': 3}).
+        self._rx_events = {}  # Received frames per event name.
+        self._rx_peers = {}  # Received frames per sender name.
+        self._tx_events = {}  # Sent frames per event name.
+        self._tx_peers = {}  # Sent frames per receiver name.
+        self._histograms = {}  # Handler latency in microseconds per event name.
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    # Collect metrics, when disabled every hook is a single attribute check.
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['metrics'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def counters(self):
+        return self._counters
+
+    @property
+    def histograms(self):
+        return self._histograms
+
+    ################################################################################
+    # Hooks
+    #
+    def inc(self, key, n=1):
+        self._counters[key] = self._counters.get(key, 0) + n
+
+    def rx(self, sender, name):
+        self._rx_events[name] = self._rx_events.get(name, 0) + 1
+        self._rx_peers[sender] = self._rx_peers.get(sender, 0) + 1
+
+    def tx(self, receiver, name, ok=True):
+        self._tx_events[name] = self._tx_events.get(name, 0) + 1
+        self._tx_peers[receiver] = self._tx_peers.get(receiver, 0) + 1
+        if not ok:
+            self.inc('tx_failed')
+
+    def observe(self, key, value):
+        if key not in self._histograms:
+            self._histograms[key] = Histogram()
+        self._histograms[key].observe(value)
+
+    def reset(self):
+        for table in (self._counters, self._rx_events, self._rx_peers, self._tx_events, self._tx_peers):
+            table.clear()
+        self._histograms.clear()
+
+    ################################################################################
+    # Reports
+    #
+    def report(self):
+        lines = ['# cyberos metrics enabled=%d' % self._enabled]
+        for key in self._counters:
+            lines.append('cyberos_%s %d' % (key, self._counters[key]))
+        for label, table in (('rx_event', self._rx_events), ('rx_peer', self._rx_peers),
+                             ('tx_event', self._tx_events), ('tx_peer', self._tx_peers)):
+            for key in table:
+                lines.append('cyberos_%s{name="%s"} %d' % (label, key, table[key]))
+        for key in self._histograms:
+            histogram = self._histograms[key]
+            n = 0
+            for i, bound in enumerate(histogram.bounds):
+                n += histogram.buckets[i]
+                lines.append('cyberos_latency_us_bucket{name="%s",le="%d"} %d' % (key, bound, n))
+            lines.append('cyberos_latency_us_bucket{name="%s",le="+Inf"} %d' % (key, histogram.count))
+            lines.append('cyberos_latency_us_max{name="%s"} %d' % (key, histogram.max))
+        return '\n'.join(lines) + '\n'
+
+    # REPL helper, e.g. "cyberos.metrics.dump()".
+    def dump(self):
+        print(self.report(), end='')
+
+    async def _route(self):
+        @cyberos.server.route('/metrics')
+        async def metrics(request):
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            await cyberos.server.write(request, self.report())
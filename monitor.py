@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS MONITOR
+#
+# Event loop lag monitor and slow task detector.
+
+import uasyncio as asyncio
+from uasyncio import Event
+from utime import ticks_ms, ticks_diff
+import fildz_cyberos as cyberos
+from .metrics import Histogram
+
+
+# Create a named cyberos task, its time slices are measured once the monitor is enabled.
+def create_task(coro, name):
+    return asyncio.create_task(_tracked(coro, name))
+
+
+# Drive the coroutine one time slice at a time and time every slice.
+def _tracked(coro, name):
+    monitor = cyberos.monitor
+    if not monitor.enabled:
+        return (yield from coro)
+    value = None
+    exc = None
+    while True:
+        monitor._task = name
+        start = ticks_ms()
+        try:
+            if exc is None:
+                value = coro.send(value)
+            else:
+                value = coro.throw(exc)
+        except StopIteration as e:
+            return e.value
+        finally:
+            monitor._task = None
+            monitor._slice(name, ticks_diff(ticks_ms(), start))
+        try:
+            value = yield value
+            exc = None
+        except BaseException as e:
+            value = None
+            exc = e
+
+
+class Monitor:
+    _STALLS = 8  # Number of stalls kept.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['monitor']
+        self._period_ms = cyberos.preferences['monitor_ms']
+        self._stall_ms = cyberos.preferences['monitor_stall_ms']
+
+        self._on_enable = Event()
+        if self._enabled:
+            self._on_enable.set()
+
+        self._task = None  # Name of the cyberos task that is running right now.
+        self._slow_task = None  # Name of the slowest task slice since the last loop tick.
+        self._slow_ms = 0
+        self._lag = Histogram((1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+        self._slices = {}  # Longest slice in milliseconds per task name.
+        self._stalls = []  # Last stalls as (lag in ms, task name).
+
+        asyncio.create_task(self._event_monitor())
+
+        # Routes.
+        asyncio.create_task(self._route())
+
+    ################################################################################
+    # Properties
+    #
+    # Already running tasks are measured only after the reboot.
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['monitor'] = value
+        cyberos.settings.on_save_settings.set()
+        if value:
+            self._on_enable.set()
+        else:
+            self._on_enable.clear()
+
+    # Lag above this value is recorded as a stall.
+    @property
+    def stall_ms(self):
+        return self._stall_ms
+
+    @stall_ms.setter
+    def stall_ms(self, value):
+        self._stall_ms = value
+        cyberos.preferences['monitor_stall_ms'] = value
+        cyberos.settings.on_save_settings.set()
+
+    # Name of the cyberos task that is running right now.
+    @property
+    def task(self):
+        return self._task
+
+    @property
+    def lag(self):
+        return self._lag
+
+    @property
+    def stalls(self):
+        return self._stalls
+
+    ################################################################################
+    # Hooks
+    #
+    def _slice(self, name, ms):
+        if ms > self._slow_ms:
+            self._slow_ms = ms
+            self._slow_task = name
+        if ms > self._slices.get(name, -1):
+            self._slices[name] = ms
+
+    ################################################################################
+    # Tasks
+    #
+    async def _event_monitor(self):
+        while True:
+            await self._on_enable.wait()
+            start = ticks_ms()
+            await asyncio.sleep_ms(self._period_ms)
+            lag = ticks_diff(ticks_ms(), start) - self._period_ms
+            if lag < 0:
+                lag = 0
+            self._lag.observe(lag)
+            if lag >= self._stall_ms:
+                if len(self._stalls) >= self._STALLS:
+                    self._stalls.pop(0)
+                self._stalls.append((lag, self._slow_task))
+            self._slow_task = None
+            self._slow_ms = 0
+
+    ################################################################################
+    # Reports
+    #
+    def report(self):
+        lines = ['# cyberos monitor enabled=%d period_ms=%d' % (self._enabled, self._period_ms)]
+        n = 0
+        for i, bound in enumerate(self._lag.bounds):
+            n += self._lag.buckets[i]
+            lines.append('cyberos_loop_lag_ms_bucket{le="%d"} %d' % (bound, n))
+        lines.append('cyberos_loop_lag_ms_bucket{le="+Inf"} %d' % self._lag.count)
+        lines.append('cyberos_loop_lag_ms_max %d' % self._lag.max)
+        for name in self._slices:
+            lines.append('cyberos_task_slice_ms_max{task="%s"} %d' % (name, self._slices[name]))
+        for lag, name in self._stalls:
+            lines.append('cyberos_stall_ms{task="%s"} %d' % (name, lag))
+        return '\n'.join(lines) + '\n'
+
+    # REPL helper, e.g. "cyberos.monitor.dump()".
+    def dump(self):
+        print(self.report(), end='')
+
+    async def _route(self):
+        @cyberos.server.route('/monitor')
+        async def monitor(request):
+            await cyberos.server.write(request, 'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n')
+            await cyberos.server.write(request, self.report())
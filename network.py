@@ -15,8 +15,49 @@
 import uasyncio as asyncio
 from uasyncio import Event
 import fildz_cyberos as cyberos
+from .monitor import create_task
 import network
-from .network_utils import _event_ap_pixel, _event_ap_power_button, _ap_color_code_update
+from .network_utils import _event_ap_power_button, _ap_color_code_update, _APPixel
+
+# Interfaces.
+_STA = 0
+_AP = 1
+
+# Requested interface states.
+_DOWN = 0
+_UP = 1
+_CYCLE = 2  # Bring the interface up to apply the channel, leave it as it was.
+
+# Requests to (interface, requested state).
+_REQUESTS = {
+    'sta_up': (_STA, _UP),
+    'sta_down': (_STA, _DOWN),
+    'ap_up': (_AP, _UP),
+    'ap_down': (_AP, _DOWN),
+    'ap_cycle': (_AP, _CYCLE),
+}
+
+# (Interface is active, requested state) to the transitions, True brings the interface up, False down.
+# Pairs that are not listed are already in the requested state.
+_TRANSITIONS = {
+    (False, _UP): (True,),
+    (True, _DOWN): (False,),
+    (False, _CYCLE): (True, False),
+    (True, _CYCLE): (True,),
+}
+
+
+# Deprecated Events of the removed interface tasks, kept for one release. Setting one runs what the task did,
+# e.g. "cyberos.network.on_ap_up.set()" is "cyberos.network.request('ap_up')". Waiting tasks are woken.
+class _Deprecated(Event):
+    def __init__(self, action):
+        super().__init__()
+        self._action = action
+
+    def set(self):
+        super().set()
+        self.clear()
+        self._action()
 
 
 class Network:
@@ -42,20 +83,23 @@ class Network:
         self._ch_reset = cyberos.preferences['ch_reset']
         self._ch_update = cyberos.preferences['ch_update']
 
-        self._on_sta_up = Event()
-        self._on_sta_down = Event()
+        self._requests = [None, None]  # Pending requested state per interface, the last request wins.
+        self._on_request = Event()
+        self._on_sta_up = _Deprecated(lambda: self.request('sta_up'))
+        self._on_sta_down = _Deprecated(lambda: self.request('sta_down'))
+        self._on_ap_up = _Deprecated(lambda: self.request('ap_up'))
+        self._on_ap_down = _Deprecated(lambda: self.request('ap_down'))
+
         self._on_sta_active = Event()
         self._on_sta_connected = Event()
         self._on_sta_disconnected = Event()
 
-        self._on_ap_up = Event()
-        self._on_ap_down = Event()
         self._on_ap_active = Event()
 
         self._on_ch_change = Event()
         self._on_wlan_change = Event()
 
-        self._on_ap_pixel = Event()
+        self._on_ap_pixel = _APPixel()
 
         # We must generate cyberware AP SSID and color code on first start.
         if self._ap_ssid is None:
@@ -64,26 +108,13 @@ class Network:
         if self._sta_hostname is None:
             self.sta_hostname = ''  # Reset the hostname to default value.
 
-        if self._sta_boot:
-            self._on_sta_up.set()
-        else:
-            self._on_sta_down.set()
-
-        if self._ap_boot:
-            self._on_ap_up.set()
-        else:
-            self._on_ap_up.set()  # To update the STA/AP channel.
-            self._on_ap_down.set()
+        self.request('sta_up' if self._sta_boot else 'sta_down')
+        self.request('ap_up' if self._ap_boot else 'ap_cycle')  # To update the STA/AP channel.
 
         self._on_sta_disconnected.set()
 
-        asyncio.create_task(self._event_sta_up())
-        asyncio.create_task(self._event_sta_down())
-        asyncio.create_task(self._event_ap_up())
-        asyncio.create_task(self._event_ap_down())
-        asyncio.create_task(self._event_ch_change())
-        asyncio.create_task(_event_ap_power_button())
-        asyncio.create_task(_event_ap_pixel())
+        create_task(self._event_network(), 'network.state')
+        create_task(_event_ap_power_button(), 'network.ap_power_button')
 
         # Events.
         asyncio.create_task(self._push())
@@ -135,6 +166,11 @@ class Network:
         cyberos.preferences['sta_reconnects'] = value
         cyberos.settings.on_save_settings.set()
 
+    # STA IP address once connected.
+    @property
+    def sta_ip(self):
+        return self._sta_if.ifconfig()[0]
+
     @property
     def sta_hostname(self):
         return self._sta_hostname
@@ -251,14 +287,6 @@ class Network:
     def on_sta_active(self):
         return self._on_sta_active
 
-    @property
-    def on_sta_up(self):
-        return self._on_sta_up
-
-    @property
-    def on_sta_down(self):
-        return self._on_sta_down
-
     @property
     def on_sta_connected(self):
         return self._on_sta_connected
@@ -271,25 +299,49 @@ class Network:
     def on_ap_active(self):
         return self._on_ap_active
 
+    @property
+    def on_ch_change(self):
+        return self._on_ch_change
+
+    # Deprecated, use cyberos.feedback.pattern() instead.
+    @property
+    def on_ap_pixel(self):
+        return self._on_ap_pixel
+
+    # Deprecated, use request('sta_up') instead.
+    @property
+    def on_sta_up(self):
+        return self._on_sta_up
+
+    # Deprecated, use request('sta_down') instead.
+    @property
+    def on_sta_down(self):
+        return self._on_sta_down
+
+    # Deprecated, use request('ap_up') instead.
     @property
     def on_ap_up(self):
         return self._on_ap_up
 
+    # Deprecated, use request('ap_down') instead.
     @property
     def on_ap_down(self):
         return self._on_ap_down
 
-    @property
-    def on_ch_change(self):
-        return self._on_ch_change
-
     @property
     def on_wlan_change(self):
         return self._on_wlan_change
 
-    @property
-    def on_ap_pixel(self):
-        return self._on_ap_pixel
+    ################################################################################
+    # State
+    #
+    # Request the interface state, e.g. "cyberos.network.request('ap_up')".
+    # Requests are applied in order by the network task, a newer request of the same interface replaces
+    # the pending one, so AP up immediately followed by AP down does nothing.
+    def request(self, name):
+        interface, state = _REQUESTS[name]
+        self._requests[interface] = state
+        self._on_request.set()
 
     ################################################################################
     # Tasks
@@ -344,17 +396,29 @@ class Network:
         self._sta_if.config(pm=network.WLAN.PM_PERFORMANCE)
 
         if self._ch_reset and not cyberos.pairing.on_pair.is_set():
-            if self._on_ap_active.is_set():
-                self._on_ap_up.set()
-            else:
-                self._on_ap_up.set()
-                self._on_ap_down.set()
+            self.request('ap_cycle')
         self._on_wlan_change.set()
         print('CYBEROS > Disconnected from', self._sta_ssid)
 
-    async def _event_sta_up(self):
+    # Single owner of the interface transitions.
+    async def _event_network(self):
         while True:
-            await self._on_sta_up.wait()
+            await self._on_request.wait()
+            self._on_request.clear()
+            for interface in (_STA, _AP):
+                state = self._requests[interface]
+                if state is None:
+                    continue
+                self._requests[interface] = None
+                wlan = self._sta_if if interface == _STA else self._ap_if
+                for up in _TRANSITIONS.get((wlan.active(), state), ()):
+                    if interface == _STA:
+                        await self._sta(up)
+                    else:
+                        await self._ap(up)
+
+    async def _sta(self, up):
+        if up:
             self._sta_if.active(True)
             while not self._sta_if.active():
                 await asyncio.sleep(0)
@@ -362,23 +426,16 @@ class Network:
                                 auto_connect=False,
                                 reconnects=0,
                                 pm=network.WLAN.PM_PERFORMANCE)
-            self._on_sta_up.clear()
             self._on_sta_active.set()
-            self._on_wlan_change.set()
             print('CYBEROS > STA up')
-
-    async def _event_sta_down(self):
-        while True:
-            await self._on_sta_down.wait()
+        else:
             self._sta_if.active(False)
-            self._on_sta_down.clear()
             self._on_sta_active.clear()
-            self._on_wlan_change.set()
             print('CYBEROS > STA down')
+        self._on_wlan_change.set()
 
-    async def _event_ap_up(self):
-        while True:
-            await self._on_ap_up.wait()
+    async def _ap(self, up):
+        if up:
             self._ap_if.active(True)
             while not self._ap_if.active():
                 await asyncio.sleep(0)
@@ -386,23 +443,13 @@ class Network:
                                key=self._ap_key,
                                mac=cyberos.cyberware.mac_public,
                                channel=self._ap_ch)
-
-            self._on_ap_up.clear()
             self._on_ap_active.set()
-            self._on_wlan_change.set()
             print('CYBEROS > AP up')
-
-    async def _event_ap_down(self):
-        while True:
-            await self._on_ap_down.wait()
+        else:
             self._ap_if.active(False)
-            self._on_ap_down.clear()
             self._on_ap_active.clear()
-            self._on_wlan_change.set()
             print('CYBEROS > AP down')
-
-    async def _event_ch_change(self):
-        pass
+        self._on_wlan_change.set()
 
     async def _push(self):
         cyberos.cyberwares[self._ap_ssid] = (
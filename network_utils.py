@@ -8,6 +8,7 @@
 
 import fildz_cyberos as cyberos
 import uasyncio as asyncio
+from uasyncio import Event
 
 
 # Generate AP name and color code.
@@ -35,28 +36,33 @@ async def _event_ap_power_button():
             await asyncio.wait_for(cyberos.cyberware.power_button.on_up.wait(), 3)
         except asyncio.TimeoutError:
             if cyberos.network.on_ap_active.is_set():
-                cyberos.network.on_ap_down.set()
-                cyberos.network.on_ap_pixel.clear()
-                await asyncio.sleep(0)  # Fix for first tones play far too long.
-                await cyberos.cyberware.buzzer.play(index=1)
+                cyberos.network.request('ap_down')
+                cyberos.feedback.pattern(None, cyberos.cyberware.pixel.C_GREEN)
+                cyberos.feedback.tone(1)
             else:
-                cyberos.network.on_ap_up.set()
-                cyberos.network.on_ap_pixel.set()
-                await asyncio.sleep(0)  # Fix for first tones play far too long.
-                await cyberos.cyberware.buzzer.play(index=0)
+                cyberos.network.request('ap_up')
+                cyberos.feedback.pattern(_ap_pixel_pattern())
+                cyberos.feedback.tone(0)
             if cyberos.cyberware.power_button.on_hold.is_set():
                 await cyberos.cyberware.power_button.on_up.wait()
 
 
-# Enable built-in LED RGB to show color code once AP is enabled via power button.
-async def _event_ap_pixel():
-    while True:
-        await cyberos.network.on_ap_pixel.wait()
-        for color in [cyberos.network.ap_color[0], cyberos.network.ap_color[1], cyberos.network.ap_color[2]]:
-            await cyberos.cyberware.pixel.set_color(color=color)
-            await asyncio.sleep_ms(500)
-            await cyberos.cyberware.pixel.set_color(color=cyberos.cyberware.pixel.C_BLANK)
-            await asyncio.sleep_ms(500)
-        await asyncio.sleep_ms(1000)
-        if not cyberos.network.on_ap_pixel.is_set():
-            await cyberos.cyberware.pixel.set_color(color=cyberos.cyberware.pixel.C_GREEN)
+# Built-in LED RGB shows the color code once AP is enabled via power button.
+def _ap_pixel_pattern():
+    blank = cyberos.cyberware.pixel.C_BLANK
+    return ((cyberos.network.ap_color[0], 500), (blank, 500),
+            (cyberos.network.ap_color[1], 500), (blank, 500),
+            (cyberos.network.ap_color[2], 500), (blank, 1500))
+
+
+# Deprecated, kept for one release: the color code blinks while the Event is set, use cyberos.feedback.pattern().
+class _APPixel(Event):
+    def set(self):
+        if not self.is_set():
+            cyberos.feedback.pattern(_ap_pixel_pattern())
+        super().set()
+
+    def clear(self):
+        if self.is_set():
+            cyberos.feedback.pattern(None, cyberos.cyberware.pixel.C_GREEN)
+        super().clear()
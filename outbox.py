@@ -0,0 +1,232 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS OUTBOX
+#
+# Store-and-forward of events to offline paired cyberwares in append-only logs on flash.
+
+import os
+import ustruct as struct
+import uasyncio as asyncio
+from uasyncio import Event
+from ucollections import deque
+from utime import time
+from random import getrandbits
+import fildz_cyberos as cyberos
+from .monitor import create_task
+
+# Record header: time stored, boot it was stored in, frame length (UDP frames are longer than 255 bytes).
+_HEADER = '<IHH'
+_HEADER_SIZE = 8
+
+# time() of 2023-01-01 since the MicroPython epoch, the RTC was set (e.g., by NTP) if it is later than this.
+_SYNCED = 725846400
+
+
+class Outbox:
+    _DIR = '/outbox/'
+    _PENDING = 8  # Frames waiting in RAM to be written, so the TX path never writes to flash.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['outbox']
+        self._size = cyberos.preferences['outbox_size']  # Log size limit per cyberware in bytes.
+        self._ttl_s = cyberos.preferences['outbox_ttl_s']  # Stored events older than this are not sent.
+        self._pace_ms = cyberos.preferences['outbox_pace_ms']  # Time between sent stored events.
+        self._probe_ms = cyberos.preferences['outbox_probe_ms']  # Time between retries of silent offline cyberwares.
+
+        self._dir = cyberos.settings._CONFIG_DIR + self._DIR
+        self._boot = getrandbits(16)  # Records of this boot, their time is comparable even without a set RTC.
+        self._offline = set()  # Cyberwares with a backlog, their events are stored until it is sent.
+        self._drain = set()  # Offline cyberwares seen again.
+        self._pending = deque((), self._PENDING)  # Frames to write as (cyberware, time stored, frame).
+        self._on_work = Event()  # Frames to write or cyberwares to drain.
+        self._header = bytearray(_HEADER_SIZE)
+        self._stored = 0
+        self._sent = 0
+        self._dropped = 0
+        self._expired = 0
+
+        if self._enabled:
+            try:
+                # Backlogs survive reboots.
+                for name in os.listdir(self._dir):
+                    if name[-4:] == '.tmp':
+                        # Compaction was interrupted, the log is either gone or still complete.
+                        if name[:-4] in os.listdir(self._dir):
+                            os.remove(self._dir + name)
+                            continue
+                        os.rename(self._dir + name, self._dir + name[:-4])
+                        name = name[:-4]
+                    self._offline.add(name)
+            except OSError:
+                os.mkdir(self._dir[:-1])
+            create_task(self._event_outbox(), 'outbox.outbox')
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    # Takes effect on the next reboot.
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['outbox'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def offline(self):
+        return self._offline
+
+    @property
+    def stored(self):
+        return self._stored
+
+    @property
+    def sent(self):
+        return self._sent
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def expired(self):
+        return self._expired
+
+    ################################################################################
+    # Store
+    #
+    # Queue the encoded frame for the cyberware log, the cyberware is offline until the log is sent.
+    # Called from the TX path, the outbox task writes the frame to flash.
+    def store(self, cyberware, event):
+        if len(self._pending) == self._PENDING:
+            self._drop()
+            return False
+        self._pending.append((cyberware, time(), event))
+        self._offline.add(cyberware)
+        self._on_work.set()
+        return True
+
+    # Any frame received from the cyberware, send its backlog.
+    def seen(self, cyberware):
+        if cyberware in self._offline and cyberware not in self._drain:
+            self._drain.add(cyberware)
+            self._on_work.set()
+
+    def clear(self, cyberware):
+        try:
+            os.remove(self._dir + cyberware)
+        except OSError:
+            pass
+        self._offline.discard(cyberware)
+
+    def _drop(self):
+        self._dropped += 1
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('outbox_dropped')
+
+    # Append the queued frames to the logs.
+    async def _write(self):
+        while len(self._pending):
+            cyberware, stored, event = self._pending.popleft()
+            path = self._dir + cyberware
+            try:
+                size = os.stat(path)[6]
+            except OSError:
+                size = 0
+            if size + _HEADER_SIZE + len(event) > self._size:
+                self._drop()
+                continue
+            struct.pack_into(_HEADER, self._header, 0, stored, self._boot, len(event))
+            with open(path, 'ab') as log:
+                log.write(self._header)
+                log.write(event)
+            self._stored += 1
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('outbox_stored')
+            await asyncio.sleep(0)
+
+    # Is the stored record older than the TTL? Unknown ages are not expired: the RTC was set since the record was
+    # stored, or it is not set and the record is from an earlier boot.
+    def _expired_record(self, stored, boot):
+        now = time()
+        synced = now >= _SYNCED
+        if synced != (stored >= _SYNCED) or not synced and boot != self._boot:
+            return False
+        return now - stored > self._ttl_s
+
+    ################################################################################
+    # Tasks
+    #
+    # Single owner of the logs: writes queued frames, sends the backlogs of cyberwares seen again and retries
+    # offline cyberwares that only receive and would never be seen.
+    async def _event_outbox(self):
+        while True:
+            try:
+                await asyncio.wait_for_ms(self._on_work.wait(), self._probe_ms)
+            except asyncio.TimeoutError:
+                for cyberware in self._offline:
+                    self._drain.add(cyberware)
+            self._on_work.clear()
+            await self._write()
+            while len(self._drain):
+                cyberware = self._drain.pop()
+                if cyberware not in cyberos.cyberwares['subscribed'] \
+                        or 'mac' not in cyberos.cyberwares['subscribed'][cyberware]:
+                    self.clear(cyberware)  # No longer paired.
+                    continue
+                await self._send(cyberware)
+
+    # Send stored frames one by one, the log is read a record at a time and only rewritten if a frame fails.
+    async def _send(self, cyberware):
+        path = self._dir + cyberware
+        mac = cyberos.cyberwares['subscribed'][cyberware]['mac']
+        offset = 0
+        while True:
+            await self._write()  # Frames stored meanwhile go behind the backlog.
+            try:
+                with open(path, 'rb') as log:
+                    log.seek(offset)
+                    if log.readinto(self._header) != _HEADER_SIZE:
+                        break  # Everything was sent, events stored meanwhile included.
+                    stored, boot, n = struct.unpack(_HEADER, self._header)
+                    event = bytearray(log.read(n))
+            except OSError:
+                break
+            if len(event) != n:
+                break  # Torn record of the interrupted write.
+            if self._expired_record(stored, boot):
+                self._expired += 1
+                offset += _HEADER_SIZE + n
+                continue
+            # Data lane of the transmitter, which restamps the frame so time spent in the log does not add to
+            # the latency. Failed 'outbox' frames are not stored again, the log keeps them.
+            completion = await cyberos.tx.submit(mac, event, cyberware, 'outbox')
+            if await completion.wait() is not True:
+                # Gone again, keep the rest of the log.
+                self._compact(path, offset)
+                return
+            self._sent += 1
+            offset += _HEADER_SIZE + n
+            await asyncio.sleep_ms(self._pace_ms)
+        self.clear(cyberware)
+
+    # Drop the sent part of the log.
+    def _compact(self, path, offset):
+        if not offset:
+            return
+        with open(path, 'rb') as log:
+            log.seek(offset)
+            with open(path + '.tmp', 'wb') as tail:
+                buf = bytearray(64)
+                while True:
+                    n = log.readinto(buf)
+                    if not n:
+                        break
+                    tail.write(buf if n == len(buf) else memoryview(buf)[:n])
+        os.remove(path)
+        os.rename(path + '.tmp', path)
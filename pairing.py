@@ -14,6 +14,7 @@ import uasyncio as asyncio
 from uasyncio import Event
 import ubinascii
 import fildz_cyberos as cyberos
+from .monitor import create_task
 
 
 class Pairing:
@@ -21,10 +22,16 @@ class Pairing:
         self._on_pair = Event()
         self._on_pairing = Event()
         self._on_paired = Event()
+        self._on_peer_id = Event()
+        self._on_advertise = Event()
+        self._advertise = set()  # Paired cyberwares our subscriptions changed for.
 
-        asyncio.create_task(self._event_pair())
-        asyncio.create_task(self._event_pairing())
-        asyncio.create_task(self._event_pairing_mode())
+        create_task(self._event_pair(), 'pairing.pair')
+        create_task(self._event_pairing(), 'pairing.pairing')
+        create_task(self._event_pairing_mode(), 'pairing.pairing_mode')
+        create_task(self._event_peer_id(), 'pairing.peer_id')
+        create_task(self._event_groups(), 'pairing.groups')
+        create_task(self._event_advertise(), 'pairing.advertise')
 
         # Events.
         asyncio.create_task(self._push())
@@ -44,6 +51,10 @@ class Pairing:
     def on_paired(self):
         return self._on_paired
 
+    @property
+    def on_peer_id(self):
+        return self._on_peer_id
+
     ################################################################################
     # Tasks
     #
@@ -69,9 +80,9 @@ class Pairing:
 
                 if _sta_reconnect:
                     await cyberos.network.disconnect()
-                    cyberos.network.on_ap_up.set()
+                    cyberos.network.request('ap_up')
                 elif _ap_disable:
-                    cyberos.network.on_ap_up.set()
+                    cyberos.network.request('ap_up')
 
                 await asyncio.sleep(0)  # Wait for all the events to complete.
                 await asyncio.sleep(3)
@@ -80,7 +91,7 @@ class Pairing:
                 if _sta_reconnect:
                     await cyberos.network.connect(cyberos.network.sta_ssid, cyberos.network.sta_key)
                 if _ap_disable:
-                    cyberos.network.on_ap_down.set()
+                    cyberos.network.request('ap_down')
                 if cyberos.cyberware.power_button.on_hold.is_set():
                     await cyberos.cyberware.power_button.on_up.wait()
 
@@ -95,44 +106,126 @@ class Pairing:
             # Send pairing request every second.
             while self._on_pair.is_set() and cyberos.network.on_ap_active.is_set():
                 print('CYBEROS > Pairing mode')
-                await cyberos.espnow.asend(cyberos.cyberware.mac_public, event, sync=False)
-                await cyberos.cyberware.buzzer.play(4)
+                await cyberos.event.asend(cyberos.cyberware.mac_public, event, '', 'on_pairing', sync=False)
+                cyberos.feedback.tone(4)
                 await asyncio.sleep(1)
 
     # Received a new pairing request.
+    # Waiters get the sender and the args of each request, the Events are set for compatibility only.
     async def _event_pairing(self):
-        while True:
-            await self._on_pairing.wait()
+        async for sender, name, args in cyberos.event.subscribe(name='on_pairing'):
+            self._on_pairing.clear()
             # Pairing mode is active?
-            if self._on_pair.is_set():
-                # Are we paired with the cyberware?
-                if cyberos.event.sender in cyberos.cyberwares['subscribed']:
-                    if 'mac' in cyberos.cyberwares['subscribed'][cyberos.event.sender]:
-                        self._on_pairing.clear()
-                        continue
-                    else:
-                        # We are not paired, but subscribed to cyberware events.
-                        cyberos.cyberwares['subscribed'][cyberos.event.sender].update({
-                            'mac': cyberos.event.args[0],
-                            'mac_str': ubinascii.hexlify(cyberos.event.args[0], ':').decode().upper(),
-                            'ch': int.from_bytes(cyberos.event.args[1], 'little')})
-                else:
-                    cyberos.cyberwares['subscribed'][cyberos.event.sender] = {
-                        'mac': cyberos.event.args[0],
-                        'mac_str': ubinascii.hexlify(cyberos.event.args[0], ':').decode().upper(),
-                        'ch': int.from_bytes(cyberos.event.args[1], 'little'),
-                        'events': {}}
-                print('CYBEROS > Paired with', cyberos.event.sender)
-                self._on_paired.set()
-                cyberos.settings.on_save_cyberwares.set()
-                self._on_pairing.clear()
-                self._on_paired.clear()
-                await cyberos.cyberware.buzzer.play(2)
+            if not self._on_pair.is_set():
+                continue
+            if cyberos.heap.enabled:
+                mark = cyberos.heap.begin()
+            # Are we paired with the cyberware?
+            if sender in cyberos.cyberwares['subscribed']:
+                if 'mac' in cyberos.cyberwares['subscribed'][sender]:
+                    continue
+                # We are not paired, but subscribed to cyberware events.
+                cyberos.cyberwares['subscribed'][sender].update({
+                    'mac': args[0],
+                    'mac_str': ubinascii.hexlify(args[0], ':').decode().upper(),
+                    'ch': int.from_bytes(args[1], 'little')})
             else:
-                self._on_pairing.clear()
+                cyberos.cyberwares['subscribed'][sender] = {
+                    'mac': args[0],
+                    'mac_str': ubinascii.hexlify(args[0], ':').decode().upper(),
+                    'ch': int.from_bytes(args[1], 'little'),
+                    'events': {}}
+            print('CYBEROS > Paired with', sender)
+            self._assign_peer_id(sender)
+            cyberos.event.index_subscribers()
+            if cyberos.heap.enabled:
+                cyberos.heap.end('pairing', mark)
+            self._on_paired.set()
+            cyberos.settings.on_save_cyberwares.set()
+            self._on_paired.clear()
+            await self.send_peer_id(sender)
+            cyberos.feedback.tone(2, priority=1)
+
+    # Received a peer id and event name ids to use in compact frames to the sender.
+    async def _event_peer_id(self):
+        async for sender, name, args in cyberos.event.subscribe(name='on_peer_id'):
+            self._on_peer_id.clear()
+            # Peer ids are accepted from paired cyberwares or while pairing.
+            if self._on_pair.is_set() or (sender in cyberos.cyberwares['subscribed']
+                                          and 'mac' in cyberos.cyberwares['subscribed'][sender]):
+                if sender not in cyberos.cyberwares['subscribed']:
+                    cyberos.cyberwares['subscribed'][sender] = {'events': {}}
+                # Event names are the events the sender wants from us, empty names are unsubscribed events.
+                names = {}
+                for i, name in enumerate(args[1:]):
+                    if len(name):
+                        names[name] = i
+                cyberos.cyberwares['subscribed'][sender].update({
+                    'tx_id': int.from_bytes(args[0], 'little'),
+                    'tx_names': names})
+                cyberos.event.index_subscribers()
+                cyberos.settings.on_save_cyberwares.set()
+
+    # Received the groups the paired cyberware is a member of.
+    async def _event_groups(self):
+        async for sender, name, args in cyberos.event.subscribe(name='on_groups'):
+            if 'mac' in cyberos.cyberwares['subscribed'].get(sender, ()):
+                cyberos.cyberwares['subscribed'][sender]['groups'] = args
+                cyberos.event.index_subscribers()
+                cyberos.settings.on_save_cyberwares.set()
+
+    ################################################################################
+    # Peer ids
+    #
+    # Give the paired cyberware a 1 byte peer id that is unique among our paired cyberwares.
+    def _assign_peer_id(self, cyberware):
+        if 'id' in cyberos.cyberwares['subscribed'][cyberware]:
+            return
+        ids = set()
+        for name in cyberos.cyberwares['subscribed']:
+            if 'id' in cyberos.cyberwares['subscribed'][name]:
+                ids.add(cyberos.cyberwares['subscribed'][name]['id'])
+        for peer_id in range(256):
+            if peer_id not in ids:
+                cyberos.cyberwares['subscribed'][cyberware]['id'] = peer_id
+                cyberos.event.index_ids()
+                return
+
+    # Send the peer id and the names of the events we are subscribed to, their index is the event name id.
+    # Indexes never move, so compact frames in flight keep their meaning: unsubscribed names are emptied
+    # and new names are appended.
+    async def send_peer_id(self, cyberware):
+        peer = cyberos.cyberwares['subscribed'][cyberware]
+        if 'id' not in peer:
+            return
+        peer_id = peer['id'].to_bytes(1, 'little')
+        events = cyberos.event.event_names(cyberware)
+        names = [name if name in events else '' for name in peer.get('names', ())]
+        for name in events:
+            if name not in names and len(names) < 255:
+                names.append(name)
+        peer['names'] = names
+        await cyberos.event.send('on_peer_id', peer_id, *names, cyberware=cyberware, sync=False)
+        await cyberos.event.send('on_groups', *cyberos.event.groups, cyberware=cyberware, sync=False)
+
+    # Advertise our subscriptions and groups to the paired cyberware again.
+    def advertise(self, cyberware):
+        if 'id' in cyberos.cyberwares['subscribed'].get(cyberware, ()):
+            self._advertise.add(cyberware)
+            self._on_advertise.set()
+
+    async def _event_advertise(self):
+        while True:
+            await self._on_advertise.wait()
+            await asyncio.sleep_ms(100)  # Collect subscription changes made together.
+            self._on_advertise.clear()
+            while len(self._advertise):
+                await self.send_peer_id(self._advertise.pop())
+            cyberos.settings.on_save_cyberwares.set()
 
     async def _push(self):
         cyberos.cyberwares[cyberos.network.ap_ssid]['events'].update(
             {
                 'on_pairing': self._on_pairing,
+                'on_peer_id': self._on_peer_id,
             })
@@ -0,0 +1,133 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS PEERS
+#
+# On-demand ESP-NOW peer table with least recently used eviction.
+
+import fildz_cyberos as cyberos
+
+
+class Peers:
+    def __init__(self):
+        self._enabled = cyberos.preferences['peers']
+        self._max = cyberos.preferences['peers_max']  # Registered peers, pinned ones not included.
+
+        self._peers = {}  # Peer MAC to last use.
+        self._pinned = set()  # Peer MACs that are never evicted (e.g., public MAC).
+        self._clock = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['peers'] = value
+        cyberos.settings.on_save_settings.set()
+
+    # ESP8266 supports up to 20 peers, keep room for the pinned ones.
+    @property
+    def max(self):
+        return self._max
+
+    @max.setter
+    def max(self, value):
+        self._max = value
+        cyberos.preferences['peers_max'] = value
+        cyberos.settings.on_save_settings.set()
+        while len(self._peers) > self._max:
+            self._evict()
+
+    @property
+    def peers(self):
+        return self._peers
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    # Hit rate in percent.
+    @property
+    def hit_rate(self):
+        total = self._hits + self._misses
+        return self._hits * 100 // total if total else 0
+
+    ################################################################################
+    # Peers
+    #
+    def pin(self, mac):
+        if mac not in self._pinned:
+            self._pinned.add(mac)
+            self._add(mac)
+            self._peers.pop(mac, None)
+
+    # Make sure the MAC address is registered before we send to it.
+    def ensure(self, mac):
+        if mac in self._pinned:
+            return
+        self._clock += 1
+        if mac in self._peers:
+            self._hits += 1
+            self._peers[mac] = self._clock
+            return
+        self._misses += 1
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('peers_misses')
+        if len(self._peers) >= self._max:
+            self._evict()
+        mac = bytes(mac)
+        if not self._add(mac):
+            # Peer table is full with peers we do not know about, make room and try again.
+            self._evict()
+            self._add(mac)
+        self._peers[mac] = self._clock
+
+    def _add(self, mac):
+        try:
+            cyberos.espnow.add_peer(mac)
+        except OSError as exc:
+            if len(exc.args) > 1 and exc.args[1] == 'ESP_ERR_ESPNOW_FULL':
+                return False
+            # ESP_ERR_ESPNOW_EXIST, the peer was registered before.
+        return True
+
+    def _evict(self):
+        lru = None
+        for mac in self._peers:
+            if lru is None or self._peers[mac] < self._peers[lru]:
+                lru = mac
+        if lru is None:
+            return
+        del self._peers[lru]
+        self._evictions += 1
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('peers_evictions')
+        try:
+            cyberos.espnow.del_peer(lru)
+        except OSError:
+            pass
+
+    def forget(self, mac):
+        if mac in self._peers:
+            del self._peers[mac]
+            try:
+                cyberos.espnow.del_peer(mac)
+            except OSError:
+                pass
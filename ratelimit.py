@@ -0,0 +1,159 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS RATE LIMIT
+#
+# Per sender token bucket rate limiting and flood protection.
+
+from utime import ticks_ms, ticks_diff, ticks_add
+import fildz_cyberos as cyberos
+
+
+class RateLimit:
+    _SENDERS = 16  # Number of sender buckets kept.
+    _BLOCKLIST = 8  # Number of blocked senders kept.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['rl']
+        self._rate = cyberos.preferences['rl_rate']  # Frames per second per sender.
+        self._burst = cyberos.preferences['rl_burst']  # Bucket size in frames.
+        self._block_ms = cyberos.preferences['rl_block_ms']  # Unpaired sender blocklist time.
+        self._block_after = cyberos.preferences['rl_block_after']  # Dropped frames before blocklisting.
+
+        self._buckets = {}  # Sender MAC to [tokens in milli frames, last refill ms, dropped frames].
+        self._events = {}  # Event name to [rate, burst] limits, checked per sender and event.
+        self._event_buckets = {}  # (Sender MAC, event name) to [tokens in milli frames, last refill ms].
+        self._blocked = {}  # Sender MAC to blocklist expiry ms.
+        self._dropped = 0
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['rl'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        self._rate = value
+        cyberos.preferences['rl_rate'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @burst.setter
+    def burst(self, value):
+        self._burst = value
+        cyberos.preferences['rl_burst'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def blocked(self):
+        return self._blocked
+
+    ################################################################################
+    # Limits
+    #
+    # Limit an event per sender, e.g. "cyberos.ratelimit.limit('on_temp', 5, 10)".
+    def limit(self, event_name, rate, burst):
+        self._events[event_name.encode()] = (rate, burst)
+
+    def unlimit(self, event_name):
+        self._events.pop(event_name.encode(), None)
+
+    # Take a token from the bucket, returns False if the bucket is empty.
+    def _take(self, bucket, rate, burst, now):
+        tokens = bucket[0] + ticks_diff(now, bucket[1]) * rate
+        if tokens > burst * 1000:
+            tokens = burst * 1000
+        bucket[1] = now
+        if tokens < 1000:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1000
+        return True
+
+    def _paired(self, mac):
+        for cyberware in cyberos.cyberwares['subscribed'].values():
+            if cyberware.get('mac') == mac:
+                return True
+        return False
+
+    # Check the raw frame before it is queued and decoded, returns False if the frame must be dropped.
+    def check(self, mac, event):
+        now = ticks_ms()
+        if mac in self._blocked:
+            if ticks_diff(self._blocked[mac], now) > 0:
+                self._drop()
+                return False
+            del self._blocked[mac]
+
+        bucket = self._buckets.get(mac)
+        if bucket is None:
+            if len(self._buckets) >= self._SENDERS:
+                self._evict(self._buckets, now)
+            bucket = self._buckets[mac] = [self._burst * 1000, now, 0]
+        if not self._take(bucket, self._rate, self._burst, now):
+            bucket[2] += 1
+            self._drop()
+            if self._block_ms and bucket[2] >= self._block_after and not self._paired(mac):
+                if len(self._blocked) >= self._BLOCKLIST:
+                    self._purge(now)
+                if len(self._blocked) < self._BLOCKLIST:
+                    self._blocked[mac] = ticks_add(now, self._block_ms)
+                    if cyberos.metrics.enabled:
+                        cyberos.metrics.inc('rl_blocked')
+                bucket[2] = 0
+            return False
+
+        if len(self._events):
+            name = cyberos.event.raw_name(event)
+            if name in self._events:
+                rate, burst = self._events[name]
+                key = (mac, name)
+                bucket = self._event_buckets.get(key)
+                if bucket is None:
+                    if len(self._event_buckets) >= self._SENDERS:
+                        self._evict(self._event_buckets, now)
+                    bucket = self._event_buckets[key] = [burst * 1000, now]
+                if not self._take(bucket, rate, burst, now):
+                    self._drop()
+                    return False
+        return True
+
+    def _drop(self):
+        self._dropped += 1
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('rl_dropped')
+
+    # Forget the bucket that was quiet for the longest time, the other senders keep their budget.
+    def _evict(self, buckets, now):
+        oldest = None
+        age = -1
+        for key in buckets:
+            if ticks_diff(now, buckets[key][1]) > age:
+                age = ticks_diff(now, buckets[key][1])
+                oldest = key
+        del buckets[oldest]
+
+    # Forget the senders whose blocklist time is over, they are only removed once they send again otherwise.
+    def _purge(self, now):
+        for mac in [mac for mac in self._blocked if ticks_diff(self._blocked[mac], now) <= 0]:
+            del self._blocked[mac]
@@ -0,0 +1,161 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS RELAY
+#
+# Multi-hop event relaying with hop limit, duplicate suppression and next-hop routes.
+
+from array import array
+import fildz_cyberos as cyberos
+from .listener import OPT_RELAY, OPT_COMPACT
+
+# Relay option: hop limit, hops taken, origin (last 3 bytes of the origin STA MAC), sequence number.
+_RELAY_SIZE = 7
+
+
+class Relay:
+    _SEEN = 32  # Number of frames remembered for duplicate suppression.
+    _ROUTES = 16  # Number of next-hop routes kept.
+
+    def __init__(self):
+        self._enabled = cyberos.preferences['relay']
+        self._ttl = cyberos.preferences['relay_ttl']
+
+        self._seq = 0  # Sequence number of our own relayed frames.
+        self._seen_origin = array('L', [0xFFFFFFFF] * self._SEEN)
+        self._seen_seq = array('H', [0] * self._SEEN)
+        self._seen_index = 0
+        self._routes = {}  # Cyberware name to [next-hop MAC, hops].
+        self._relayed = set()  # Paired cyberwares that missed a direct frame, relayed to until heard directly.
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = value
+        cyberos.preferences['relay'] = value
+        cyberos.settings.on_save_settings.set()
+
+    # Hop limit of the frames we send.
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @ttl.setter
+    def ttl(self, value):
+        self._ttl = value
+        cyberos.preferences['relay_ttl'] = value
+        cyberos.settings.on_save_settings.set()
+
+    @property
+    def routes(self):
+        return self._routes
+
+    @property
+    def relayed(self):
+        return self._relayed
+
+    ################################################################################
+    # Helpers
+    #
+    def _origin(self, option):
+        return (option[2] << 16) | (option[3] << 8) | option[4]
+
+    # Remember the frame, returns True if it was seen before.
+    def _seen(self, origin, seq):
+        for i in range(self._SEEN):
+            if self._seen_origin[i] == origin and self._seen_seq[i] == seq:
+                return True
+        self._seen_origin[self._seen_index] = origin
+        self._seen_seq[self._seen_index] = seq
+        self._seen_index = (self._seen_index + 1) % self._SEEN
+        return False
+
+    def _learn(self, cyberware, mac, hops):
+        route = self._routes.get(cyberware)
+        if route is None:
+            if len(self._routes) >= self._ROUTES:
+                # Forget the longest route.
+                longest = None
+                for name in self._routes:
+                    if longest is None or self._routes[name][1] > self._routes[longest][1]:
+                        longest = name
+                del self._routes[longest]
+            self._routes[cyberware] = [mac, hops]
+        elif hops <= route[1] or route[0] == mac:
+            route[0] = mac
+            route[1] = hops
+
+    # Paired cyberwares in range get frames directly, with the compact header, everything else is relayed.
+    def direct(self, cyberware):
+        return cyberware not in self._relayed and 'mac' in cyberos.cyberwares['subscribed'].get(cyberware, ())
+
+    # Frame received from the cyberware without relaying, it is in range again.
+    def heard(self, cyberware):
+        self._relayed.discard(cyberware)
+
+    # MAC address to send the frame for the cyberware to, the public MAC floods it.
+    def next_hop(self, cyberware):
+        route = self._routes.get(cyberware)
+        if route is None:
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('relay_flooded')
+            return cyberos.cyberware.mac_public
+        return route[0]
+
+    ################################################################################
+    # Frames
+    #
+    # Relay option for a frame we originate.
+    def option(self):
+        self._seq = (self._seq + 1) & 0xFFFF
+        mac = cyberos.cyberware.mac_private
+        self._seen((mac[3] << 16) | (mac[4] << 8) | mac[5], self._seq)
+        return bytes((OPT_RELAY, _RELAY_SIZE, self._ttl, 0, mac[3], mac[4], mac[5],
+                      self._seq >> 8, self._seq & 0xFF))
+
+    # Direct frame was not acknowledged, the cyberware is relayed to from now on.
+    # Returns the frame with a relay option, None if it has no header to relay it by or was relayed already.
+    def reroute(self, cyberware, event):
+        self._relayed.add(cyberware)
+        if event[0] == OPT_RELAY or event[0] == OPT_COMPACT:
+            return None
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('relay_rerouted')
+        frame = bytearray(self.option())
+        frame.extend(event)
+        return frame
+
+    # Check a received frame, returns False if it is a duplicate.
+    def receive(self, option, sender, mac):
+        if len(option) != _RELAY_SIZE:
+            return False
+        if self._seen(self._origin(option), (option[5] << 8) | option[6]):
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('relay_duplicates')
+            return False
+        self._learn(sender, mac, option[1])
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('relay_rx_hops_%d' % option[1])
+        return True
+
+    # Forward a frame that is not for us, at most once and while the hop limit allows it.
+    async def forward(self, event, option, receiver):
+        if option[0] <= 1:
+            return
+        frame = bytearray(event)
+        offset = 0
+        while frame[offset] != OPT_RELAY:
+            offset += 2 + frame[offset + 1]
+        frame[offset + 2] -= 1  # Hop limit.
+        frame[offset + 3] += 1  # Hops taken.
+        mac = self.next_hop(receiver) if len(receiver) else cyberos.cyberware.mac_public
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('relay_forwarded')
+        await cyberos.event.asend(mac, frame, receiver, 'relay', sync=False)
@@ -0,0 +1,123 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS RPC
+#
+# Request/response calls over events matched by correlation ids.
+
+import uasyncio as asyncio
+from array import array
+import fildz_cyberos as cyberos
+from .listener import OPT_RPC
+from .transmitter import Completion
+
+# RPC option: kind and correlation id.
+_REQUEST = 0
+_RESPONSE = 1
+_ERROR = 2
+
+
+class RPC:
+    _SLOTS = 8  # Calls pending at the same time.
+
+    def __init__(self):
+        self._methods = {}  # Method name to its function.
+        self._id = 0
+        self._ids = array('B', [0] * self._SLOTS)  # Correlation id per slot.
+        self._peers = [None] * self._SLOTS  # Called cyberware per slot, None if the slot is free.
+        self._completions = [None] * self._SLOTS
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def pending(self):
+        return self._SLOTS - self._peers.count(None)
+
+    ################################################################################
+    # Methods
+    #
+    # Register the method paired cyberwares can call, a function or a coroutine function returning the result args,
+    # e.g. "cyberos.rpc.register('get_battery', battery_level)".
+    def register(self, method, function):
+        self._methods[method] = function
+
+    def unregister(self, method):
+        self._methods.pop(method, None)
+
+    ################################################################################
+    # Calls
+    #
+    # Call the method of the paired cyberware and return its result args, None if it did not answer in time.
+    # Retries send the same call again, so methods that are retried must be safe to run twice.
+    async def call(self, cyberware, method, *args, timeout_ms=1000, retries=0):
+        for slot in range(self._SLOTS):
+            if self._peers[slot] is None:
+                break
+        else:
+            raise ValueError('No free RPC slots')
+        self._id = (self._id + 1) & 0xFF
+        self._ids[slot] = self._id
+        self._peers[slot] = cyberware
+        self._completions[slot] = completion = Completion()
+        option = bytes((OPT_RPC, 2, _REQUEST, self._id))
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('rpc_calls')
+        try:
+            for attempt in range(retries + 1):
+                if attempt and cyberos.metrics.enabled:
+                    cyberos.metrics.inc('rpc_retries')
+                await cyberos.event.transmit(method, args, cyberware, True, option)
+                try:
+                    kind, result = await asyncio.wait_for_ms(completion.wait(), timeout_ms)
+                except asyncio.TimeoutError:
+                    continue
+                if kind == _ERROR:
+                    if cyberos.metrics.enabled:
+                        cyberos.metrics.inc('rpc_errors')
+                    raise RuntimeError('%s: %s' % (method, result[0] if len(result) else ''))
+                return result
+            if cyberos.metrics.enabled:
+                cyberos.metrics.inc('rpc_timeouts')
+            return None
+        finally:
+            self._peers[slot] = None
+            self._completions[slot] = None
+
+    # RPC frame from the paired cyberware, called from the listener.
+    async def receive(self, option, sender, method, args):
+        if len(option) != 2:
+            return
+        kind = option[0]
+        if kind == _REQUEST:
+            # Serve the call in its own task, so the dispatch task is not blocked by the method.
+            asyncio.create_task(self._serve(sender, option[1], method, args))
+            return
+        for slot in range(self._SLOTS):
+            if self._peers[slot] == sender and self._ids[slot] == option[1]:
+                if not self._completions[slot].done:
+                    self._completions[slot]._complete((kind, args))
+                return
+        if cyberos.metrics.enabled:
+            cyberos.metrics.inc('rpc_late')  # Response to the call that already timed out.
+
+    async def _serve(self, sender, call_id, method, args):
+        kind = _RESPONSE
+        if method not in self._methods:
+            kind = _ERROR
+            result = ('Unknown method',)
+        else:
+            try:
+                result = self._methods[method](*args)
+                if result.__class__.__name__ in ('generator', 'coroutine'):
+                    result = await result
+                if result is None:
+                    result = ()
+                elif not isinstance(result, (tuple, list)):
+                    result = (result,)
+                result = [arg if isinstance(arg, (str, bytes, bytearray)) else str(arg) for arg in result]
+            except Exception as e:
+                kind = _ERROR
+                result = (str(e),)
+        await cyberos.event.transmit(method, result, sender, False, bytes((OPT_RPC, 2, kind, call_id)))
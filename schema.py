@@ -0,0 +1,83 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS SCHEMA
+#
+# Typed event arguments packed with precompiled struct formats.
+
+import ustruct as struct
+
+# Field type to struct format, variable size fields are packed with a 1 byte length.
+TYPES = {
+    'int8': 'b',
+    'uint8': 'B',
+    'int16': 'h',
+    'uint16': 'H',
+    'int32': 'i',
+    'uint32': 'I',
+    'float': 'f',
+    'bool': '?',
+    'bytes': None,
+    'str': None,
+}
+
+
+class Schema:
+    def __init__(self, fields):
+        self._fields = tuple(fields)
+        fmt = '<'
+        self._fixed = []  # Indexes of fixed size fields, packed first in one go.
+        self._variable = []  # Indexes of variable size fields, packed after the fixed ones.
+        for i, field in enumerate(self._fields):
+            if field not in TYPES:
+                raise ValueError('Unknown field type %s' % field)
+            if TYPES[field] is None:
+                self._variable.append(i)
+            else:
+                self._fixed.append(i)
+                fmt += TYPES[field]
+        self._format = fmt
+        self._size = struct.calcsize(fmt)
+        self._args = [None] * len(self._fields)
+        from .listener import MAX_FRAME  # Listener imports us first.
+        self._max = MAX_FRAME
+
+    @property
+    def fields(self):
+        return self._fields
+
+    # Packed args are sent as a single arg of the frame, so they must fit into it.
+    def pack(self, args):
+        if len(args) != len(self._fields):
+            raise ValueError('Expected %d args' % len(self._fields))
+        size = self._size
+        variable = []
+        for i in self._variable:
+            arg = args[i].encode() if self._fields[i] == 'str' else args[i]
+            if len(arg) > 255:
+                raise ValueError('Arg %d is %d bytes, at most 255' % (i, len(arg)))
+            size += 1 + len(arg)
+            variable.append(arg)
+        if size > self._max:
+            raise ValueError('Args are %d bytes packed, at most %d' % (size, self._max))
+        data = bytearray(size)
+        struct.pack_into(self._format, data, 0, *[args[i] for i in self._fixed])
+        offset = self._size
+        for arg in variable:
+            data[offset] = len(arg)
+            data[offset + 1:offset + 1 + len(arg)] = arg
+            offset += 1 + len(arg)
+        return data
+
+    def unpack(self, data):
+        args = list(self._args)
+        values = struct.unpack_from(self._format, data, 0)
+        for n, i in enumerate(self._fixed):
+            args[i] = values[n]
+        offset = self._size
+        for i in self._variable:
+            arg = data[offset + 1:offset + 1 + data[offset]]
+            args[i] = str(arg, 'utf8') if self._fields[i] == 'str' else bytes(arg)
+            offset += 1 + data[offset]
+        return args
@@ -10,9 +10,9 @@ import errno
 import os
 import ujson as json
 import ubinascii
-import uasyncio as asyncio
 from uasyncio import Event
 import fildz_cyberos as cyberos
+from .monitor import create_task
 
 
 # import os
@@ -28,12 +28,13 @@ class Settings:
     _SETTINGS_FILE = '/cyberos.json'
     _PAIRED_FILE = '/cyberwares.json'
     _CONFIG_DIR = 'fildz'
+    _PEER_KEYS = ('id', 'names', 'tx_id', 'tx_names', 'groups', 'transport')
 
     def __init__(self):
         self._on_save_settings = Event()
-        asyncio.create_task(self._event_save_settings())
+        create_task(self._event_save_settings(), 'settings.save_settings')
         self._on_save_cyberwares = Event()
-        asyncio.create_task(self._event_save_cyberwares())
+        create_task(self._event_save_cyberwares(), 'settings.save_cyberwares')
         self._load_settings()
         self._load_cyberwares()
 
@@ -73,7 +74,7 @@ class Settings:
                     try:
                         with open(self._CONFIG_DIR + self._SETTINGS_FILE, "r") as config_file:
                             config_str = config_file.read()
-                            cyberos.preferences = json.loads(config_str)
+                            cyberos.preferences.update(json.loads(config_str))
                             break
                     except ValueError:
                         break
@@ -112,15 +113,23 @@ class Settings:
     async def _event_save_cyberwares(self):
         while True:
             await self._on_save_cyberwares.wait()
+            if cyberos.heap.enabled:
+                mark = cyberos.heap.begin()
             _paired = {}
             for cyberware in cyberos.cyberwares['subscribed']:
                 if 'mac_str' in cyberos.cyberwares['subscribed'][cyberware]:
                     _paired.update({cyberware: {'mac_str': cyberos.cyberwares['subscribed'][cyberware]['mac_str']}})
+                    # Peer ids and event name ids for compact frames, groups and transport of the cyberware.
+                    for key in self._PEER_KEYS:
+                        if key in cyberos.cyberwares['subscribed'][cyberware]:
+                            _paired[cyberware][key] = cyberos.cyberwares['subscribed'][cyberware][key]
             while True:
                 try:
                     with open(self._CONFIG_DIR + self._PAIRED_FILE, 'w') as config_file:
                         json.dump(_paired, config_file)
                     self._on_save_cyberwares.clear()
+                    if cyberos.heap.enabled:
+                        cyberos.heap.end('settings.save_cyberwares', mark)
                     break
                 except OSError as exc:
                     if exc.errno == errno.ENOENT:
@@ -130,11 +139,15 @@ class Settings:
     async def _event_save_settings(self):
         while True:
             await self._on_save_settings.wait()
+            if cyberos.heap.enabled:
+                mark = cyberos.heap.begin()
             while True:
                 try:
                     with open(self._CONFIG_DIR + self._SETTINGS_FILE, 'w') as config_file:
                         json.dump(cyberos.preferences, config_file)
                     self._on_save_settings.clear()
+                    if cyberos.heap.enabled:
+                        cyberos.heap.end('settings.save_settings', mark)
                     break
                 except OSError as exc:
                     if exc.errno == errno.ENOENT:
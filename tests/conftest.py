@@ -0,0 +1,161 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS HOST TESTS
+#
+# MicroPython modules are mapped to their CPython counterparts and the package is imported as fildz_cyberos
+# without running its __init__, which needs the device drivers. Tests set the cyberos globals they use,
+# e.g. "python -m pytest -q tests".
+
+import asyncio
+import binascii
+import collections
+import importlib
+import os
+import random
+import socket
+import struct
+import sys
+import time
+import types
+
+import pytest
+
+_PERIOD = 1 << 30  # ticks_*() wrap like on the device.
+
+utime = types.ModuleType('utime')
+utime.ticks_us = lambda: (time.monotonic_ns() // 1000) & (_PERIOD - 1)
+utime.ticks_ms = lambda: (time.monotonic_ns() // 1000000) & (_PERIOD - 1)
+utime.ticks_add = lambda ticks, delta: (ticks + delta) & (_PERIOD - 1)
+utime.ticks_diff = lambda a, b: ((a - b + _PERIOD // 2) & (_PERIOD - 1)) - _PERIOD // 2
+utime.time = lambda: int(time.time())
+utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+uasyncio = types.ModuleType('uasyncio')
+uasyncio.__dict__.update((key, value) for key, value in asyncio.__dict__.items() if key[:2] != '__')
+uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+uasyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+
+micropython = types.ModuleType('micropython')
+micropython.const = lambda value: value
+
+for name, module in (('utime', utime), ('uasyncio', uasyncio), ('ucollections', collections),
+                     ('ustruct', struct), ('usocket', socket), ('ubinascii', binascii), ('urandom', random),
+                     ('micropython', micropython)):
+    sys.modules.setdefault(name, module)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+package = types.ModuleType('fildz_cyberos')
+package.__path__ = [_ROOT]
+sys.modules['fildz_cyberos'] = package
+
+# Named tasks are plain tasks on the host, the monitor drives coroutines as MicroPython generators.
+from fildz_cyberos import monitor  # noqa: E402
+monitor._tracked = lambda coro, name: coro
+
+
+class Server:
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, route):
+        def decorator(func):
+            self.routes[route] = func
+            return func
+        return decorator
+
+    async def write(self, request, data):
+        request.append(data)
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self):
+        self.counters = {}
+
+    def inc(self, key, n=1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def rx(self, sender, name):
+        pass
+
+    def tx(self, receiver, name, ok=True):
+        if not ok:
+            self.inc('tx_failed')
+
+    def observe(self, key, value):
+        pass
+
+
+class Disabled:
+    enabled = False
+    active = False
+
+
+# Cyberos globals of the test, restored afterwards.
+@pytest.fixture
+def cyberos():
+    saved = dict(package.__dict__)
+    package.preferences = {}
+    package.cyberwares = {'subscribed': {}}
+    package.server = Server()
+    package.metrics = Metrics()
+    for name in ('clock', 'relay', 'outbox', 'history', 'heap', 'ratelimit', 'peers', 'aggregate', 'bridge'):
+        setattr(package, name, Disabled())
+    yield package
+    package.__dict__.clear()
+    package.__dict__.update(saved)
+
+
+################################################################################
+# Cyberware stacks
+#
+# Cyberos of one more cyberware in this process: its own package globals and copies of the modules, which bind
+# "fildz_cyberos" when imported. Listeners of the stacks exchange frames over the shared Loopback air.
+PUBLIC = b'\xff' * 6
+
+
+def _isolated(names):
+    saved = dict((key, sys.modules.pop(key)) for key in list(sys.modules) if key.split('.')[0] == 'fildz_cyberos')
+    isolated = types.ModuleType('fildz_cyberos')
+    isolated.__path__ = [_ROOT]
+    sys.modules['fildz_cyberos'] = isolated
+    try:
+        importlib.import_module('fildz_cyberos.monitor')._tracked = lambda coro, name: coro
+        modules = dict((name, importlib.import_module('fildz_cyberos.' + name)) for name in names)
+    finally:
+        for key in [key for key in sys.modules if key.split('.')[0] == 'fildz_cyberos']:
+            del sys.modules[key]
+        sys.modules.update(saved)
+    return isolated, modules
+
+
+# Listener, transmitter and Loopback transport of the cyberware, modules names more modules to load,
+# e.g. "a = stack('SENSOR-0F889A-ABW', b'\x02\x00\x00\x00\x00\x01', air)". Call it from a running event loop.
+def stack(ap_ssid, mac, air, modules=(), loss=0, delay_ms=0, **preferences):
+    isolated, modules = _isolated(('listener', 'transmitter', 'transport') + tuple(modules))
+    isolated.modules = modules
+    isolated.preferences = dict(groups=[], tx_queue=16, tx_inflight=2, tx_pace_ms=0)
+    isolated.preferences.update(preferences)
+    isolated.cyberwares = {'subscribed': {}, ap_ssid: {'events': {}}}
+    isolated.network = types.SimpleNamespace(ap_ssid=ap_ssid)
+    isolated.cyberware = types.SimpleNamespace(mac_private=mac, mac_public=PUBLIC)
+    isolated.settings = types.SimpleNamespace(on_save_settings=asyncio.Event(), on_save_cyberwares=asyncio.Event())
+    isolated.pairing = types.SimpleNamespace(advertise=lambda cyberware: None)
+    isolated.server = Server()
+    isolated.metrics = Metrics()
+    for name in ('clock', 'relay', 'outbox', 'history', 'heap', 'ratelimit', 'peers', 'aggregate', 'bridge'):
+        setattr(isolated, name, Disabled())
+    isolated.event = modules['listener'].Listener()
+    isolated.tx = modules['transmitter'].Transmitter()
+    isolated.event.add_transport(modules['transport'].Loopback(mac, air, public=PUBLIC, loss=loss, delay_ms=delay_ms))
+    return isolated
+
+
+# Pair the stacks like pairing does, without the pairing exchange.
+def pair(a, b):
+    for one, other in ((a, b), (b, a)):
+        one.cyberwares['subscribed'][other.network.ap_ssid] = {'mac': other.cyberware.mac_private, 'events': {}}
+        one.event.index_subscribers()
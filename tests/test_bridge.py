@@ -0,0 +1,47 @@
+import asyncio
+import types
+
+from fildz_cyberos.bridge import Bridge
+from fildz_cyberos.listener import Listener
+
+PEER = 'DISPLAY-0F889A-ABW'
+
+
+def bridge(cyberos):
+    cyberos.preferences.update(bridge=False, bridge_host='127.0.0.1', bridge_port=4210, bridge_mqtt=False,
+                               bridge_flush_ms=1000, bridge_batch=256)
+    return Bridge()
+
+
+def test_control_events_are_not_uplinked(cyberos):
+    events = [(PEER, 'on_ping', ['1']), (PEER, 'on_temp', ['21']), (PEER, 'on_pairing', ['x'])]
+
+    async def subscribe(size):
+        for event in events:
+            yield event
+
+    cyberos.event = types.SimpleNamespace(CONTROL_EVENTS=Listener.CONTROL_EVENTS, subscribe=subscribe)
+    uplink = bridge(cyberos)
+    asyncio.run(uplink._event_uplink())
+    assert uplink._count == 1
+    assert b'on_temp' in uplink._batch and b'on_ping' not in uplink._batch
+
+
+def test_failed_mqtt_publish_reconnects(cyberos):
+    class Client:
+        def __init__(self):
+            self.sock = types.SimpleNamespace(timeout=None)
+            self.sock.settimeout = lambda timeout: setattr(self.sock, 'timeout', timeout)
+
+        def publish(self, topic, msg):
+            raise OSError(110)
+
+        def disconnect(self):
+            pass
+
+    uplink = bridge(cyberos)
+    uplink._client = client = Client()
+    uplink._append(PEER, 'on_temp', ['21'])
+    assert not uplink._flush()
+    assert client.sock.timeout == Bridge._TIMEOUT_S
+    assert not uplink.connected and uplink._count == 1
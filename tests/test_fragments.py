@@ -0,0 +1,58 @@
+import asyncio
+import types
+
+from fildz_cyberos.fragments import Fragments
+from fildz_cyberos.transmitter import Completion
+
+MAC = b'\x02\x00\x00\x00\x00\x0a'
+PEER = 'DISPLAY-0F889A-ABW'
+
+
+def fragments(cyberos, frames):
+    async def transmit(event_name, args, cyberware, sync, options=b''):
+        frames.append((bytes(options), bytes(args[0])))
+        completion = Completion()
+        completion._complete(True)
+        return completion
+
+    cyberos.preferences.update(frag_buffer=2048, frag_timeout_ms=3000)
+    cyberos.network = types.SimpleNamespace(ap_ssid='BUTTON-02AD9A-WAY')
+    cyberos.event = types.SimpleNamespace(transmit=transmit)
+    return Fragments()
+
+
+def deliver(receiver, frames):
+    args = None
+    for option, chunk in frames:
+        args = receiver.receive(MAC, option[2:], chunk)
+    return args
+
+
+def test_max_size_event_is_reassembled(cyberos):
+    frames = []
+
+    async def main():
+        sender = fragments(cyberos, frames)
+        receiver = Fragments()
+        payload = b'\x01' * (receiver.max_size - 2)  # Packed args carry a 2 byte length.
+        await sender.send('on_benchmark', (payload,), PEER, True)
+        return receiver.max_size, deliver(receiver, frames)
+
+    max_size, args = asyncio.run(main())
+    assert max_size == 1024
+    assert len(frames) == 6  # The last fragment is shorter.
+    assert args == ['\x01' * (max_size - 2)]
+
+
+def test_larger_event_is_dropped(cyberos):
+    frames = []
+
+    async def main():
+        sender = fragments(cyberos, frames)
+        receiver = Fragments()
+        await sender.send('on_benchmark', (bytes(receiver.max_size - 1),), PEER, True)
+        return deliver(receiver, frames)
+
+    assert asyncio.run(main()) is None
+    assert cyberos.metrics.counters['frag_dropped'] >= 1
+    assert 'frag_rx' not in cyberos.metrics.counters
@@ -0,0 +1,34 @@
+import asyncio
+import sys
+import types
+
+from fildz_cyberos import heap as module
+from fildz_cyberos.heap import Heap
+from fildz_cyberos.history import History
+
+
+def test_storage_is_freed_in_low_memory(cyberos, monkeypatch):
+    monkeypatch.setattr(module.gc, 'mem_free', lambda: 1000, raising=False)
+    monkeypatch.setattr(module.gc, 'mem_alloc', lambda: 1000, raising=False)
+    monkeypatch.setitem(sys.modules, 'aiorepl', types.SimpleNamespace(task=lambda: asyncio.sleep(0)))
+    cyberos.preferences.update(heap=True, heap_low=2000, history=True, history_size=4, history_slot=16)
+    cyberos.network = types.SimpleNamespace(on_wlan_change=asyncio.Event())
+    cyberos.repl = None
+
+    async def stop():
+        pass
+
+    cyberos.server.stop = stop
+
+    async def main():
+        cyberos.heap = heap = Heap()
+        cyberos.history = history = History()
+        history.record(b'frame')
+        await heap._shed()
+        shed = len(history._frames), history.count
+        history.record(b'frame')  # Not recorded until memory is recovered.
+        await heap._restore()
+        history.record(b'frame')
+        return shed, len(history._frames), history.count
+
+    assert asyncio.run(main()) == ((0, 0), 4 * 16, 1)
@@ -0,0 +1,213 @@
+import asyncio
+
+from fildz_cyberos.listener import Listener
+
+
+def listener(cyberos):
+    cyberos.preferences['groups'] = []
+    return Listener()
+
+
+def test_failing_callback_does_not_stop_other_handlers(cyberos):
+    calls = []
+
+    def broken():
+        calls.append('broken')
+        raise ValueError('broken')
+
+    def working():
+        calls.append('working')
+
+    async def coroutine():
+        calls.append('coroutine')
+
+    async def main():
+        event = listener(cyberos)
+        event._name = 'on_click'
+        await event._fire([broken, working, coroutine])
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert calls == ['broken', 'working', 'coroutine']
+    assert cyberos.metrics.counters['handler_errors'] == 1
+
+
+def test_emitted_events_keep_their_args(cyberos):
+    from uasyncio import Event
+
+    cyberos.network = type('Network', (), {'ap_ssid': 'DISPLAY-0F889A-ABW'})
+    on_a, on_b = Event(), Event()
+    cyberos.cyberwares['subscribed']['SENSOR-0F889A-ABW'] = {'mac': b'\x02\x00\x00\x00\x00\x0a',
+                                                             'events': {'on_a': on_a, 'on_b': on_b}}
+    seen = []
+
+    async def consumer(event, handler):
+        await handler.wait()
+        seen.append((event.name, list(event.args)))
+
+    async def main():
+        event = listener(cyberos)
+        cyberos.event = event
+        tasks = [asyncio.create_task(consumer(event, on_a)), asyncio.create_task(consumer(event, on_b))]
+        await asyncio.sleep(0)
+        # Aggregate flushes several slots without yielding in between.
+        await event.emit('SENSOR-0F889A-ABW', 'on_a', [1])
+        await event.emit('SENSOR-0F889A-ABW', 'on_b', [2])
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+    asyncio.run(main())
+    assert seen == [('on_a', [1]), ('on_b', [2])]
+
+
+def test_waiter_keeps_the_times_of_queued_events(cyberos):
+    async def main():
+        event = listener(cyberos)
+        waiter = event.subscribe(name='on_ping')
+        for sender, rx_us, tx_us in (('A', 100, None), ('B', 200, 150)):
+            event._sender, event._name, event._args = sender, 'on_ping', []
+            event._rx_us, event._tx_us = rx_us, tx_us
+            event._resolve()
+        times = []
+        for n in range(2):
+            await waiter.get()
+            times.append((waiter.rx_us, waiter.tx_us))
+        return times
+
+    assert asyncio.run(main()) == [(100, None), (200, 150)]
+
+
+def test_waiters_subscribe_to_their_event(cyberos):
+    advertised = []
+    cyberos.pairing = type('Pairing', (), {'advertise': staticmethod(advertised.append)})
+    cyberos.cyberwares['subscribed']['BUTTON-02AD9A-WAY'] = {'mac': b'\x02\x00\x00\x00\x00\x0b', 'events': {}}
+
+    async def main():
+        event = listener(cyberos)
+        event.index_subscribers()
+        for n in range(2):
+            event.unsubscribe(event.subscribe('BUTTON-02AD9A-WAY', 'on_click'))
+        event.subscribe(name='on_ping')
+        return event.event_names('BUTTON-02AD9A-WAY')
+
+    assert asyncio.run(main()) == ['on_click']
+    assert advertised == ['BUTTON-02AD9A-WAY']
+
+
+def test_events_the_cyberware_is_not_subscribed_to_are_filtered(cyberos):
+    cyberos.cyberwares['subscribed']['DISPLAY-0F889A-ABW'] = {'mac': b'\x02\x00\x00\x00\x00\x0a', 'events': {},
+                                                              'tx_names': {'on_temp': 0}}
+
+    async def main():
+        event = listener(cyberos)
+        return await event.send('on_load', '1', cyberware='DISPLAY-0F889A-ABW')
+
+    assert asyncio.run(main()) is None
+    assert cyberos.metrics.counters['tx_filtered'] == 1
+
+
+def test_wildcard_push_and_pull(cyberos):
+    advertised = []
+    cyberos.pairing = type('Pairing', (), {'advertise': staticmethod(advertised.append)})
+    cyberos.cyberwares['subscribed']['BUTTON-02AD9A-WAY'] = {'mac': b'\x02\x00\x00\x00\x00\x0b', 'events': {}}
+    cyberos.cyberwares['subscribed']['DISPLAY-0F889A-ABW'] = {'mac': b'\x02\x00\x00\x00\x00\x0a', 'events': {}}
+    clicked, held = (lambda: None), (lambda: None)
+
+    async def main():
+        event = listener(cyberos)
+        event.index_subscribers()
+        await event.push('BUTTON-*', 'on_click', clicked)
+        await event.pull('BUTTON-*', 'on_hold')  # Not subscribed, the other events stay.
+        assert event.handlers('BUTTON-02AD9A-WAY', 'on_click') is clicked
+        await event.push('BUTTON-*', 'on_hold', held)
+        await event.pull('BUTTON-*', 'on_click')
+        assert event.handlers('BUTTON-02AD9A-WAY', 'on_click') is None
+        assert event.handlers('BUTTON-02AD9A-WAY', 'on_hold') is held
+        assert event.handlers('DISPLAY-0F889A-ABW', 'on_hold') is None  # Does not match the wildcard.
+        assert event.event_names('BUTTON-02AD9A-WAY') == ['on_hold']
+        await event.push('BUTTON-*', 'on_click', clicked)
+        await event.pull('BUTTON-*')  # All events of the wildcard.
+        return event._wildcards, event.event_names('BUTTON-02AD9A-WAY')
+
+    assert asyncio.run(main()) == ({}, [])
+    assert advertised == ['BUTTON-02AD9A-WAY'] * 6  # Only the matching cyberware, once per change.
+
+
+def test_group_events_reach_wildcard_subscribers_over_loopback():
+    from conftest import stack, pair
+
+    lights = []
+
+    async def main():
+        air = []
+        switch = stack('SWITCH-0F889A-ABW', b'\x02\x00\x00\x00\x00\x01', air)
+        lamp = stack('LAMP-0F889A-ABW', b'\x02\x00\x00\x00\x00\x02', air)
+        pair(switch, lamp)
+        lamp.event.join('kitchen')
+        await lamp.event.push('SWITCH-*', 'on_light', lambda: lights.append(list(lamp.event.args)))
+        # Pairing tells the switch the groups of the lamp.
+        switch.cyberwares['subscribed']['LAMP-0F889A-ABW']['groups'] = ['kitchen']
+        switch.event.index_subscribers()
+
+        assert await switch.event.send('on_light', '1', cyberware='@hall') is None  # No members.
+        await (await switch.event.send('on_light', '1', cyberware='@kitchen'))
+        await asyncio.sleep(0.01)
+        await lamp.event.pull('SWITCH-*', 'on_light')
+        await (await switch.event.send('on_light', '0', cyberware='@kitchen'))
+        await asyncio.sleep(0.01)
+        lamp.event.leave('kitchen')
+        return lamp.preferences['groups']
+
+    assert asyncio.run(main()) == []
+    assert lights == [['1']]
+
+
+def test_raw_name_of_compact_frames(cyberos):
+    from fildz_cyberos.listener import OPT_COMPACT
+
+    cyberos.cyberwares['subscribed']['BUTTON-02AD9A-WAY'] = {'mac': b'\x02\x00\x00\x00\x00\x0b', 'events': {},
+                                                             'id': 7, 'names': ['on_click', 'on_hold']}
+
+    async def main():
+        event = listener(cyberos)
+        event.index_ids()
+        return [event.raw_name(bytes((OPT_COMPACT, 2, peer_id, name_id, 1)) + b'1')
+                for peer_id, name_id in ((7, 1), (7, 2), (8, 0))]
+
+    assert asyncio.run(main()) == [b'on_hold', b'', b'']  # Unknown event name and peer ids.
+
+
+def test_schema_and_rpc_frames_use_the_compact_header():
+    from conftest import stack, pair
+    from fildz_cyberos.listener import OPT_COMPACT
+
+    frames = []
+    temps = []
+
+    async def main():
+        air = []
+        sensor = stack('SENSOR-0F889A-ABW', b'\x02\x00\x00\x00\x00\x01', air, modules=('rpc',))
+        display = stack('DISPLAY-0F889A-ABW', b'\x02\x00\x00\x00\x00\x02', air, modules=('rpc',))
+        pair(sensor, display)
+        # Ids pairing agrees on, each side gave the other peer id 1 and ids of the event names it wants.
+        for one, other, names in ((sensor, display, ['get_battery']), (display, sensor, ['on_temp', 'get_battery'])):
+            one.cyberwares['subscribed'][other.network.ap_ssid].update(id=1, names=names)
+            other.cyberwares['subscribed'][one.network.ap_ssid].update(
+                tx_id=1, tx_names=dict((name, index) for index, name in enumerate(names)))
+        for one in (sensor, display):
+            one.rpc = one.modules['rpc'].RPC()
+            one.event.index_ids()
+            one.event.index_subscribers()
+            one.event.schema('on_temp', ('int16', 'str'))
+            endpoint = [endpoint for endpoint in air if endpoint.mac == one.cyberware.mac_private][0]
+            endpoint._put = (lambda put: lambda sender, frame: frames.append(frame) or put(sender, frame))(
+                endpoint._put)
+        sensor.rpc.register('get_battery', lambda: 87)
+        await display.event.push('SENSOR-0F889A-ABW', 'on_temp',
+                                 lambda: temps.append((display.event.name, display.event.args)))
+
+        assert await (await sensor.event.send('on_temp', -5, 'ü', cyberware='DISPLAY-0F889A-ABW')) is True
+        return await display.rpc.call('SENSOR-0F889A-ABW', 'get_battery')
+
+    assert asyncio.run(main()) == ['87']
+    assert temps == [('on_temp', [-5, 'ü'])]
+    assert [frame[0] for frame in frames] == [OPT_COMPACT] * 3  # Schema event, RPC request and response.
@@ -0,0 +1,127 @@
+import asyncio
+import types
+
+from fildz_cyberos.loadtest import LoadTest
+
+
+def receive(cyberos, test, run, seq, sent_us, rx_us, padding=0):
+    cyberos.event.args = [str(run), str(seq), str(sent_us), '\x00' * padding]
+    cyberos.event.rx_us = rx_us
+    test._on_load()
+
+
+def stats(report):
+    line = [line for line in report.splitlines() if line[:3] == 'rx '][0]
+    return dict(field.split('=') for field in line.split()[1:])
+
+
+def test_loss_reordering_and_duplicates(cyberos):
+    cyberos.event = types.SimpleNamespace()
+
+    async def main():
+        test = LoadTest()
+        test._source = 'BUTTON-02AD9A-WAY'
+        for seq in (0, 1, 2, 4, 3, 4, 6, 7, 8, 9):  # 5 is lost, 3 is late, 4 is duplicated.
+            receive(cyberos, test, 1, seq, seq * 1000, seq * 1000 + 500)
+        return stats(test.report())
+
+    rx = asyncio.run(main())
+    assert rx['received'] == '10'
+    assert rx['lost'] == '1'
+    assert rx['loss_pct'] == '10'
+    assert rx['reordered'] == '1'
+    assert rx['duplicates'] == '1'
+
+
+def test_goodput_and_jitter(cyberos):
+    cyberos.event = types.SimpleNamespace()
+
+    async def main():
+        test = LoadTest()
+        test._source = 'BUTTON-02AD9A-WAY'
+        # 11 events of 100 bytes 10 ms apart, constant transit, so no jitter.
+        for seq in range(11):
+            args = (str(1), str(seq), str(seq * 10000))
+            receive(cyberos, test, 1, seq, seq * 10000, seq * 10000 + 3000, 100 - sum(len(arg) for arg in args))
+        steady = stats(test.report())
+        # The next event is 1600 us late, then transit is back to normal.
+        receive(cyberos, test, 1, 11, 110000, 110000 + 3000 + 1600, 100 - 10)
+        receive(cyberos, test, 1, 12, 120000, 120000 + 3000, 100 - 10)
+        return steady, stats(test.report())
+
+    steady, late = asyncio.run(main())
+    # 1100 bytes over 100 ms.
+    assert steady['goodput_kbps'] == '88'
+    assert steady['jitter_us'] == '0'
+    # RFC 3550: J += (|D| - J) / 16.
+    assert late['jitter_us'] == str(1600 // 16 + (1600 - 1600 // 16) // 16)
+
+
+def test_new_run_starts_over(cyberos):
+    cyberos.event = types.SimpleNamespace()
+
+    async def main():
+        test = LoadTest()
+        test._source = 'BUTTON-02AD9A-WAY'
+        for seq in (0, 2):
+            receive(cyberos, test, 1, seq, seq, seq)
+        receive(cyberos, test, 2, 0, 0, 0)
+        return stats(test.report())
+
+    rx = asyncio.run(main())
+    assert rx['run'] == '2'
+    assert rx['received'] == '1'
+    assert rx['lost'] == '0'
+
+
+def test_run_counts_acknowledged_frames(cyberos):
+    from fildz_cyberos.transmitter import Completion
+
+    sent = []
+
+    async def send(name, *args, cyberware='', sync=True):
+        sent.append(args)
+        completion = Completion()
+        completion._complete(len(sent) % 4 != 0)  # Every 4th frame is not acknowledged.
+        return completion
+
+    cyberos.event = types.SimpleNamespace(send=send)
+
+    async def main():
+        test = LoadTest()
+        await test.run('DISPLAY-0F889A-ABW', rate=200, size=32, duration_ms=200)
+        return test
+
+    test = asyncio.run(main())
+    assert test._sent == len(sent)
+    assert 20 <= test._sent <= 45
+    assert test._failed == test._sent // 4
+    assert test._acked == test._sent - test._failed
+    assert all(sum(len(arg) for arg in args) == 32 for args in sent)
+
+
+def test_run_between_listeners_over_loopback():
+    from conftest import stack, pair
+
+    async def main():
+        air = []
+        button = stack('BUTTON-02AD9A-WAY', b'\x02\x00\x00\x00\x00\x01', air, modules=('loadtest',))
+        display = stack('DISPLAY-0F889A-ABW', b'\x02\x00\x00\x00\x00\x02', air, modules=('loadtest',))
+        pair(button, display)
+        button.loadtest = button.modules['loadtest'].LoadTest()
+        display.loadtest = display.modules['loadtest'].LoadTest()
+        await display.loadtest.listen('BUTTON-02AD9A-WAY')
+        tx = await button.loadtest.run('DISPLAY-0F889A-ABW', rate=200, size=32, duration_ms=200)
+        await asyncio.sleep(0.05)  # Let the last frames be dispatched.
+        return tx, display.loadtest.report()
+
+    tx, report = asyncio.run(main())
+    line = [line for line in tx.splitlines() if line[:3] == 'tx '][0]
+    sent = dict(field.split('=') for field in line.split()[1:])
+    rx = stats(report)
+    assert int(sent['sent']) > 10
+    assert sent['acked'] == sent['sent'] and sent['failed'] == '0'
+    assert rx['peer'] == 'BUTTON-02AD9A-WAY'
+    assert rx['received'] == sent['sent']
+    assert rx['lost'] == rx['reordered'] == rx['duplicates'] == '0'
+    assert int(rx['goodput_kbps']) > 0 and int(rx['jitter_us']) >= 0
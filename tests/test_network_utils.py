@@ -0,0 +1,16 @@
+import types
+
+from fildz_cyberos.network_utils import _APPixel
+
+
+def test_deprecated_ap_pixel_event_drives_the_feedback_pattern(cyberos):
+    patterns = []
+    cyberos.feedback = types.SimpleNamespace(pattern=lambda steps, color=None: patterns.append((steps, color)))
+    cyberos.cyberware = types.SimpleNamespace(pixel=types.SimpleNamespace(C_BLANK=0, C_GREEN=2))
+    cyberos.network = types.SimpleNamespace(ap_color=(3, 4, 5))
+    pixel = _APPixel()
+    pixel.clear()
+    pixel.set()
+    pixel.set()
+    pixel.clear()
+    assert patterns == [(((3, 500), (0, 500), (4, 500), (0, 500), (5, 500), (0, 1500)), None), (None, 2)]
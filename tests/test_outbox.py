@@ -0,0 +1,80 @@
+import asyncio
+import types
+
+from fildz_cyberos import outbox as module
+from fildz_cyberos.outbox import Outbox, _SYNCED
+from fildz_cyberos.clock import Clock
+from fildz_cyberos.listener import Listener
+from fildz_cyberos.transmitter import Transmitter
+
+MAC = b'\x02\x00\x00\x00\x00\x0a'
+PEER = 'DISPLAY-0F889A-ABW'
+
+
+class Transport:
+    def __init__(self):
+        self.online = False
+        self.frames = []
+
+    async def asend(self, mac, frame, sync=True):
+        if self.online:
+            self.frames.append(bytes(frame))
+        return self.online
+
+
+# Stored frames are sent by the transmitter, call it from a running event loop.
+def outbox(cyberos, tmp_path, transport):
+    cyberos.preferences.update(outbox=True, outbox_size=8192, outbox_ttl_s=60, outbox_pace_ms=0, outbox_probe_ms=50,
+                               tx_queue=4, tx_inflight=1, tx_pace_ms=0)
+    cyberos.settings = types.SimpleNamespace(_CONFIG_DIR=str(tmp_path))
+    cyberos.cyberwares['subscribed'][PEER] = {'mac': MAC, 'events': {}}
+    cyberos.event = types.SimpleNamespace(CONTROL_EVENTS=Listener.CONTROL_EVENTS, transport=lambda cyberware: transport)
+    cyberos.clock = clock = types.SimpleNamespace(enabled=True, option=lambda: bytes((0x85, 4, 9, 9, 9, 9)))
+    clock.restamp = lambda frame: Clock.restamp(clock, frame)
+    cyberos.tx = Transmitter()
+    cyberos.outbox = box = Outbox()
+    return box
+
+
+def test_silent_peer_is_probed_and_drained_in_order(cyberos, tmp_path):
+    transport = Transport()
+    long = b'\x07' + b'x' * 299  # Longer than 255 bytes, like UDP frames.
+    stamped = bytes((0x85, 4, 1, 1, 1, 1)) + b'\x07short'
+
+    async def main():
+        box = outbox(cyberos, tmp_path, transport)
+        box.store(PEER, long)
+        box.store(PEER, stamped)
+        await asyncio.sleep(0.02)
+        assert (tmp_path / 'outbox' / PEER).exists()  # Written by the outbox task, not by store().
+        assert PEER in box.offline
+        await asyncio.sleep(0.07)  # Probed while still offline, nothing is lost nor stored again.
+        assert box.sent == 0 and box.stored == 2
+        assert cyberos.metrics.counters['tx_failed'] >= 1
+        transport.online = True  # Receive-only peer, it never sends us anything.
+        await asyncio.sleep(0.1)
+        return box
+
+    box = asyncio.run(main())
+    assert transport.frames == [long, bytes((0x85, 4, 9, 9, 9, 9)) + b'\x07short']  # Restamped on replay.
+    assert box.sent == box.stored == 2
+    assert PEER not in box.offline
+    assert not (tmp_path / 'outbox' / PEER).exists()
+
+
+def test_ttl_only_applies_to_known_ages(cyberos, tmp_path, monkeypatch):
+    async def main():
+        return outbox(cyberos, tmp_path, Transport())
+
+    box = asyncio.run(main())
+    other_boot = (box._boot + 1) & 0xFFFF
+
+    monkeypatch.setattr(module, 'time', lambda: _SYNCED + 1000)
+    assert box._expired_record(_SYNCED, other_boot)  # RTC set before and now.
+    assert not box._expired_record(_SYNCED + 990, other_boot)
+    assert not box._expired_record(100, box._boot)  # RTC set since the record was stored.
+
+    monkeypatch.setattr(module, 'time', lambda: 1000)
+    assert box._expired_record(100, box._boot)  # RTC not set, same boot.
+    assert not box._expired_record(100, other_boot)  # RTC not set, earlier boot.
+    assert not box._expired_record(5000, other_boot)
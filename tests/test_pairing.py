@@ -0,0 +1,29 @@
+import asyncio
+import types
+
+from uasyncio import Event
+
+from fildz_cyberos.pairing import Pairing
+
+PEER = 'BUTTON-02AD9A-WAY'
+
+
+def test_peer_ids_are_taken_from_the_waiter(cyberos):
+    indexed = []
+
+    async def subscribe(name):
+        assert name == 'on_peer_id'
+        yield PEER, name, [b'\x07', 'on_click', '', 'on_hold']
+        cyberos.event.sender, cyberos.event.args = 'OTHER', []  # Listener moved on, the waiter has the event.
+
+    cyberos.cyberwares['subscribed'][PEER] = {'mac': b'\x02\x00\x00\x00\x00\x0b', 'events': {}}
+    cyberos.event = types.SimpleNamespace(subscribe=subscribe, index_subscribers=lambda: indexed.append(True))
+    cyberos.settings = types.SimpleNamespace(on_save_cyberwares=Event())
+    pairing = Pairing.__new__(Pairing)
+    pairing._on_pair = Event()
+    pairing._on_peer_id = Event()
+
+    asyncio.run(pairing._event_peer_id())
+    assert cyberos.cyberwares['subscribed'][PEER]['tx_id'] == 7
+    assert cyberos.cyberwares['subscribed'][PEER]['tx_names'] == {'on_click': 0, 'on_hold': 2}
+    assert indexed
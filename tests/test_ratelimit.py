@@ -0,0 +1,40 @@
+import types
+
+from fildz_cyberos import ratelimit as module
+from fildz_cyberos.ratelimit import RateLimit
+
+
+def ratelimit(cyberos):
+    cyberos.preferences.update(rl=True, rl_rate=1, rl_burst=1, rl_block_ms=1000, rl_block_after=1)
+    return RateLimit()
+
+
+def test_full_event_buckets_evict_the_oldest_sender(cyberos, monkeypatch):
+    now = [0]
+    monkeypatch.setattr(module, 'ticks_ms', lambda: now[0])
+    cyberos.event = types.SimpleNamespace(raw_name=lambda event: b'on_temp')
+    limiter = ratelimit(cyberos)
+    limiter._rate, limiter._burst = 1000, 1000  # Only the event limit applies.
+    limiter.limit('on_temp', 0, 1)
+    for sender in range(RateLimit._SENDERS):
+        now[0] += 1
+        assert limiter.check(bytes((sender,)), b'')
+    now[0] += 1
+    assert limiter.check(b'\xff', b'')  # Table is full, the oldest sender gives way.
+    assert (b'\x00', b'on_temp') not in limiter._event_buckets
+    assert not limiter.check(b'\x01', b'')  # Others keep their spent budget.
+
+
+def test_expired_senders_make_room_in_the_blocklist(cyberos, monkeypatch):
+    now = [0]
+    monkeypatch.setattr(module, 'ticks_ms', lambda: now[0])
+    limiter = ratelimit(cyberos)
+    for sender in range(RateLimit._BLOCKLIST):
+        mac = bytes((sender,))
+        limiter.check(mac, b'')
+        limiter.check(mac, b'')  # Bucket is empty, blocklisted.
+    assert len(limiter.blocked) == RateLimit._BLOCKLIST
+    now[0] += 2000
+    limiter.check(b'\xff', b'')
+    limiter.check(b'\xff', b'')
+    assert list(limiter.blocked) == [b'\xff']
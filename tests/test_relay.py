@@ -0,0 +1,163 @@
+import asyncio
+import random
+import types
+
+from fildz_cyberos.relay import Relay
+from fildz_cyberos.transmitter import Transmitter
+from fildz_cyberos.listener import Listener, OPT_RELAY
+
+PUBLIC = b'\xff' * 6
+_AIR_US = 8  # Airtime per byte at 1 Mbit/s.
+_OVERHEAD = 50  # Bytes of the radio frame around our payload.
+
+
+################################################################################
+# Multi-room simulation
+#
+# Cyberwares in a row of rooms hear the cyberwares of their own and the neighbouring rooms. Cyberwares of the
+# first room send to the cyberwares of the last room, which reply so routes are learned, then send again.
+# Every cyberware runs its own Relay, "python -m pytest -q -s tests/test_relay.py" prints the report.
+# Lost unicast frames are not retried here as they are by ESP-NOW, routed delivery with loss is a lower bound.
+class Node:
+    def __init__(self, cyberos, room, index):
+        self.name = 'NODE-%d-%d' % (room, index)
+        self.room = room
+        self.mac = bytes((2, 0, 0, 0, room, index))
+        self.cyberware = types.SimpleNamespace(mac_private=self.mac, mac_public=PUBLIC)
+        self.cyberos = cyberos
+        self.air = None
+        self.relay = self.use(Relay)
+
+    # Relay and the frames it sends see the cyberos globals of this cyberware.
+    def use(self, func, *args):
+        self.cyberos.cyberware = self.cyberware
+        self.cyberos.event = self
+        return func(*args)
+
+    async def asend(self, mac, frame, cyberware, event_name, sync=True):
+        self.air.send(self, mac, bytes(frame))
+
+
+class Air:
+    def __init__(self, nodes, loss):
+        self.nodes = nodes
+        self.loss = loss
+        self.frames = []  # Frames in the air as (sender, MAC, frame).
+        self.transmissions = 0
+        self.airtime_us = 0
+
+    def send(self, sender, mac, frame):
+        self.transmissions += 1
+        self.airtime_us += (len(frame) + _OVERHEAD) * _AIR_US
+        self.frames.append((sender, mac, frame))
+
+    # Deliver the frames until the air is quiet, returns hops taken to the receiver or None.
+    async def run(self, receiver):
+        hops = None
+        while len(self.frames):
+            sender, mac, frame = self.frames.pop(0)
+            for node in self.nodes:
+                if node is sender or abs(node.room - sender.room) > 1 or mac not in (PUBLIC, node.mac) \
+                        or random.random() < self.loss:
+                    continue
+                option = frame[2:2 + frame[1]]
+                origin = frame[3 + frame[1]:3 + frame[1] + frame[2 + frame[1]]].decode()
+                to = frame[3 + frame[1] + len(origin):].decode()
+                if not node.use(node.relay.receive, option, origin, sender.mac):
+                    continue  # Duplicate.
+                if to == node.name:
+                    hops = option[1] if hops is None else min(hops, option[1])
+                else:
+                    await node.use(node.relay.forward, frame, option, to)
+        return hops
+
+
+async def originate(node, receiver):
+    option = node.use(node.relay.option)
+    mac = node.use(node.relay.next_hop, receiver.name)
+    origin = node.name.encode()
+    await node.asend(mac, option + bytes((len(origin),)) + origin + receiver.name.encode(), receiver.name, 'on_x')
+
+
+def simulate(cyberos, rooms=4, per_room=3, ttl=3, loss=0.0, seed=1):
+    random.seed(seed)
+    cyberos.preferences.update(relay=True, relay_ttl=ttl)
+    nodes = [Node(cyberos, room, index) for room in range(rooms) for index in range(per_room)]
+    air = Air(nodes, loss)
+    for node in nodes:
+        node.air = air
+    first = [node for node in nodes if node.room == 0]
+    last = [node for node in nodes if node.room == rooms - 1]
+    report = {}
+
+    async def main():
+        for phase in ('flooded', 'reply', 'routed'):
+            delivered = hops = transmissions = airtime_us = 0
+            for a in first:
+                for b in last:
+                    sender, receiver = (b, a) if phase == 'reply' else (a, b)
+                    air.transmissions = air.airtime_us = 0
+                    await originate(sender, receiver)
+                    taken = await air.run(receiver.name)
+                    if taken is not None:
+                        delivered += 1
+                        hops += taken
+                    transmissions += air.transmissions
+                    airtime_us += air.airtime_us
+            events = len(first) * len(last)
+            report[phase] = (delivered / events, hops / delivered if delivered else 0, transmissions / events,
+                             airtime_us / events)
+
+    asyncio.run(main())
+    return report
+
+
+def test_relay_simulation_report(cyberos):
+    print('\nrooms ttl loss  phase    delivered  hops  frames  airtime_us')
+    for rooms, ttl, loss in ((4, 2, 0.0), (4, 3, 0.0), (4, 5, 0.0), (4, 3, 0.1), (6, 5, 0.1)):
+        report = simulate(cyberos, rooms=rooms, ttl=ttl, loss=loss)
+        for phase in ('flooded', 'routed'):
+            rate, hops, frames, airtime_us = report[phase]
+            print('{:5} {:3} {:4}  {:8} {:8.0%} {:5.1f} {:7.1f} {:11.0f}'.format(
+                rooms, ttl, loss, phase, rate, hops, frames, airtime_us))
+
+    # Rooms at the far end are out of reach with too low a hop limit.
+    assert simulate(cyberos, rooms=4, ttl=2)['flooded'][0] == 0
+    report = simulate(cyberos, rooms=4, ttl=3)
+    assert report['flooded'][0] == report['routed'][0] == 1
+    assert report['flooded'][1] == report['routed'][1] == 2  # Hops taken: two relays in between.
+    # Learned routes cost a frame per hop instead of a frame per cyberware in reach.
+    assert report['routed'][2] == 3 < report['flooded'][2]
+
+
+################################################################################
+# Direct frames to paired cyberwares
+#
+def test_paired_cyberware_is_relayed_to_after_a_missed_frame(cyberos):
+    peer = 'DISPLAY-0F889A-ABW'
+    mac = b'\x02\x00\x00\x00\x00\x0a'
+    sent = []
+
+    class Transport:
+        async def asend(self, to, frame, sync=True):
+            sent.append((to, bytes(frame)))
+            return to != mac  # Out of range.
+
+    cyberos.preferences.update(relay=True, relay_ttl=3, tx_queue=4, tx_inflight=1, tx_pace_ms=0)
+    cyberos.cyberwares['subscribed'][peer] = {'mac': mac}
+    cyberos.cyberware = types.SimpleNamespace(mac_private=b'\x02\x00\x00\x00\x00\x01', mac_public=PUBLIC)
+    cyberos.event = types.SimpleNamespace(CONTROL_EVENTS=Listener.CONTROL_EVENTS, transport=lambda name: Transport())
+    cyberos.relay = relay = Relay()
+    assert relay.direct(peer) and not relay.direct('@kitchen') and not relay.direct('BUTTON-0F889A-ABW')
+
+    async def main():
+        tx = Transmitter()
+        completion = await tx.submit(mac, b'\x04NODE\x00\x04on_x', peer, 'on_x')
+        return await completion.wait()
+
+    assert asyncio.run(main()) is True
+    assert sent[0] == (mac, b'\x04NODE\x00\x04on_x')
+    assert sent[1][0] == PUBLIC and sent[1][1][0] == OPT_RELAY and sent[1][1][9:] == sent[0][1]
+    assert not relay.direct(peer)
+    relay.heard(peer)
+    assert relay.direct(peer)
@@ -0,0 +1,31 @@
+import pytest
+
+from fildz_cyberos.listener import MAX_FRAME
+from fildz_cyberos.schema import Schema
+
+
+def test_pack_and_unpack_round_trip():
+    schema = Schema(('int16', 'uint8', 'float', 'bool', 'str', 'bytes'))
+    data = schema.pack((-300, 200, 0.5, True, 'ü°C', b'\x00\xff'))
+    assert len(data) == 2 + 1 + 4 + 1 + 1 + 5 + 1 + 2  # Text is sized in UTF-8 bytes.
+    assert schema.unpack(data) == [-300, 200, 0.5, True, 'ü°C', b'\x00\xff']
+    text = Schema(('str',))
+    assert text.unpack(text.pack(('',))) == ['']
+
+
+def test_unknown_field_types_and_arg_counts():
+    with pytest.raises(ValueError):
+        Schema(('int64',))
+    with pytest.raises(ValueError):
+        Schema(('int8', 'str')).pack((1,))
+
+
+def test_pack_limits():
+    schema = Schema(('str', 'bytes'))
+    with pytest.raises(ValueError, match='at most 255'):
+        schema.pack(('ü' * 128, b''))  # 128 characters, 256 bytes.
+    with pytest.raises(ValueError, match='at most 255'):
+        schema.pack(('', bytes(256)))
+    with pytest.raises(ValueError, match='at most %d' % MAX_FRAME):  # Each arg fits, the frame does not.
+        schema.pack(('x' * 200, bytes(100)))
+    assert len(schema.pack(('x' * 200, bytes(MAX_FRAME - 202)))) == MAX_FRAME
@@ -0,0 +1,77 @@
+import asyncio
+
+from fildz_cyberos.transport import Loopback
+
+A = b'\x02\x00\x00\x00\x00\x0a'
+B = b'\x02\x00\x00\x00\x00\x0b'
+C = b'\x02\x00\x00\x00\x00\x0c'
+PUBLIC = b'\x02\x00\x00\x00\x00\xff'
+
+
+def test_loopback_unicast(cyberos):
+    async def main():
+        air = []
+        a, b, c = Loopback(A, air, PUBLIC), Loopback(B, air, PUBLIC), Loopback(C, air, PUBLIC)
+        assert await a.asend(B, b'hello') is True
+        assert await asyncio.wait_for(b.__anext__(), 1) == (A, b'hello')
+        assert not len(c._frames)
+        assert await a.asend(b'\x02\x00\x00\x00\x00\x00', b'nobody') is False
+
+    asyncio.run(main())
+
+
+def test_loopback_public_reaches_every_other_endpoint(cyberos):
+    async def main():
+        air = []
+        a, b, c = Loopback(A, air, PUBLIC), Loopback(B, air, PUBLIC), Loopback(C, air, PUBLIC)
+        assert await a.asend(PUBLIC, b'all', sync=False) is True
+        assert await b.__anext__() == (A, b'all')
+        assert await c.__anext__() == (A, b'all')
+        assert not len(a._frames)
+
+    asyncio.run(main())
+
+
+def test_loopback_loss_and_delay(cyberos):
+    async def main():
+        air = []
+        a, b = Loopback(A, air), Loopback(B, air, loss=1)
+        assert await a.asend(B, b'lost') is False
+        assert b.lost == 1
+
+        air = []
+        a, b = Loopback(A, air), Loopback(B, air, delay_ms=50)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await a.asend(B, b'late')
+        assert await b.__anext__() == (A, b'late')
+        assert loop.time() - start >= 0.04
+
+    asyncio.run(main())
+
+
+def test_listeners_exchange_paired_events_over_loopback():
+    from conftest import stack, pair
+
+    received = []
+
+    async def main():
+        air = []
+        sensor = stack('SENSOR-0F889A-ABW', A, air)
+        display = stack('DISPLAY-0F889A-ABW', B, air)
+        pair(sensor, display)
+        display.cyberwares['subscribed']['SENSOR-0F889A-ABW']['events']['on_temp'] = \
+            lambda: received.append((display.event.sender, display.event.name, list(display.event.args)))
+
+        temps = display.event.subscribe('SENSOR-0F889A-ABW', 'on_temp')
+        reply = sensor.event.subscribe('DISPLAY-0F889A-ABW', 'on_ack')
+        ok = await (await sensor.event.send('on_temp', '21.5', 'ü', cyberware='DISPLAY-0F889A-ABW'))
+        sender, name, args = await temps.get(1000)
+        await display.event.send('on_ack', args[0], cyberware='SENSOR-0F889A-ABW')
+        return ok, args, await reply.get(1000)
+
+    ok, args, reply = asyncio.run(main())
+    assert ok is True
+    assert args == ['21.5', 'ü']
+    assert received == [('SENSOR-0F889A-ABW', 'on_temp', ['21.5', 'ü'])]
+    assert reply == ('DISPLAY-0F889A-ABW', 'on_ack', ['21.5'])
@@ -0,0 +1,169 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS TRANSMITTER
+#
+# Single TX scheduler fed by a bounded queue with an in-flight window and completion handles.
+
+import uasyncio as asyncio
+from uasyncio import Event
+from utime import ticks_ms, ticks_diff
+import fildz_cyberos as cyberos
+from .monitor import create_task
+from .listener import LANE_CONTROL, LANE_DATA
+
+
+# Awaitable delivery result of a queued frame, e.g. "ok = await (await cyberos.event.send('on_x', cyberware=X))".
+class Completion:
+    def __init__(self):
+        self._on_done = Event()
+        self._result = None
+
+    @property
+    def done(self):
+        return self._on_done.is_set()
+
+    # True once delivered, False if not acknowledged, OSError if it failed to send.
+    @property
+    def result(self):
+        return self._result
+
+    def _complete(self, result):
+        self._result = result
+        self._on_done.set()
+
+    async def wait(self):
+        await self._on_done.wait()
+        return self._result
+
+    # MicroPython coroutines are generators and iterate as they are, CPython ones are iterated via __await__().
+    def __iter__(self):
+        wait = self.wait()
+        return wait.__await__() if hasattr(wait, '__await__') else wait
+
+    __await__ = __iter__
+
+
+class Transmitter:
+    def __init__(self):
+        self._queue_size = cyberos.preferences['tx_queue']  # Frames queued per lane.
+        self._inflight = cyberos.preferences['tx_inflight']  # Frames sent at the same time.
+        self._pace_ms = cyberos.preferences['tx_pace_ms']  # Minimal time between frames to the same peer.
+
+        # Queued frames as (MAC, frame, cyberware, event name, sync, completion) per lane.
+        self._lanes = ([], [])
+        self._busy = set()  # Peer MACs with a frame in flight, frames to a peer are sent in order.
+        self._last = {}  # Peer MAC to ticks_ms() of the last frame sent to it.
+        self._on_tx = Event()  # Frames are waiting in the lanes.
+        self._on_space = Event()  # Data lane has room.
+        self._on_space.set()
+
+        for worker in range(self._inflight):
+            create_task(self._event_tx(), 'transmitter.tx')
+
+    ################################################################################
+    # Properties
+    #
+    @property
+    def queued(self):
+        return len(self._lanes[LANE_CONTROL]) + len(self._lanes[LANE_DATA])
+
+    @property
+    def inflight(self):
+        return len(self._busy)
+
+    # Takes effect on the next reboot.
+    @property
+    def pace_ms(self):
+        return self._pace_ms
+
+    @pace_ms.setter
+    def pace_ms(self, value):
+        self._pace_ms = value
+        cyberos.preferences['tx_pace_ms'] = value
+        cyberos.settings.on_save_settings.set()
+
+    ################################################################################
+    # Queue
+    #
+    # Queue the frame and return its completion handle, application frames wait for room in the queue.
+    async def submit(self, mac, event, cyberware, event_name, sync=True):
+        lane = LANE_CONTROL if event_name in cyberos.event.CONTROL_EVENTS else LANE_DATA
+        if lane == LANE_DATA and sync and cyberos.outbox.enabled and event_name != 'outbox' \
+                and cyberware in cyberos.outbox.offline:
+            # Cyberware is offline, the frame waits in the outbox behind its backlog, which is sent as 'outbox'.
+            completion = Completion()
+            completion._complete(False)
+            cyberos.outbox.store(cyberware, event)
+            return completion
+        while len(self._lanes[lane]) >= self._queue_size:
+            if lane == LANE_CONTROL:
+                # Control lane never blocks, the oldest control frame gives way.
+                self._lanes[lane].pop(0)[5]._complete(False)
+                break
+            self._on_space.clear()
+            await self._on_space.wait()
+        completion = Completion()
+        self._lanes[lane].append((mac, event, cyberware, event_name, sync, completion))
+        self._on_tx.set()
+        return completion
+
+    # Next frame to a peer that has no frame in flight, control lane first.
+    def _next(self):
+        for lane in self._lanes:
+            for i in range(len(lane)):
+                if lane[i][0] not in self._busy:
+                    return lane.pop(i)
+        return None
+
+    ################################################################################
+    # Tasks
+    #
+    async def _event_tx(self):
+        while True:
+            await self._on_tx.wait()
+            item = self._next()
+            if item is None:
+                self._on_tx.clear()
+                continue
+            if len(self._lanes[LANE_DATA]) < self._queue_size:
+                self._on_space.set()
+            mac, event, cyberware, event_name, sync, completion = item
+            self._busy.add(mac)
+            try:
+                if self._pace_ms and mac in self._last:
+                    wait = self._pace_ms - ticks_diff(ticks_ms(), self._last[mac])
+                    if wait > 0:
+                        await asyncio.sleep_ms(wait)
+                if cyberos.clock.enabled and event_name != 'relay':
+                    cyberos.clock.restamp(event)  # Relayed frames keep the time of their origin.
+                result = await cyberos.event.transport(cyberware).asend(mac, event, sync)
+            except OSError as exc:
+                if cyberos.metrics.enabled:
+                    cyberos.metrics.inc('tx_errors')
+                result = exc
+            finally:
+                self._busy.discard(mac)
+                if self._pace_ms:
+                    self._last[mac] = ticks_ms()
+            if cyberos.metrics.enabled:
+                cyberos.metrics.tx(cyberware, event_name, result is not False and not isinstance(result, OSError))
+            if result is not True and sync and cyberos.relay.enabled and event_name != 'relay' \
+                    and mac == cyberos.cyberwares['subscribed'].get(cyberware, {}).get('mac'):
+                # Paired cyberware is out of range, relay the frame instead.
+                frame = cyberos.relay.reroute(cyberware, event)
+                if frame is not None:
+                    lane = LANE_CONTROL if event_name in cyberos.event.CONTROL_EVENTS else LANE_DATA
+                    self._lanes[lane].append((cyberos.relay.next_hop(cyberware), frame, cyberware, event_name, sync,
+                                              completion))
+                    self._on_tx.set()
+                    continue
+            if result is not True and sync and cyberos.outbox.enabled and event_name not in ('relay', 'outbox') \
+                    and event_name not in cyberos.event.CONTROL_EVENTS \
+                    and cyberware in cyberos.cyberwares['subscribed']:
+                # Cyberware did not acknowledge the frame, keep it until the cyberware is seen again.
+                cyberos.outbox.store(cyberware, event)
+            completion._complete(result)
+            if len(self._lanes[LANE_CONTROL]) or len(self._lanes[LANE_DATA]):
+                self._on_tx.set()  # Frames to a busy peer can go now.
@@ -0,0 +1,178 @@
+# The MIT License (MIT)
+# Copyright (c) 2023 Edgaras Janušauskas and Inovatorius MB (www.fildz.com)
+
+################################################################################
+# FILDZ CYBEROS TRANSPORT
+#
+# Frame transports of the listener: ESP-NOW, UDP multicast over STA and an in-memory loopback.
+
+# A transport is iterated for received (sender MAC, frame) and sends frames with "await asend(mac, frame, sync)".
+# Frames, addresses (MAC) and dispatch are the same on every transport.
+
+import usocket as socket
+import uasyncio as asyncio
+from uasyncio import Event
+from ucollections import deque
+from utime import ticks_ms, ticks_diff, ticks_add
+from random import getrandbits
+import fildz_cyberos as cyberos
+from .listener import MAX_FRAME
+
+
+class ESPNow:
+    name = 'espnow'
+    max_frame = MAX_FRAME
+
+    def __init__(self, espnow):
+        self._espnow = espnow
+
+    def __aiter__(self):
+        return self._espnow.__aiter__()
+
+    async def asend(self, mac, frame, sync=True):
+        if cyberos.peers.enabled:
+            cyberos.peers.ensure(mac)
+        return await self._espnow.asend(mac, frame, sync=sync)
+
+
+# UDP datagrams carry the receiver and the sender MAC before the frame, so cyberwares sharing the Wi-Fi network
+# address each other exactly as over ESP-NOW. There are no acknowledgements, sync sends are True once sent.
+class UDP:
+    name = 'udp'
+    max_frame = 1024  # Args are still limited to 255 bytes each.
+    _HEADER_SIZE = 12
+
+    def __init__(self):
+        self._group = cyberos.preferences['udp_group']
+        self._port = cyberos.preferences['udp_port']
+        self._mac = cyberos.cyberware.mac_private
+        self._sock = None
+        self._reader = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def _open(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('0.0.0.0', self._port))
+        # Join the multicast group on the STA interface.
+        mreq = bytes(int(x) for x in self._group.split('.')) + bytes(int(x) for x in cyberos.network.sta_ip.split('.'))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setblocking(False)
+        self._sock = sock
+        self._reader = asyncio.StreamReader(sock)
+        print('CYBEROS > UDP transport on {}:{}'.format(self._group, self._port))
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._reader = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self._sock is None:
+                await cyberos.network.on_sta_connected.wait()
+                try:
+                    self._open()
+                except OSError as e:
+                    print('CYBEROS > UDP transport failed:', e)
+                    self._close()
+                    await asyncio.sleep(1)
+                    continue
+            try:
+                data = await self._reader.read(self._HEADER_SIZE + self.max_frame)
+            except OSError:
+                self._close()
+                continue
+            if len(data) <= self._HEADER_SIZE or data[6:12] == self._mac:
+                continue  # Our own multicast looped back.
+            receiver = data[:6]
+            if receiver != self._mac and receiver != cyberos.cyberware.mac_public:
+                continue
+            return data[6:12], memoryview(data)[self._HEADER_SIZE:]
+
+    async def asend(self, mac, frame, sync=True):
+        if self._sock is None or not cyberos.network.on_sta_connected.is_set():
+            return False
+        try:
+            self._sock.sendto(mac + self._mac + frame, (self._group, self._port))
+        except OSError:
+            return False
+        return True
+
+
+# Stand-in for the radio without any hardware or network, so the stack runs on a host (CPython or the MicroPython
+# unix port) for tests and benchmarks. Endpoints sharing the same air list reach each other by their MAC or the
+# shared public MAC, frames can be lost and delayed on the way, e.g.
+# "air = []; a = Loopback(b'\x02\x00\x00\x00\x00\x01', air, loss=0.1, delay_ms=5)".
+# tests/test_transport.py pairs two Listeners over it, see stack() in tests/conftest.py.
+class Loopback:
+    name = 'loopback'
+    max_frame = MAX_FRAME
+    _QUEUE = 32  # Frames queued per endpoint, the oldest frame is lost once full.
+
+    def __init__(self, mac, air, public=None, loss=0, delay_ms=0):
+        self._mac = bytes(mac)
+        self._addresses = (self._mac,) if public is None else (self._mac, bytes(public))
+        self._air = air  # Endpoints sharing the medium.
+        self._loss = int(loss * 0x10000)  # Chance the frame is lost, out of 0x10000.
+        self._delay_ms = delay_ms
+        self._frames = deque((), self._QUEUE)  # Received frames as (due ticks_ms(), sender MAC, frame).
+        self._on_frame = Event()
+        self._sent = 0
+        self._lost = 0
+        air.append(self)
+
+    @property
+    def mac(self):
+        return self._mac
+
+    @property
+    def sent(self):
+        return self._sent
+
+    # Frames lost on the way to this endpoint.
+    @property
+    def lost(self):
+        return self._lost
+
+    def _put(self, sender, frame):
+        if self._loss and getrandbits(16) < self._loss:
+            self._lost += 1
+            return False
+        if len(self._frames) == self._QUEUE:
+            self._lost += 1
+        self._frames.append((ticks_add(ticks_ms(), self._delay_ms), sender, frame))
+        self._on_frame.set()
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not len(self._frames):
+            self._on_frame.clear()
+            await self._on_frame.wait()
+        due, sender, frame = self._frames.popleft()
+        wait = ticks_diff(due, ticks_ms())
+        if wait > 0:
+            await asyncio.sleep_ms(wait)
+        return sender, frame
+
+    # Sync sends are True once any endpoint the frame is addressed to got it, like an ESP-NOW acknowledgement.
+    async def asend(self, mac, frame, sync=True):
+        mac = bytes(mac)
+        frame = bytes(frame)
+        self._sent += 1
+        delivered = False
+        for endpoint in self._air:
+            if endpoint is not self and mac in endpoint._addresses and endpoint._put(self._mac, frame):
+                delivered = True
+        await asyncio.sleep(0)
+        return delivered